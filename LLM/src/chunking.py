@@ -0,0 +1,146 @@
+"""Découpage du markdown enrichi par pertinence pour l'extraction.
+
+Le markdown est découpé en sections selon ses titres ; chaque section reçoit un score
+de pertinence pour chaque section du schéma (produit, risque, dates, performance,
+coûts...) à partir de mots-clés. L'extraction peut alors envoyer au LLM, pour chaque
+groupe de champs, uniquement les sections pertinentes dans un budget de tokens, au lieu
+du document entier.
+"""
+
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List
+
+HEADING_PATTERN = re.compile(r"^#{1,6}\s+(.*)$", re.MULTILINE)
+
+# Mots-clés (sans accents, en minuscules) des sections habituelles du schéma
+GROUP_KEYWORDS = {
+    "product": ["produit", "nom du produit", "isin", "devise", "initiateur", "emetteur", "objectif",
+                "sous-jacent", "type", "investisseurs de detail", "description"],
+    "document": ["document d'informations cles", "objet", "date de production", "version",
+                 "document", "informations cles"],
+    "risk": ["risque", "indicateur", "echelle", "srri", "sri", "perte", "classe",
+             "avertissement", "niveau de risque", "credit", "liquidite"],
+    "dates": ["date", "echeance", "emission", "remboursement", "constatation",
+              "valorisation", "maturite", "periode de detention"],
+    "performance": ["scenario", "performance", "tensions", "defavorable", "intermediaire",
+                    "favorable", "rendement", "montant", "investissement", "vous pourriez obtenir"],
+    "costs": ["cout", "frais", "commission", "incidence", "ponctuel", "recurrent",
+              "entree", "sortie", "transaction"],
+}
+# Les coûts sont rangés sous performance dans le schéma
+GROUP_ALIASES = {"performance": ["performance", "costs"]}
+# Un mot-clé dans un titre compte autant que HEADING_WEIGHT occurrences dans le texte
+HEADING_WEIGHT = 5
+
+
+@dataclass
+class Section:
+    """Section du markdown : son titre et son texte complet (titre inclus)."""
+    title: str
+    text: str
+    index: int
+
+
+def normalize(text: str) -> str:
+    """Minuscules sans accents, pour une recherche de mots-clés tolérante."""
+    decomposed = unicodedata.normalize("NFKD", text.lower())
+    return "".join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def split_sections(markdown: str, max_chars: int = 6000) -> List[Section]:
+    """Découpe le markdown par titres ; les sections trop longues sont coupées par paragraphes."""
+    starts = [match.start() for match in HEADING_PATTERN.finditer(markdown)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = zip(starts, starts[1:] + [len(markdown)])
+
+    sections = []
+    for start, end in bounds:
+        text = markdown[start:end].strip()
+        if not text:
+            continue
+        heading = HEADING_PATTERN.match(text)
+        title = heading.group(1).strip() if heading else ""
+        for piece in _split_long(text, max_chars):
+            sections.append(Section(title, piece, len(sections)))
+    return sections
+
+
+def _split_long(text: str, max_chars: int) -> List[str]:
+    if len(text) <= max_chars:
+        return [text]
+    pieces, current = [], ""
+    for paragraph in text.split("\n\n"):
+        if current and len(current) + len(paragraph) + 2 > max_chars:
+            pieces.append(current)
+            current = ""
+        current = f"{current}\n\n{paragraph}" if current else paragraph
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def group_keywords(group: str, template: Any) -> List[str]:
+    """Mots-clés d'une section du schéma : les mots connus, sinon les noms de ses champs."""
+    keywords = []
+    for alias in GROUP_ALIASES.get(group, [group]):
+        keywords.extend(GROUP_KEYWORDS.get(alias, []))
+    if not keywords:
+        keywords.append(normalize(group))
+        if isinstance(template, dict):
+            for field in template:
+                keywords.extend(
+                    word for word in re.split(r"[_\W]+|(?<=[a-z])(?=[A-Z])", field)
+                    if len(word) > 2
+                )
+        keywords = [normalize(keyword) for keyword in keywords]
+    return keywords
+
+
+def score_section(section: Section, keywords: List[str]) -> float:
+    """Nombre d'occurrences des mots-clés, celles du titre étant pondérées."""
+    title = normalize(section.title)
+    body = normalize(section.text)
+    return sum(body.count(keyword) + HEADING_WEIGHT * title.count(keyword) for keyword in keywords)
+
+
+def select_sections(sections: List[Section], keywords: List[str], budget: int,
+                    count_tokens: Callable[[str], int]) -> List[Section]:
+    """Sections pertinentes les mieux notées tenant dans le budget, dans l'ordre du document."""
+    scored = [(score_section(section, keywords), section) for section in sections]
+    selected, used = [], 0
+    for score, section in sorted(scored, key=lambda item: -item[0]):
+        if score <= 0:
+            break
+        tokens = count_tokens(section.text)
+        if used + tokens > budget:
+            continue
+        selected.append(section)
+        used += tokens
+    return sorted(selected, key=lambda section: section.index)
+
+
+def empty_value(template: Any) -> Any:
+    """Valeur vide d'un champ du schéma, pour un groupe sans section pertinente."""
+    if isinstance(template, dict):
+        return {key: empty_value(value) for key, value in template.items()}
+    if isinstance(template, list):
+        return []
+    # Nombre absent : null, comme le produit la grammaire
+    return None if template in ("float", "int") else ""
+
+
+def join_sections(sections: List[Section]) -> str:
+    return "\n\n".join(section.text for section in sections)
+
+
+def plan_groups(markdown: str, schema: Dict[str, Any], budget: int,
+                count_tokens: Callable[[str], int]) -> Dict[str, str]:
+    """Texte à envoyer au LLM pour chaque section du schéma ("" si rien n'est pertinent)."""
+    sections = split_sections(markdown)
+    return {
+        group: join_sections(select_sections(sections, group_keywords(group, template), budget, count_tokens))
+        for group, template in schema.items()
+    }
@@ -0,0 +1,73 @@
+"""Suivi incrémental d'un objet JSON généré token par token.
+
+Le parser suit la profondeur des accolades et crochets (hors chaînes) du texte reçu
+au fil du streaming. Il signale chaque membre de premier niveau terminé
+("product", "risk", ...) dès sa virgule ou l'accolade fermante, et l'instant où
+l'objet racine est complet.
+"""
+
+import json
+from typing import Any, List, Optional, Tuple
+
+
+class JSONStreamParser:
+    """Découpe les membres de premier niveau d'un objet JSON reçu par morceaux."""
+
+    def __init__(self):
+        self.text = ""
+        self.depth = 0
+        self.in_string = False
+        self.escape = False
+        self.member_start: Optional[int] = None
+        # Index de l'accolade ouvrante de l'objet racine
+        self.start: Optional[int] = None
+        # Index suivant l'accolade fermante de l'objet racine, une fois complet
+        self.end: Optional[int] = None
+
+    @property
+    def complete(self) -> bool:
+        return self.end is not None
+
+    def feed(self, chunk: str) -> List[Tuple[str, Any]]:
+        """Ajoute du texte généré et retourne les membres de premier niveau terminés."""
+        members = []
+        offset = len(self.text)
+        self.text += chunk
+        for index in range(offset, len(self.text)):
+            if self.complete:
+                break
+            char = self.text[index]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif char == "\\":
+                    self.escape = True
+                elif char == '"':
+                    self.in_string = False
+                continue
+            if char == '"':
+                self.in_string = True
+            elif char in "{[":
+                self.depth += 1
+                if self.depth == 1 and char == "{":
+                    if self.start is None:
+                        self.start = index
+                    self.member_start = index + 1
+            elif char in "}]":
+                if self.depth == 1 and self.member_start is not None:
+                    members.extend(self._member(index))
+                    self.end = index + 1
+                self.depth -= 1
+            elif char == "," and self.depth == 1 and self.member_start is not None:
+                members.extend(self._member(index))
+                self.member_start = index + 1
+        return members
+
+    def _member(self, end: int) -> List[Tuple[str, Any]]:
+        member = self.text[self.member_start:end].strip()
+        if not member:
+            return []
+        try:
+            return list(json.loads("{" + member + "}").items())
+        except json.JSONDecodeError:
+            return []
@@ -18,11 +18,17 @@ def prettify_xml(elem):
     reparsed = minidom.parseString(rough_string)
     return reparsed.toprettyxml(indent="  ")
 
-def json_to_xml():
+def json_to_xml(json_file=None, output_file=None):
+    """Convertit le kid.json en XML des informations clés.
+
+    Args:
+        json_file: JSON extrait (par défaut LLM/outputs/kid.json)
+        output_file: XML généré (par défaut LLM/outputs/key-info.xml)
+    """
     try:
         # Chemins des fichiers
         project_root = str(Path(__file__).parent.parent.parent)
-        json_file = os.path.join(project_root, "LLM", "outputs", "kid.json")
+        json_file = json_file or os.path.join(project_root, "LLM", "outputs", "kid.json")
         
         # Lire le JSON
         with open(json_file, 'r', encoding='utf-8') as f:
@@ -77,7 +83,7 @@ def json_to_xml():
         xml_string = prettify_xml(root)
         
         # Sauvegarder le XML
-        output_file = os.path.join(project_root, "LLM", "outputs", "key-info.xml")
+        output_file = output_file or os.path.join(project_root, "LLM", "outputs", "key-info.xml")
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(xml_string)
         
@@ -88,4 +94,8 @@ def json_to_xml():
         raise
 
 if __name__ == "__main__":
-    json_to_xml()
+    import sys
+    if len(sys.argv) not in (1, 3):
+        print("Usage: python key_info_xml.py [<json_file> <output_file>]")
+        sys.exit(1)
+    json_to_xml(*sys.argv[1:])
@@ -0,0 +1,144 @@
+"""Backends du modèle de langage.
+
+Le modèle partagé par l'extraction et le résumé (model_service.py) est soit le
+modèle GGUF chargé par llama.cpp (KID_LLM_BACKEND=llama, par défaut), soit FakeLlama
+(KID_LLM_BACKEND=fake) : un modèle factice, sans poids ni llama-cpp-python, qui
+reproduit la partie de l'interface llama_cpp.Llama utilisée par le projet
+(génération en streaming, tokenize, n_ctx, états KV du préfixe). Il répond au prompt
+d'extraction par un JSON conforme au schéma du prompt et simule au besoin la latence
+d'évaluation du prompt et de génération, pour mesurer l'orchestration, les caches et
+la concurrence sans les modèles.
+"""
+
+import json
+import os
+import re
+import time
+from typing import Any, Dict, Iterator, List, Optional, Union
+
+# "llama" (llama.cpp) ou "fake"
+LLM_BACKEND = os.environ.get("KID_LLM_BACKEND", "llama")
+# Secondes par token généré et par token de prompt évalué (modèle factice)
+FAKE_TOKEN_LATENCY = float(os.environ.get("KID_FAKE_LLM_TOKEN_LATENCY", "0"))
+FAKE_PROMPT_LATENCY = float(os.environ.get("KID_FAKE_LLM_PROMPT_LATENCY", "0"))
+
+# Le schéma suit ce texte dans le prompt d'extraction (build_prompt_prefix)
+SCHEMA_MARKER = "JSON Schema :"
+FAKE_SUMMARY = """# Résumé
+
+- Produit : information non disponible (modèle factice)
+- Niveau de risque : information non disponible
+- Coûts : information non disponible"""
+
+TOKEN_PATTERN = re.compile(r"\s*\S+|\s+")
+
+
+def fake_value(template: Any) -> Any:
+    """Valeur factice d'un champ du schéma : chaînes vides, 0 pour les nombres."""
+    if isinstance(template, dict):
+        return {key: fake_value(value) for key, value in template.items()}
+    if isinstance(template, list):
+        return [fake_value(template[0])] if template else []
+    if template in ("float", "int"):
+        return 0
+    if template == "bool":
+        return False
+    return ""
+
+
+class FakeLlama:
+    """Modèle factice à l'interface de llama_cpp.Llama.
+
+    Un token correspond à un mot (avec ses espaces). L'état KV est simulé : seuls
+    les tokens du prompt qui ne prolongent pas l'état courant coûtent la latence
+    d'évaluation, comme avec le préfixe restauré par PromptPrefixCache.
+    """
+
+    def __init__(self, n_ctx: int = 8192, token_latency: float = FAKE_TOKEN_LATENCY,
+                 prompt_latency: float = FAKE_PROMPT_LATENCY):
+        self._n_ctx = n_ctx
+        self.token_latency = token_latency
+        self.prompt_latency = prompt_latency
+        self.state: List[int] = []
+        self.calls = 0
+        self.evaluated_tokens = 0
+        self.generated_tokens = 0
+
+    def n_ctx(self) -> int:
+        return self._n_ctx
+
+    def tokenize(self, text: bytes, add_bos: bool = True, special: bool = False) -> List[int]:
+        tokens = [hash(piece) & 0x7FFFFFFF for piece in TOKEN_PATTERN.findall(text.decode("utf-8", "ignore"))]
+        return ([1] if add_bos else []) + tokens
+
+    def reset(self) -> None:
+        self.state = []
+
+    def eval(self, tokens: List[int]) -> None:
+        self._evaluate(self.state + list(tokens))
+
+    def save_state(self) -> List[int]:
+        return list(self.state)
+
+    def load_state(self, state: List[int]) -> None:
+        self.state = list(state)
+
+    def _evaluate(self, tokens: List[int]) -> None:
+        """Évalue les tokens qui suivent le plus long préfixe commun avec l'état courant."""
+        common = 0
+        for cached, token in zip(self.state, tokens):
+            if cached != token:
+                break
+            common += 1
+        evaluated = len(tokens) - common
+        self.evaluated_tokens += evaluated
+        if self.prompt_latency:
+            time.sleep(self.prompt_latency * evaluated)
+        self.state = list(tokens)
+
+    def respond(self, prompt: str) -> str:
+        """JSON factice du schéma contenu dans le prompt d'extraction, sinon un résumé."""
+        position = prompt.find(SCHEMA_MARKER)
+        start = prompt.find("{", position) if position != -1 else -1
+        if start != -1:
+            try:
+                schema, _ = json.JSONDecoder().raw_decode(prompt, start)
+                return json.dumps(fake_value(schema), ensure_ascii=False)
+            except json.JSONDecodeError:
+                pass
+        return FAKE_SUMMARY
+
+    def __call__(self, prompt: str, max_tokens: int = 16, stream: bool = False,
+                 stop: Optional[Union[str, List[str]]] = None, **kwargs) -> Union[Dict[str, Any], Iterator[Dict[str, Any]]]:
+        """Génère la réponse ; grammar, temperature, echo... sont acceptés et ignorés."""
+        self.calls += 1
+        prompt_tokens = self.tokenize(prompt.encode("utf-8"))
+        self._evaluate(prompt_tokens)
+
+        text = self.respond(prompt)
+        for stop_text in ([stop] if isinstance(stop, str) else stop or []):
+            if stop_text in text:
+                text = text[:text.index(stop_text)]
+        pieces = TOKEN_PATTERN.findall(text)
+        finish_reason = "length" if len(pieces) > max_tokens else "stop"
+        pieces = pieces[:max_tokens]
+
+        if stream:
+            return self._stream(pieces, finish_reason)
+        self._generate(len(pieces))
+        return {
+            "choices": [{"text": "".join(pieces), "index": 0, "finish_reason": finish_reason}],
+            "usage": {"prompt_tokens": len(prompt_tokens), "completion_tokens": len(pieces),
+                      "total_tokens": len(prompt_tokens) + len(pieces)},
+        }
+
+    def _generate(self, count: int) -> None:
+        self.generated_tokens += count
+        if self.token_latency:
+            time.sleep(self.token_latency * count)
+
+    def _stream(self, pieces: List[str], finish_reason: str) -> Iterator[Dict[str, Any]]:
+        for index, piece in enumerate(pieces):
+            self._generate(1)
+            last = index == len(pieces) - 1
+            yield {"choices": [{"text": piece, "index": 0, "finish_reason": finish_reason if last else None}]}
@@ -1,11 +1,25 @@
+from __future__ import annotations
+
+import contextlib
 import logging
+import hashlib
 import json
-import llama_cpp
+try:
+    import llama_cpp
+except ImportError:
+    # Seul le backend factice (KID_LLM_BACKEND=fake) fonctionne sans llama-cpp-python
+    llama_cpp = None
 import os
-import ast
-from typing import Dict, Any, List
+import time
+from collections import OrderedDict
+from typing import Dict, Any, Callable, ContextManager, List, Optional, Tuple
 from dataclasses import dataclass
-from validation_advanced import validate_document
+from validation_advanced import load_schema, validate_document
+from schema_grammar import load_grammar
+from chunking import empty_value, plan_groups
+from model_service import get_model_service
+from resume import summarize_json
+from json_stream import JSONStreamParser
 import sys
 
 # Add the project root directory to Python path
@@ -22,6 +36,69 @@ logger = logging.getLogger(__name__)
 # Set TOKENIZERS_PARALLELISM to false to avoid warnings
 os.environ["TOKENIZERS_PARALLELISM"] = "false"
 
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    """Mesure d'étape (voir stage_metrics.py), sans effet tant que set_observer n'a pas été appelé."""
+
+
+def set_observer(observer: Callable[..., None]) -> None:
+    """Transmet les mesures de ce module à ``observer``, en pratique stage_metrics.observe.
+
+    stage_metrics.py est à la racine du dépôt : c'est l'appelant (pipeline_worker.py, ou
+    le script lancé par run_pipeline.sh) qui le fournit.
+    """
+    global observe
+    observe = observer
+
+
+# Profilage du job (voir profiling.py), sans effet tant que set_profiler n'a pas été appelé
+def span(name: str, **args: Any) -> ContextManager:
+    return contextlib.nullcontext()
+
+
+def record_span(name: str, start: float, end: float, **args: Any) -> None:
+    pass
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    return fn
+
+
+def job_profile(output_dir: Optional[str], name: str) -> ContextManager:
+    return contextlib.nullcontext()
+
+
+def set_profiler(profiler: Any) -> None:
+    """Enregistre les spans et le profil CPU de ce module avec ``profiler``, le module profiling.
+
+    Comme stage_metrics.py, profiling.py est fourni par l'appelant.
+    """
+    global span, record_span, bind, job_profile
+    span, record_span, bind, job_profile = profiler.span, profiler.record_span, profiler.bind, profiler.job_profile
+
+# Ligne écrite sur la sortie standard pour chaque section générée (--stream-sections),
+# lue par app.py en mode script
+SECTION_MARKER = "@@KID_SECTION "
+
+SectionCallback = Callable[[str, Any], None]
+
+# Réutilisation de l'état KV du préfixe fixe du prompt (KID_LLM_PREFIX_CACHE=0 pour la désactiver)
+PREFIX_CACHE_ENABLED = os.environ.get("KID_LLM_PREFIX_CACHE", "1") == "1"
+# Nombre d'états de préfixe gardés en mémoire (un par section du schéma en extraction par sections)
+PREFIX_CACHE_STATES = int(os.environ.get("KID_LLM_PREFIX_STATES", "6"))
+
+# Extraction par sections du schéma avec uniquement les passages pertinents du document :
+# "auto" quand le document complet ne tient pas dans le contexte, "always" ou "never"
+CHUNKING_MODE = os.environ.get("KID_LLM_CHUNKING", "auto")
+# Tokens réservés à la réponse d'une section du schéma en extraction par sections
+GROUP_MAX_TOKENS = int(os.environ.get("KID_LLM_GROUP_MAX_TOKENS", "1536"))
+# max_tokens dérivé du schéma : tokens du schéma compact × facteur + marge,
+# les valeurs extraites étant plus longues que les noms de types du schéma
+MAX_TOKENS_FACTOR = float(os.environ.get("KID_LLM_MAX_TOKENS_FACTOR", "4"))
+MAX_TOKENS_MARGIN = 256
+# Ancien plafond fixe de la réponse, référence du rapport des tokens économisés
+LEGACY_MAX_TOKENS = 10000
+
 def load_config() -> Dict[str, Any]:
     """Charge la configuration depuis config.json."""
     config_path = os.path.join(os.path.dirname(__file__), '..', 'configs', 'config.json')
@@ -77,67 +154,48 @@ def save_json_output(data: Dict[str, Any], output_file: str) -> None:
     except Exception as e:
         logger.error(f"Erreur lors de la sauvegarde du JSON: {str(e)}")
 
-def load_json_schema(schema_file: str) -> Dict[str, Any]:
-    """Charge le schéma JSON depuis un fichier."""
+def load_llm(model_config: Dict[str, Any]) -> llama_cpp.Llama:
+    """Modèle GGUF partagé du processus (chargé une seule fois, voir model_service.py).
+
+    Les appels directs au modèle retourné ne passent pas par la file du service :
+    préférer get_model_service(model_config).run(...) si d'autres threads l'utilisent.
+    """
+    return get_model_service(model_config).llm
+
+def apply_risk(data: Dict[str, Any], risk: Optional[Dict[str, Any]]) -> None:
+    """Reprend dans risk.level le niveau de risque détecté par le VLM, s'il y en a un."""
+    if not risk or risk.get("level") is None:
+        return
+    if not isinstance(data.get("risk"), dict):
+        data["risk"] = {}
+    data["risk"]["level"] = risk["level"]
+    logger.info(f"Niveau de risque repris du VLM : {risk['level']} (confiance : {risk.get('confidence')})")
+
+def load_risk(risk_path: Optional[str]) -> Optional[Dict[str, Any]]:
+    """Lit le JSON du niveau de risque écrit par process_markdown_fixed.py."""
+    if not risk_path or not os.path.exists(risk_path):
+        return None
     try:
-        with open(schema_file, 'r', encoding='utf-8') as file:
-            schema = json.load(file)
-            logger.info(f"Schéma JSON chargé depuis {schema_file}")
-            return schema
+        with open(risk_path, 'r', encoding='utf-8') as f:
+            return json.load(f)
     except Exception as e:
-        logger.error(f"Erreur lors du chargement du schéma JSON: {str(e)}")
-        return {}
-
-def main():
-    try:
-        # Chargement de la configuration
-        config = load_config()
-        model_config = config["model"]
-        
-        # Initialisation du modèle LLM
-        llm = llama_cpp.Llama(
-            model_path=model_config["path"],
-            #n_ctx=model_config["max_length"],
-            n_ctx=8192,
-            n_threads=8,  # Utiliser plus de threads CPU
-            n_batch=1024,  # Augmenter la taille du batch comme dans votre exemple
-            n_gpu_layers=-1,  # Charger tous les layers sur le GPU
-            use_mmap=True,  # Utiliser le memory mapping pour un chargement plus rapide
-            use_mlock=False,  # Désactiver le verrouillage mémoire
-            verbose=True  # Activer les logs pour voir ce qui se passe
-        )
-        
-        # Lecture du fichier d'entrée
-        input_path = os.path.join(project_root, "inputs", "input.txt")
-        vlm_output = read_vlm_output(input_path)
-        if not vlm_output:
-            logger.error("Impossible de lire le fichier d'entrée")
-            return
+        logger.error(f"Erreur lors de la lecture du niveau de risque: {str(e)}")
+        return None
 
-        # Chargement du schéma JSON
-        schema_path = os.path.join(project_root, "configs", "json_schema.json")
-        json_structure = load_json_schema(schema_path)
-        if not json_structure:
-            logger.error("Impossible de charger le schéma JSON")
-            return
-        
-        # Préparation du prompt
-        prompt = f""" Tu es un assistant spécialisé dans l'extraction d'informations structurées à partir de texte. Ta tâche est de remplir le JSON Schema suivant avec les informations contenues dans le document fourni.
+def build_prompt_prefix(json_structure: Dict[str, Any]) -> str:
+    """Partie fixe du prompt (instructions et schéma), identique pour tous les documents."""
+    return f""" Tu es un assistant spécialisé dans l'extraction d'informations structurées à partir de texte. Ta tâche est de remplir le JSON Schema suivant avec les informations contenues dans le document fourni.
 
 
 Voici le JSON Schema :
 
         {json.dumps(json_structure, indent=2)}
 
-Voici le document :
-
-{vlm_output}
-
 Instructions importantes :
 
 Lis attentivement les informations destructurés du document et ajoute les au format JSON en respectant le formt du schéma.
 
-Si une information n'est pas présente dans le document, laisse le champ correspondant vide ("") ou avec la valeur par défaut si elle est spécifiée dans le schéma (par exemple, false ou []).
+Si une information n'est pas présente dans le document, laisse le champ correspondant vide ("") ou avec la valeur par défaut si elle est spécifiée dans le schéma (par exemple, false ou []). Pour un champ numérique absent, utilise null.
 
 Respecte scrupuleusement le format du JSON Schema (guillemets, virgules, accolades, crochets, etc.).
 
@@ -161,84 +219,573 @@ Sois précis et concis dans tes réponses.
 
 Ne fait pas de phrase, l'objectif est juste de remplir les champs du json schema.
 
+Voici le document :
+
+"""
+
+def build_prompt_suffix(vlm_output: str) -> str:
+    """Partie variable du prompt : le document, placé après le préfixe fixe."""
+    return f"""{vlm_output}
+
 Ta réponse doit être uniquement le JSON Schema complété, sans texte additionnel.
 
 """
-        
-        # Génération de la réponse
-        response = llm(
+
+def build_prompt(json_structure: Dict[str, Any], vlm_output: str) -> str:
+    """Construit le prompt d'extraction pour un document."""
+    return build_prompt_prefix(json_structure) + build_prompt_suffix(vlm_output)
+
+class PromptPrefixCache:
+    """États KV des préfixes fixes du prompt, calculés une fois par modèle chargé.
+
+    Avant chaque document, l'état sauvegardé (llama.cpp save_state) est restauré :
+    llama.cpp reprend au plus long préfixe commun et n'évalue que le document,
+    même si le modèle a servi à un autre prompt entre-temps. L'extraction par
+    sections utilise un préfixe par section du schéma, d'où plusieurs états
+    (les moins récemment utilisés sont libérés au-delà de max_states).
+    """
+
+    def __init__(self, max_states: int = PREFIX_CACHE_STATES):
+        self.llm = None
+        self.max_states = max_states
+        self.states: "OrderedDict[str, Any]" = OrderedDict()
+        self.build_time = 0.0
+
+    def restore(self, llm: llama_cpp.Llama, prefix: str) -> None:
+        if self.llm is not llm:
+            self.llm = llm
+            self.states.clear()
+        prefix_hash = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        if prefix_hash in self.states:
+            self.states.move_to_end(prefix_hash)
+            llm.load_state(self.states[prefix_hash])
+            observe("kid_llm_prefix_cache_lookups_total", 1, outcome="hit")
+            return
+        observe("kid_llm_prefix_cache_lookups_total", 1, outcome="miss")
+        start = time.perf_counter()
+        tokens = llm.tokenize(prefix.encode("utf-8"), add_bos=True)
+        llm.reset()
+        llm.eval(tokens)
+        self.states[prefix_hash] = llm.save_state()
+        while len(self.states) > self.max_states:
+            self.states.popitem(last=False)
+        self.build_time = time.perf_counter() - start
+        logger.info(f"Préfixe du prompt évalué et sauvegardé : {len(tokens)} tokens en {self.build_time:.2f}s")
+
+PREFIX_CACHE = PromptPrefixCache() if PREFIX_CACHE_ENABLED else None
+
+def complete(llm: llama_cpp.Llama, prompt: str, prefix: Optional[str] = None,
+             prefix_cache: Optional[PromptPrefixCache] = PREFIX_CACHE,
+             on_text: Optional[Callable[[str], None]] = None,
+             stop_when: Optional[Callable[[], bool]] = None,
+             **kwargs) -> Tuple[str, Dict[str, float]]:
+    """Génère la réponse du LLM en streaming et mesure l'évaluation du prompt.
+
+    Args:
+        prefix: Début de prompt dont l'état KV est réutilisé via prefix_cache
+        on_text: Appelé avec chaque morceau de texte dès sa génération
+        stop_when: Vérifié après chaque morceau ; la génération s'arrête dès qu'il
+            retourne True (par exemple quand l'objet JSON est fermé)
+
+    Returns:
+        Tuple (texte généré, mesures) ; prompt_eval est le temps jusqu'au premier token,
+        finish_reason vaut "length" si max_tokens a été atteint.
+    """
+    start = time.perf_counter()
+    if prefix is not None and prefix_cache is not None:
+        prefix_cache.restore(llm, prefix)
+    first_token = None
+    chunks = []
+    stopped_early = False
+    finish_reason = None
+    stream = llm(prompt, stream=True, **kwargs)
+    for chunk in stream:
+        if first_token is None:
+            first_token = time.perf_counter()
+        text = chunk["choices"][0]["text"]
+        finish_reason = chunk["choices"][0].get("finish_reason") or finish_reason
+        chunks.append(text)
+        if on_text is not None:
+            on_text(text)
+        if stop_when is not None and stop_when():
+            stopped_early = True
+            finish_reason = "stop"
+            break
+    # Fermer le générateur arrête llama.cpp sans évaluer d'autres tokens
+    stream.close()
+    end = time.perf_counter()
+    first_token = first_token or end
+    record_span("prompt_eval", start, first_token, prefix_cached=prefix is not None and prefix_cache is not None)
+    record_span("generation", first_token, end, tokens=len(chunks), stopped_early=stopped_early)
+    return "".join(chunks), {
+        "prompt_eval": first_token - start,
+        "generation": end - first_token,
+        "completion_tokens": len(chunks),
+        "stopped_early": stopped_early,
+        "finish_reason": finish_reason,
+    }
+
+def response_budget(llm: llama_cpp.Llama, json_structure: Dict[str, Any]) -> int:
+    """Tokens de réponse estimés pour remplir json_structure, d'après la taille du schéma."""
+    schema_tokens = count_tokens(llm, json.dumps(json_structure, ensure_ascii=False))
+    return int(schema_tokens * MAX_TOKENS_FACTOR) + MAX_TOKENS_MARGIN
+
+def schema_max_tokens(llm: llama_cpp.Llama, json_structure: Dict[str, Any], prompt_tokens: int) -> int:
+    """max_tokens d'une extraction : le budget du schéma, dans le contexte restant."""
+    return max(1, min(response_budget(llm, json_structure), llm.n_ctx() - prompt_tokens))
+
+class GenerationStats:
+    """Tokens générés par appel au LLM.
+
+    Les générations tronquées (max_tokens atteint avant la fermeture du JSON) sont
+    comptées à part : les moyennes ne portent que sur les réponses complètes, et
+    unused_tokens est la part mesurée du plafond qu'elles n'ont pas consommée. Le
+    gain face à la génération libre est mesuré par benchmark_grammar (tokens_saved).
+    """
+
+    def __init__(self):
+        self.complete = 0
+        self.truncated = 0
+        # Tous les appels, pour le débit en tokens/s
+        self.completion_tokens = 0
+        self.generation = 0.0
+        # Réponses complètes uniquement
+        self.complete_tokens = 0
+        self.max_tokens = 0
+        self.early_stops = 0
+
+    def record(self, max_tokens: int, stats: Dict[str, Any], truncated: bool = False) -> None:
+        self.completion_tokens += stats["completion_tokens"]
+        self.generation += stats["generation"]
+        if truncated:
+            self.truncated += 1
+            return
+        self.complete += 1
+        self.complete_tokens += stats["completion_tokens"]
+        self.max_tokens += max_tokens
+        self.early_stops += int(stats["stopped_early"])
+
+    def report(self) -> Dict[str, float]:
+        complete = max(1, self.complete)
+        return {
+            "complete": self.complete,
+            "truncated": self.truncated,
+            "completion_tokens": self.completion_tokens,
+            "generation": self.generation,
+            "avg_completion_tokens": self.complete_tokens / complete,
+            "avg_max_tokens": self.max_tokens / complete,
+            "avg_unused_tokens": (self.max_tokens - self.complete_tokens) / complete,
+            "early_stops": self.early_stops,
+        }
+
+GENERATION_STATS = GenerationStats()
+
+def json_answer(text: str) -> Tuple[str, bool]:
+    """Texte jusqu'à la fermeture de l'objet JSON racine, et vrai si celui-ci est complet."""
+    parser = JSONStreamParser()
+    parser.feed(text)
+    return (text[parser.start:parser.end], True) if parser.complete else (text, False)
+
+def benchmark_grammar(llm: llama_cpp.Llama, vlm_output: str) -> Dict[str, Dict[str, Any]]:
+    """Compare les tokens générés pour un document selon le mode de génération.
+
+    "free" reproduit l'ancienne génération (sans grammaire ni arrêt, max_tokens=10000),
+    "early_exit" s'arrête à la fermeture de l'objet JSON avec le max_tokens dérivé du
+    schéma, "grammar" y ajoute la grammaire JSON. tokens_saved est l'écart avec "free".
+    """
+    json_structure = load_schema().schema
+    prefix = build_prompt_prefix(json_structure)
+    prompt = prefix + build_prompt_suffix(vlm_output)
+    max_tokens = schema_max_tokens(llm, json_structure, count_tokens(llm, prompt) + 1)
+    variants = (
+        ("free", None, LEGACY_MAX_TOKENS, False),
+        ("early_exit", None, max_tokens, True),
+        ("grammar", load_grammar(json_structure), max_tokens, True),
+    )
+    report = {}
+    for name, grammar, variant_max_tokens, early_exit in variants:
+        stream_parser = JSONStreamParser()
+        text, stats = complete(llm, prompt, prefix=prefix, grammar=grammar,
+                               on_text=stream_parser.feed,
+                               stop_when=(lambda: stream_parser.complete) if early_exit else None,
+                               max_tokens=variant_max_tokens, temperature=0.0)
+        try:
+            json.loads(json_answer(text)[0])
+            valid_json = True
+        except json.JSONDecodeError:
+            valid_json = False
+        report[name] = {
+            "max_tokens": variant_max_tokens,
+            "completion_tokens": stats["completion_tokens"],
+            "generation": stats["generation"],
+            "valid_json": valid_json,
+            "tokens_saved": report["free"]["completion_tokens"] - stats["completion_tokens"] if report else 0,
+        }
+    logger.info(f"Tokens générés par document : {report}")
+    return report
+
+def benchmark_prompt_eval(llm: llama_cpp.Llama, vlm_output: str, runs: int = 3) -> Dict[str, float]:
+    """Compare le temps d'évaluation du prompt sans et avec réutilisation du préfixe.
+
+    Un seul token est généré, la mesure porte donc sur l'évaluation du prompt.
+    """
+    json_structure = load_schema().schema
+    prefix = build_prompt_prefix(json_structure)
+    prompt = prefix + build_prompt_suffix(vlm_output)
+
+    cold = []
+    for _ in range(runs):
+        llm.reset()
+        _, stats = complete(llm, prompt, prefix_cache=None, max_tokens=1, temperature=0.0)
+        cold.append(stats["prompt_eval"])
+
+    prefix_cache = PromptPrefixCache()
+    prefix_cache.restore(llm, prefix)
+    warm = []
+    for _ in range(runs):
+        # Un autre prompt évalué entre deux documents ne fait pas perdre le préfixe
+        llm.reset()
+        _, stats = complete(llm, prompt, prefix=prefix, prefix_cache=prefix_cache,
+                            max_tokens=1, temperature=0.0)
+        warm.append(stats["prompt_eval"])
+
+    report = {
+        "prompt_tokens": len(llm.tokenize(prompt.encode("utf-8"), add_bos=True)),
+        "prefix_tokens": len(llm.tokenize(prefix.encode("utf-8"), add_bos=True)),
+        "prefix_build": prefix_cache.build_time,
+        "prompt_eval_without_cache": sum(cold) / runs,
+        "prompt_eval_with_cache": sum(warm) / runs,
+    }
+    logger.info(f"Évaluation du prompt : {report}")
+    return report
+
+def parse_response(response_text: str, debug_dir: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """Parse le JSON de la réponse du LLM.
+
+    La grammaire impose un JSON valide : une réponse illisible signifie une génération
+    interrompue (max_tokens atteint), elle n'est pas réparée. Un éventuel texte après
+    la fermeture de l'objet racine est ignoré.
+
+    Args:
+        debug_dir: Dossier recevant debug_response.txt si la réponse est illisible
+    """
+    try:
+        return json.loads(json_answer(response_text)[0])
+    except json.JSONDecodeError as e:
+        logger.error(f"Erreur de parsing JSON : {str(e)}")
+        logger.error(f"Texte invalide : {response_text}")
+        if debug_dir is not None:
+            # Sauvegarder la réponse brute pour debug
+            debug_file = os.path.join(debug_dir, "debug_response.txt")
+            with open(debug_file, 'w', encoding='utf-8') as f:
+                f.write(response_text)
+            logger.info(f"Réponse brute sauvegardée dans {debug_file}")
+        return None
+
+def generate_json(llm: llama_cpp.Llama,
+                  json_structure: Dict[str, Any],
+                  document: str,
+                  model_config: Dict[str, Any],
+                  max_tokens: Optional[int] = None,
+                  debug_dir: Optional[str] = None,
+                  on_section: Optional[SectionCallback] = None) -> Optional[Dict[str, Any]]:
+    """Remplit json_structure à partir du texte d'un document, en un appel au LLM.
+
+    Args:
+        max_tokens: Plafond de la réponse, réduit au besoin au budget dérivé du schéma.
+            Une réponse tronquée par ce plafond est regénérée une fois avec tout le
+            contexte restant.
+        on_section: Appelé avec (nom, valeur) de chaque section de premier niveau
+            dès que sa génération est terminée
+    """
+    stream_parser = JSONStreamParser()
+    sent_sections = set()
+
+    def on_text(text: str) -> None:
+        for name, value in stream_parser.feed(text):
+            # Les sections déjà envoyées ne le sont pas de nouveau par un second essai
+            if on_section is not None and name not in sent_sections:
+                sent_sections.add(name)
+                on_section(name, value)
+
+    # Seul le document est évalué, le préfixe fixe est réutilisé, et la grammaire
+    # limite la sortie au JSON du schéma ; la génération s'arrête dès que l'objet
+    # racine est fermé, sans attendre le token de fin
+    prefix = build_prompt_prefix(json_structure)
+    prompt = prefix + build_prompt_suffix(document)
+    prompt_tokens = count_tokens(llm, prompt) + 1
+    budget = schema_max_tokens(llm, json_structure, prompt_tokens)
+    max_tokens = min(max_tokens, budget) if max_tokens else budget
+    remaining_context = max(1, llm.n_ctx() - prompt_tokens)
+    while True:
+        response_text, stats = complete(
+            llm,
             prompt,
-            max_tokens=10000,  # limite max
+            prefix=prefix,
+            on_text=on_text,
+            stop_when=lambda: stream_parser.complete,
+            grammar=load_grammar(json_structure),
+            max_tokens=max_tokens,
             temperature=model_config["temperature"],
-            stop=None,  # Enlever les stop tokens pour éviter la coupure prématurée
             echo=False
         )
-        
-        # Log de la réponse brute
-        response_text = response["choices"][0]["text"]
-        logger.info("=== Réponse brute du LLM ===")
-        logger.info(response_text)
-        logger.info("=== Fin de la réponse brute ===")
+        truncated = stats["finish_reason"] == "length" or not stream_parser.complete
+        GENERATION_STATS.record(max_tokens, stats, truncated)
+        observe("kid_llm_prompt_eval_seconds", stats["prompt_eval"])
+        observe("kid_llm_generation_seconds", stats["generation"])
+        observe("kid_llm_completion_tokens", stats["completion_tokens"])
+        logger.info(f"Évaluation du prompt : {stats['prompt_eval']:.2f}s, "
+                    f"génération : {stats['generation']:.2f}s ({stats['completion_tokens']} tokens "
+                    f"sur {max_tokens} autorisés{', arrêt à la fermeture du JSON' if stats['stopped_early'] else ''})")
+        logger.info(f"Tokens par génération : {GENERATION_STATS.report()}")
+        if not truncated or max_tokens >= remaining_context:
+            break
+        logger.warning(f"Réponse tronquée à {max_tokens} tokens, nouvel essai avec le contexte "
+                       f"restant ({remaining_context} tokens)")
+        max_tokens = remaining_context
+        stream_parser = JSONStreamParser()
+    
+    # Log de la réponse brute
+    logger.info("=== Réponse brute du LLM ===")
+    logger.info(response_text)
+    logger.info("=== Fin de la réponse brute ===")
+    return parse_response(response_text, debug_dir)
+
+def count_tokens(llm: llama_cpp.Llama, text: str) -> int:
+    return len(llm.tokenize(text.encode("utf-8"), add_bos=False))
+
+def needs_chunking(llm: llama_cpp.Llama, json_structure: Dict[str, Any], vlm_output: str) -> bool:
+    """Vrai si le prompt complet et la réponse ne tiennent pas dans le contexte."""
+    if CHUNKING_MODE in ("always", "never"):
+        return CHUNKING_MODE == "always"
+    prompt_tokens = count_tokens(llm, build_prompt(json_structure, vlm_output))
+    return prompt_tokens + response_budget(llm, json_structure) > llm.n_ctx()
+
+def extract_chunked(llm: llama_cpp.Llama,
+                    json_structure: Dict[str, Any],
+                    vlm_output: str,
+                    model_config: Dict[str, Any],
+                    debug_dir: Optional[str] = None,
+                    on_section: Optional[SectionCallback] = None) -> Optional[Dict[str, Any]]:
+    """Extrait chaque section du schéma à partir des seuls passages pertinents du document.
+
+    Une section du schéma sans passage pertinent est laissée vide sans appel au LLM.
+    """
+    budgets = {
+        group: llm.n_ctx() - GROUP_MAX_TOKENS
+        - count_tokens(llm, build_prompt({group: template}, ""))
+        for group, template in json_structure.items()
+    }
+    plan = plan_groups(vlm_output, json_structure, min(budgets.values()),
+                       lambda text: count_tokens(llm, text))
+    parsed_data = {}
+    for group, template in json_structure.items():
+        document = plan[group]
+        if not document:
+            logger.info(f"Section '{group}' : aucun passage pertinent, laissée vide")
+            parsed_data[group] = empty_value(template)
+            if on_section is not None:
+                on_section(group, parsed_data[group])
+            continue
+        logger.info(f"Section '{group}' : {count_tokens(llm, document)} tokens de document")
+        partial = generate_json(llm, {group: template}, document, model_config,
+                                max_tokens=GROUP_MAX_TOKENS, debug_dir=debug_dir, on_section=on_section)
+        if partial is None:
+            return None
+        parsed_data[group] = partial.get(group, empty_value(template))
+    return parsed_data
+
+def extract(llm: llama_cpp.Llama,
+            vlm_output: str,
+            model_config: Dict[str, Any],
+            risk: Optional[Dict[str, Any]] = None,
+            debug_dir: Optional[str] = None,
+            on_section: Optional[SectionCallback] = None) -> Optional[Dict[str, Any]]:
+    """Extrait le kid.json d'un markdown enrichi déjà en mémoire.
+
+    Args:
+        llm: Modèle chargé
+        vlm_output: Markdown enrichi par process_markdown_fixed.py
+        model_config: Section "model" de config.json
+        risk: Niveau de risque détecté par le VLM, prioritaire sur la valeur extraite par le LLM
+        debug_dir: Dossier recevant la réponse brute si elle est illisible
+        on_section: Appelé avec (nom, valeur) de chaque section de premier niveau
+            (product, risk, dates...) dès qu'elle est générée, avant la fin du document
+
+    Returns:
+        Le document extrait et validé, ou None
+    """
+    # Schéma JSON lu et compilé une fois par processus, partagé par le prompt,
+    # la grammaire et la validation
+    compiled_schema = load_schema()
+    json_structure = compiled_schema.schema
+    if not json_structure:
+        logger.error("Impossible de charger le schéma JSON")
+        return None
+
+    emit = None
+    if on_section is not None:
+        def emit(name: str, value: Any) -> None:
+            # Le niveau détecté par le VLM remplace aussi celui de la section diffusée
+            section = {name: value}
+            if name == "risk":
+                apply_risk(section, risk)
+            on_section(name, section[name])
 
+    try:
+        if needs_chunking(llm, json_structure, vlm_output):
+            logger.info("Extraction par sections du schéma")
+            parsed_data = extract_chunked(llm, json_structure, vlm_output, model_config, debug_dir,
+                                          on_section=emit)
+        else:
+            parsed_data = generate_json(llm, json_structure, vlm_output, model_config,
+                                        debug_dir=debug_dir, on_section=emit)
+        if parsed_data is None:
+            return None
+        
+        apply_risk(parsed_data, risk)
+        
+        # Valider le document
+        with span("validate"):
+            validation_result = validate_document(parsed_data, compiled_schema)
+        observe("kid_validation_score", validation_result.score)
+        
+        if validation_result.score >= 0.0:  # Ajuster le seuil si nécessaire
+            return parsed_data
+        logger.error(f"Validation échouée. Score: {validation_result.score}")
+        for feedback in validation_result.feedback:
+            logger.error(f"Feedback: {feedback}")
+        return None
+        
+    except Exception as e:
+        logger.error(f"Erreur lors du traitement : {str(e)}")
+        return None
+
+def extract_with_summary(llm: llama_cpp.Llama,
+                         vlm_output: str,
+                         model_config: Dict[str, Any],
+                         risk: Optional[Dict[str, Any]] = None,
+                         debug_dir: Optional[str] = None,
+                         on_section: Optional[SectionCallback] = None) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """Mode combiné : extraction puis résumé dérivé du JSON extrait.
+
+    Le document n'est évalué qu'une fois ; le résumé ne relit que les champs extraits.
+    """
+    parsed_data = extract(llm, vlm_output, model_config, risk, debug_dir, on_section)
+    if parsed_data is None:
+        return None, None
+    start = time.perf_counter()
+    summary = summarize_json(llm, parsed_data)
+    logger.info(f"Résumé généré à partir du JSON en {time.perf_counter() - start:.2f}s")
+    return parsed_data, summary
+
+def main(llm: Optional[llama_cpp.Llama] = None,
+         input_path: Optional[str] = None,
+         output_path: Optional[str] = None,
+         risk_path: Optional[str] = None,
+         summary_path: Optional[str] = None,
+         on_section: Optional[SectionCallback] = None,
+         profile_dir: Optional[str] = None) -> bool:
+    """Extrait le kid.json à partir du markdown enrichi.
+
+    Args:
+        llm: Modèle déjà réservé par l'appelant. S'il est absent, la requête passe
+            par la file du service de modèle partagé.
+        input_path: Markdown d'entrée (par défaut inputs/input.txt).
+        output_path: JSON de sortie (par défaut outputs/kid.json). Chaque job
+            utilise ses propres chemins pour pouvoir tourner en parallèle.
+        risk_path: JSON du niveau de risque écrit par process_markdown_fixed.py,
+            prioritaire sur la valeur extraite par le LLM.
+        summary_path: Si fourni, écrit aussi le résumé (resume.txt), dérivé du JSON
+            extrait au lieu d'une seconde évaluation du document par resume.py.
+        on_section: Appelé avec chaque section de premier niveau dès sa génération.
+        profile_dir: Dossier recevant un profil CPU et une trace des étapes (voir
+            profiling.py, voir set_profiler) ; aucun profilage si None.
+
+    Returns:
+        True si le kid.json a été écrit, False si aucun JSON valide n'a pu être extrait.
+    """
+    input_path = input_path or os.path.join(project_root, "inputs", "input.txt")
+    output_path = output_path or os.path.join(project_root, "outputs", "kid.json")
+
+    # Profil CPU et trace des étapes, uniquement si demandé
+    with job_profile(profile_dir, "extract"):
         try:
-            # Nettoyer la réponse
-            response_text = response["choices"][0]["text"].strip()
-            
-            # Compter les accolades ouvrantes et fermantes
-            open_braces = response_text.count('{')
-            close_braces = response_text.count('}')
-            
-            # Équilibrer les accolades si nécessaire
-            if open_braces > close_braces:
-                response_text += '}' * (open_braces - close_braces)
-            elif not response_text.endswith('}'):
-                # Ajouter une accolade fermante seulement si on n'en a pas déjà ajouté
-                response_text += '}'
-            
-            # Trouver le JSON dans la réponse
-            start_idx = response_text.find('{')
-            end_idx = response_text.rfind('}') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                response_text = response_text[start_idx:end_idx]
-                
-                try:
-                    # Essayer d'abord avec json.loads pour un parsing strict
-                    parsed_data = json.loads(response_text)
-                except json.JSONDecodeError:
-                    try:
-                        # Si json.loads échoue, utiliser ast.literal_eval
-                        parsed_data = ast.literal_eval(response_text)
-                    except (SyntaxError, ValueError) as e:
-                        logger.error(f"Erreur de parsing JSON : {str(e)}")
-                        logger.error(f"Texte invalide : {response_text}")
-                        # Sauvegarder la réponse brute pour debug
-                        debug_file = os.path.join(project_root, "outputs", "debug_response.txt")
-                        with open(debug_file, 'w', encoding='utf-8') as f:
-                            f.write(response_text)
-                        logger.info(f"Réponse brute sauvegardée dans {debug_file}")
-                        return
-                
-                # Valider le document
-                validation_result = validate_document(parsed_data)
-                
-                if validation_result.score >= 0.0:  # Ajuster le seuil si nécessaire
-                    # Sauvegarder le résultat
-                    output_file = os.path.join(project_root, "outputs", "kid.json")
-                    with open(output_file, 'w', encoding='utf-8') as f:
-                        json.dump(parsed_data, f, indent=2, ensure_ascii=False)
-                    logger.info(f"Résultat sauvegardé dans {output_file}")
-                else:
-                    logger.error(f"Validation échouée. Score: {validation_result.score}")
-                    for feedback in validation_result.feedback:
-                        logger.error(f"Feedback: {feedback}")
+            # Chargement de la configuration
+            config = load_config()
+            model_config = config["model"]
             
+            # Lecture du fichier d'entrée
+            vlm_output = read_vlm_output(input_path)
+            if not vlm_output:
+                logger.error("Impossible de lire le fichier d'entrée")
+                return False
+
+            risk = load_risk(risk_path)
+            debug_dir = os.path.dirname(output_path)
+            # La requête peut s'exécuter dans le thread du service de modèle
+            run = bind(extract_with_summary if summary_path else extract)
+            if llm is None:
+                output = get_model_service(model_config).run(run, vlm_output, model_config, risk, debug_dir,
+                                                             on_section)
+            else:
+                output = run(llm, vlm_output, model_config, risk, debug_dir, on_section)
+            parsed_data, summary = output if summary_path else (output, None)
+            if parsed_data is not None:
+                # Sauvegarder le résultat
+                with open(output_path, 'w', encoding='utf-8') as f:
+                    json.dump(parsed_data, f, indent=2, ensure_ascii=False)
+                logger.info(f"Résultat sauvegardé dans {output_path}")
+            if summary is not None:
+                with open(summary_path, 'w', encoding='utf-8') as f:
+                    f.write(summary)
+                logger.info(f"Résumé sauvegardé dans {summary_path}")
+            return parsed_data is not None
+
         except Exception as e:
             logger.error(f"Erreur lors du traitement : {str(e)}")
-            logger.error(f"Réponse reçue : {response_text}")
-            
-    except Exception as e:
-        logger.error(f"Erreur lors du traitement : {str(e)}")
-        raise
+            raise
 
 if __name__ == "__main__":
-    main()
+    if len(sys.argv) == 3 and sys.argv[1] == "--benchmark-prefix":
+        benchmark_prompt_eval(load_llm(load_config()["model"]), read_vlm_output(sys.argv[2]))
+        sys.exit(0)
+    if len(sys.argv) == 3 and sys.argv[1] == "--benchmark-grammar":
+        benchmark_grammar(load_llm(load_config()["model"]), read_vlm_output(sys.argv[2]))
+        sys.exit(0)
+    args = sys.argv[1:]
+    print_sections = None
+    if "--stream-sections" in args:
+        args.remove("--stream-sections")
+        print_sections = lambda name, value: print(
+            SECTION_MARKER + json.dumps({"section": name, "value": value}, ensure_ascii=False), flush=True
+        )
+    summary_file = None
+    if "--summary" in args and args.index("--summary") + 1 < len(args):
+        position = args.index("--summary")
+        summary_file = args[position + 1]
+        del args[position:position + 2]
+    if len(args) not in (0, 2, 3):
+        print("Usage: python llm_test_options.py [<input_file> <output_file> [risk_file]] "
+              "[--summary <resume_file>] [--stream-sections]")
+        print("       python llm_test_options.py --benchmark-prefix <input_file>")
+        print("       python llm_test_options.py --benchmark-grammar <input_file>")
+        sys.exit(1)
+    try:
+        # Racine du dépôt dans PYTHONPATH (run_pipeline.sh) : mesures transmises à app.py
+        # et profil du job demandé par KID_PROFILE_DIR
+        import profiling
+        from stage_metrics import observe as stage_observe
+        set_observer(stage_observe)
+        set_profiler(profiling)
+        profile_dir = profiling.PROFILE_DIR
+    except ImportError:
+        profile_dir = None
+    written = main(None, *args, summary_path=summary_file, on_section=print_sections, profile_dir=profile_dir)
+    if os.environ.get("KID_STATS_PATH"):
+        # Mesures lues par benchmark.py
+        with open(os.environ["KID_STATS_PATH"], 'w', encoding='utf-8') as f:
+            json.dump(GENERATION_STATS.report(), f)
+    if not written:
+        # Code de sortie non nul : run_pipeline.sh, stage_runner.py et app.py arrêtent le pipeline
+        sys.exit(1)
@@ -0,0 +1,127 @@
+"""Service de modèle partagé.
+
+Le modèle GGUF (~7 Go) est chargé une seule fois par processus et partagé par
+l'extraction (llm_test_options.py) et le résumé (resume.py), avec les mêmes
+réglages. Le contexte llama.cpp n'étant pas utilisable par plusieurs threads à la
+fois, les requêtes passent par une file servie par un thread unique.
+
+Les réglages de threads et de batch sont calculés à partir des cœurs disponibles
+et peuvent être imposés par KID_LLM_THREADS, KID_LLM_THREADS_BATCH et KID_LLM_BATCH ;
+le nombre de couches chargées sur le GPU par KID_LLM_GPU_LAYERS.
+KID_LLM_BACKEND=fake remplace le modèle par FakeLlama (voir llm_backends.py).
+"""
+
+import logging
+import os
+import queue
+import threading
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+from llm_backends import LLM_BACKEND, FakeLlama
+
+logger = logging.getLogger(__name__)
+
+N_CTX = 8192
+# Couches chargées sur le GPU, -1 pour toutes (réglage de l'extraction ; le résumé,
+# qui chargeait son propre modèle, n'en mettait qu'une)
+N_GPU_LAYERS = int(os.environ.get("KID_LLM_GPU_LAYERS", "-1"))
+
+
+def available_cores() -> int:
+    """Cœurs utilisables par ce processus (affinité CPU comprise)."""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def default_settings(cores: Optional[int] = None) -> Dict[str, int]:
+    """Réglages llama.cpp dérivés du nombre de cœurs.
+
+    La génération, limitée par la bande passante mémoire, laisse un cœur au reste du
+    processus (serveur, VLM) ; l'évaluation du prompt utilise tous les cœurs, avec un
+    batch qui grandit avec eux.
+    """
+    cores = cores or available_cores()
+    return {
+        "n_threads": int(os.environ.get("KID_LLM_THREADS", max(1, cores - 1))),
+        "n_threads_batch": int(os.environ.get("KID_LLM_THREADS_BATCH", cores)),
+        "n_batch": int(os.environ.get("KID_LLM_BATCH", min(2048, max(256, 128 * cores)))),
+    }
+
+
+def create_llm(model_config: Dict[str, Any], settings: Dict[str, int], backend: str = LLM_BACKEND) -> Any:
+    """Modèle du backend demandé : llama_cpp.Llama ("llama") ou FakeLlama ("fake")."""
+    if backend == "fake":
+        logger.info("Utilisation du modèle factice")
+        return FakeLlama(n_ctx=N_CTX)
+
+    import llama_cpp
+
+    logger.info(f"Chargement du modèle {model_config['path']} avec {settings}")
+    return llama_cpp.Llama(
+        model_path=model_config["path"],
+        n_ctx=N_CTX,
+        n_gpu_layers=N_GPU_LAYERS,
+        use_mmap=True,  # Utiliser le memory mapping pour un chargement plus rapide
+        use_mlock=False,  # Désactiver le verrouillage mémoire
+        verbose=True,
+        **settings
+    )
+
+
+class ModelService:
+    """Modèle chargé une fois, requêtes exécutées une par une dans l'ordre d'arrivée."""
+
+    def __init__(self, model_config: Dict[str, Any], backend: str = LLM_BACKEND):
+        self.model_config = model_config
+        self.settings = default_settings()
+        self.backend = backend
+        self.llm = create_llm(model_config, self.settings, backend)
+        self.served = 0
+        self._requests: "queue.Queue" = queue.Queue()
+        self._thread = threading.Thread(target=self._serve, name="llm-service", daemon=True)
+        self._thread.start()
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Met en file l'appel fn(llm, *args, **kwargs)."""
+        future: Future = Future()
+        self._requests.put((fn, args, kwargs, future))
+        return future
+
+    def run(self, fn: Callable[..., Any], *args, **kwargs) -> Any:
+        """Exécute fn(llm, *args, **kwargs) à son tour et retourne son résultat."""
+        if threading.current_thread() is self._thread:
+            # Appel imbriqué depuis une requête en cours : le modèle est déjà réservé
+            return fn(self.llm, *args, **kwargs)
+        return self.submit(fn, *args, **kwargs).result()
+
+    def _serve(self) -> None:
+        while True:
+            fn, args, kwargs, future = self._requests.get()
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(self.llm, *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)
+            finally:
+                self.served += 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.backend, "queued": self._requests.qsize(), "served": self.served,
+                **self.settings}
+
+
+_services: Dict[str, ModelService] = {}
+_services_lock = threading.Lock()
+
+
+def get_model_service(model_config: Dict[str, Any]) -> ModelService:
+    """Service du modèle de config["model"], créé au premier appel du processus."""
+    path = model_config["path"]
+    with _services_lock:
+        if path not in _services:
+            _services[path] = ModelService(model_config)
+        return _services[path]
@@ -1,8 +1,8 @@
 import logging
 import json
-import llama_cpp
 import os
 from pathlib import Path
+from model_service import get_model_service
 
 # Configuration du logging
 logging.basicConfig(
@@ -30,57 +30,101 @@ def read_input_file(file_path):
         logger.error(f"Erreur lors de la lecture du fichier : {str(e)}")
         raise
 
-def main():
-    try:
-        # Charger la configuration
-        config = load_config()
-        model_path = config["model"]["path"]
-        
-        # Initialiser le modèle
-        llm = llama_cpp.Llama(
-            model_path=model_path,
-            n_ctx=8192,
-            n_batch=512,
-            n_threads=4,
-            n_gpu_layers=1
-        )
-
-        # Lire le fichier d'entrée
-        project_root = str(Path(__file__).parent.parent.parent)
-        input_file = os.path.join(project_root, "LLM", "inputs", "input.txt")
-        content = read_input_file(input_file)
-
-        # Construire le prompt
-        prompt = f"""[INST] Tu es un expert financier. Fais un résumé clair et bien structuré de ce document financier.
-Mets en avant les informations essentielles comme :
+SUMMARY_POINTS = """Mets en avant les informations essentielles comme :
 - Le nom et type du produit
 - Le niveau de risque et les avertissements importants
 - Les dates clés
 - Les scénarios de performance
 - Les coûts
 
-Utilise une présentation claire avec des titres et des puces pour faciliter la lecture.
+Utilise une présentation claire avec des titres et des puces pour faciliter la lecture."""
+
+# Plafond du résumé (KID_SUMMARY_MAX_TOKENS), réduit au contexte restant après le prompt
+SUMMARY_MAX_TOKENS = int(os.environ.get("KID_SUMMARY_MAX_TOKENS", "2048"))
+# Le résumé s'arrête si le modèle entame un nouveau tour de conversation
+SUMMARY_STOP = ["[INST]", "</s>"]
+
+def summary_max_tokens(llm, prompt):
+    prompt_tokens = len(llm.tokenize(prompt.encode("utf-8"), add_bos=True))
+    return max(1, min(SUMMARY_MAX_TOKENS, llm.n_ctx() - prompt_tokens))
+
+def generate(llm, prompt):
+    # Génération de la réponse
+    max_tokens = summary_max_tokens(llm, prompt)
+    response = llm(
+        prompt,
+        max_tokens=max_tokens,
+        temperature=0.1,
+        stop=SUMMARY_STOP,
+        echo=False
+    )
+    logger.info(f"Résumé : {response['usage']['completion_tokens']} tokens sur {max_tokens} autorisés "
+                f"(fin : {response['choices'][0]['finish_reason']})")
+
+    # Traitement de la réponse
+    return response["choices"][0]["text"].strip()
+
+def summarize(llm, content):
+    """Génère le résumé d'un markdown enrichi avec un modèle chargé."""
+    # Construire le prompt
+    prompt = f"""[INST] Tu es un expert financier. Fais un résumé clair et bien structuré de ce document financier.
+{SUMMARY_POINTS}
 
 Document :
 
 {content}
 
 [/INST]"""
+    return generate(llm, prompt)
+
+def summarize_json(llm, data):
+    """Génère le résumé à partir du kid.json déjà extrait.
+
+    Le prompt ne contient que les champs extraits, bien plus courts que le document :
+    le document n'est évalué qu'une fois, par l'extraction.
+    """
+    prompt = f"""[INST] Tu es un expert financier. Fais un résumé clair et bien structuré d'un document financier à partir des informations clés qui en ont été extraites ci-dessous (format JSON).
+{SUMMARY_POINTS}
+
+N'invente aucune information absente du JSON.
+
+Informations clés :
+
+{json.dumps(data, indent=2, ensure_ascii=False)}
+
+[/INST]"""
+    return generate(llm, prompt)
+
+def main(input_file=None, output_file=None, json_file=None):
+    """Génère le résumé du document.
+
+    Le modèle est celui du service partagé (model_service.py) : dans un worker qui a
+    déjà chargé le modèle d'extraction, il n'est pas rechargé.
+
+    Args:
+        input_file: Markdown enrichi (par défaut LLM/inputs/input.txt)
+        output_file: Fichier du résumé (par défaut LLM/outputs/resume.txt)
+        json_file: kid.json extrait ; s'il est fourni, le résumé est dérivé de ses
+            champs au lieu de réévaluer le document entier
+    """
+    try:
+        # Charger la configuration
+        config = load_config()
+        service = get_model_service(config["model"])
+        project_root = str(Path(__file__).parent.parent.parent)
 
-        # Génération de la réponse
-        response = llm(
-            prompt,
-            max_tokens=2048,
-            temperature=0.1,
-            stop=None,
-            echo=False
-        )
-
-        # Traitement de la réponse
-        response_text = response["choices"][0]["text"].strip()
+        if json_file:
+            with open(json_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            response_text = service.run(summarize_json, data)
+        else:
+            # Lire le fichier d'entrée
+            input_file = input_file or os.path.join(project_root, "LLM", "inputs", "input.txt")
+            content = read_input_file(input_file)
+            response_text = service.run(summarize, content)
         
         # Sauvegarder le résumé
-        output_file = os.path.join(project_root, "LLM", "outputs", "resume.txt")
+        output_file = output_file or os.path.join(project_root, "LLM", "outputs", "resume.txt")
         with open(output_file, 'w', encoding='utf-8') as f:
             f.write(response_text)
         
@@ -91,4 +135,12 @@ Document :
         raise
 
 if __name__ == "__main__":
-    main()
+    import sys
+    if len(sys.argv) == 4 and sys.argv[1] == "--from-json":
+        main(output_file=sys.argv[3], json_file=sys.argv[2])
+        sys.exit(0)
+    if len(sys.argv) not in (1, 3):
+        print("Usage: python resume.py [<input_file> <output_file>]")
+        print("       python resume.py --from-json <kid.json> <output_file>")
+        sys.exit(1)
+    main(*sys.argv[1:])
@@ -0,0 +1,125 @@
+"""Génération de la grammaire GBNF à partir du schéma d'extraction.
+
+La grammaire contraint le décodage de llama.cpp à un objet JSON de la forme de
+``json_schema.json`` : chaque section et chaque champ dans l'ordre du schéma, des
+chaînes pour les champs "str" et les dates, des nombres (ou null) pour les champs
+"float" et "int", des tableaux pour les listes. La génération s'arrête donc à
+l'accolade fermante de l'objet racine.
+
+Le format de gabarit du projet (section -> champ -> nom de type) et les
+documents JSON Schema standard sont tous deux pris en charge.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import re
+from typing import Any, Dict, List, Optional
+
+try:
+    import llama_cpp
+except ImportError:
+    # Seul le backend factice (KID_LLM_BACKEND=fake) fonctionne sans llama-cpp-python
+    llama_cpp = None
+
+logger = logging.getLogger(__name__)
+
+# Règles communes ; les valeurs ne consomment pas les espaces qui les suivent, les
+# conteneurs si. Les espaces sont bornés comme dans le json.gbnf de llama.cpp (un retour
+# à la ligne et jusqu'à 20 caractères d'indentation), sinon le modèle peut épuiser tout
+# son budget de tokens en lignes vides.
+BASE_RULES = r'''ws ::= | " " | "\n" [ \t]{0,20}
+string ::= "\"" ( [^"\\\x7F\x00-\x1F] | "\\" (["\\/bfnrt] | "u" [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F] [0-9a-fA-F]) )* "\""
+number ::= "-"? ([0-9] | [1-9] [0-9]*) ("." [0-9]+)? ([eE] [-+]? [0-9]+)?
+boolean ::= "true" | "false"
+null ::= "null"
+value ::= object | array | string | number | boolean | null
+object ::= "{" ws ( string ws ":" ws value ws ( "," ws string ws ":" ws value ws )* )? "}"
+array ::= "[" ws ( value ws ( "," ws value ws )* )? "]"'''
+
+# Noms de type du gabarit -> règle de la grammaire. Un nombre absent vaut null, comme le
+# demande le prompt, et non "" que la validation refuse pour un champ numérique.
+TEMPLATE_TYPES = {
+    "str": "string",
+    "YYYY-MM-DD": "string",
+    "float": "(number | null)",
+    "int": "(number | null)",
+    "bool": "boolean",
+}
+
+
+def is_json_schema(schema: Dict[str, Any]) -> bool:
+    """True pour un document JSON Schema standard, False pour le format de gabarit."""
+    return isinstance(schema.get("type"), str) or isinstance(schema.get("properties"), dict)
+
+
+def _literal(text: str) -> str:
+    """Littéral GBNF correspondant à l'encodage JSON d'une clé."""
+    encoded = json.dumps(text, ensure_ascii=False)
+    return '"' + encoded.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+class _TemplateGrammar:
+    """Construit une règle par objet du gabarit, nommée d'après son chemin."""
+
+    def __init__(self):
+        self.rules: Dict[str, str] = {}
+
+    def rule_name(self, path: List[str]) -> str:
+        base = re.sub(r"[^a-zA-Z0-9]+", "-", "-".join(path)).strip("-").lower() or "root"
+        name, index = base, 1
+        while name in self.rules or name in ("ws", "string", "number", "boolean", "null",
+                                             "value", "object", "array"):
+            index += 1
+            name = f"{base}-{index}"
+        return name
+
+    def rule_for(self, template: Any, path: List[str]) -> str:
+        """Expression de la grammaire pour un nœud du gabarit."""
+        if isinstance(template, dict):
+            name = self.rule_name(path)
+            # Réservé avant la récursion pour que les règles imbriquées aient des noms distincts
+            self.rules[name] = ""
+            members = [
+                f'{_literal(key)} ws ":" ws {self.rule_for(value, path + [key])} ws'
+                for key, value in template.items()
+            ]
+            self.rules[name] = '"{" ws ' + ' "," ws '.join(members) + ' "}"' if members else '"{" ws "}"'
+            return name
+        if isinstance(template, list):
+            if not template:
+                return "array"
+            item = self.rule_for(template[0], path + ["item"])
+            return f'("[" ws ( {item} ws ( "," ws {item} ws )* )? "]")'
+        return TEMPLATE_TYPES.get(template, "value")
+
+
+def template_to_gbnf(template: Dict[str, Any]) -> str:
+    """Grammaire GBNF pour le format de gabarit du projet."""
+    builder = _TemplateGrammar()
+    root = builder.rule_for(template, ["kid"])
+    rules = [f"root ::= {root}"] + [f"{name} ::= {body}" for name, body in builder.rules.items()]
+    return "\n".join(rules) + "\n" + BASE_RULES + "\n"
+
+
+_grammars: Dict[str, llama_cpp.LlamaGrammar] = {}
+
+
+def load_grammar(schema: Dict[str, Any]) -> Optional[llama_cpp.LlamaGrammar]:
+    """Grammaire compilée d'un schéma, construite une fois par contenu de schéma.
+
+    Retourne None si llama-cpp-python n'est pas installé (backend factice).
+    """
+    if llama_cpp is None:
+        return None
+    schema_json = json.dumps(schema, sort_keys=True)
+    key = hashlib.sha256(schema_json.encode("utf-8")).hexdigest()
+    if key not in _grammars:
+        if is_json_schema(schema):
+            _grammars[key] = llama_cpp.LlamaGrammar.from_json_schema(schema_json, verbose=False)
+        else:
+            _grammars[key] = llama_cpp.LlamaGrammar.from_string(template_to_gbnf(schema), verbose=False)
+        logger.info("Grammaire GBNF générée à partir du schéma JSON")
+    return _grammars[key]
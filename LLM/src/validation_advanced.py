@@ -1,91 +1,161 @@
-"""Advanced document validation module."""
+"""Advanced document validation module.
 
-from typing import List, Dict, Any
+The JSON schema is read once per process and compiled into a flat list of field
+checks (path, expected type, container kind), reused by every validation.
+"""
+
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Optional, Tuple
 import logging
 import json
 import os
+import time
 
 logger = logging.getLogger(__name__)
 
+SCHEMA_PATH = os.path.join(os.path.dirname(__file__), '..', 'configs', 'json_schema.json')
+
+# Feedback for a field whose value has the wrong type
+TYPE_MESSAGES = {
+    "list": "should be a list",
+    "str": "should be a string",
+    "float": "should be a number",
+    "YYYY-MM-DD": "should be a date string",
+}
+TYPE_CHECKS = {
+    "str": str,
+    # null: number missing from the document
+    "float": (int, float, type(None)),
+    "YYYY-MM-DD": str,
+}
+
 class ValidationResult:
     """Container for validation results."""
     def __init__(self, score: float = 0.0, feedback: List[str] = None):
         self.score = score
         self.feedback = feedback or []
 
-class DocumentValidator:
-    """Advanced document validator."""
-    
-    def __init__(self):
-        """Initialize validator with schema."""
-        schema_path = os.path.join(os.path.dirname(__file__), '..', 'configs', 'json_schema.json')
+@dataclass(frozen=True)
+class FieldCheck:
+    """One check of the compiled schema.
+
+    Attributes:
+        path: Keys from the document root ((section,), (section, field) or
+            (section, field, subfield))
+        expected: Template type name ("str", "float", "YYYY-MM-DD"...), or None
+            when only the presence of the key is checked
+        kind: Container kind of the schema node: "dict", "list" or "value"
+    """
+    path: Tuple[str, ...]
+    expected: Optional[str]
+    kind: str
+
+class CompiledSchema:
+    """JSON schema compiled into the flat, ordered list of checks of the validator."""
+
+    def __init__(self, schema: Dict[str, Any]):
+        self.schema = schema
+        self.checks = compile_checks(schema)
+        self.total_fields = sum(len(section.keys()) for section in schema.values())
+
+def _kind(template: Any) -> str:
+    if isinstance(template, dict):
+        return "dict"
+    if isinstance(template, list):
+        return "list"
+    return "value"
+
+def compile_checks(schema: Dict[str, Any]) -> List[FieldCheck]:
+    """Flatten the schema in document order: each section, its fields, their subfields."""
+    checks = []
+    for section, section_schema in schema.items():
+        checks.append(FieldCheck((section,), None, "dict"))
+        for field, field_type in section_schema.items():
+            kind = _kind(field_type)
+            expected = field_type if kind == "value" else None
+            checks.append(FieldCheck((section, field), expected, kind))
+            if kind == "dict":
+                checks.extend(FieldCheck((section, field, subfield), None, _kind(subfield_type))
+                              for subfield, subfield_type in field_type.items())
+    return checks
+
+# Value of a key absent from the document
+_MISSING = object()
+
+_compiled: Dict[Tuple[str, float], CompiledSchema] = {}
+
+def load_schema(schema_path: str = SCHEMA_PATH) -> CompiledSchema:
+    """Compiled schema of a file, read again only when the file changes."""
+    try:
+        key = (os.path.abspath(schema_path), os.path.getmtime(schema_path))
+    except OSError as e:
+        logger.error(f"Error loading schema: {str(e)}")
+        return CompiledSchema({})
+    if key not in _compiled:
         try:
             with open(schema_path, 'r') as f:
-                self.schema = json.load(f)
+                schema = json.load(f)
         except Exception as e:
             logger.error(f"Error loading schema: {str(e)}")
-            self.schema = {}
+            schema = {}
+        _compiled.clear()
+        _compiled[key] = CompiledSchema(schema)
+    return _compiled[key]
+
+class DocumentValidator:
+    """Advanced document validator."""
+
+    def __init__(self, compiled: Optional[CompiledSchema] = None):
+        """Initialize validator with the compiled schema (loaded once per process)."""
+        self.compiled = compiled or load_schema()
+        self.schema = self.compiled.schema
 
     def validate(self, data: Dict[str, Any]) -> ValidationResult:
         """
         Validate document analysis results against JSON schema.
-        
+
         Args:
             data: Document analysis data
-            
+
         Returns:
             ValidationResult with score and feedback
         """
         try:
             feedback = []
-            score = 0.0
-            
-            # Validate main sections
-            for section in self.schema:
-                if section not in data:
-                    feedback.append(f"Missing section: {section}")
+            # Values of the sections and fields found so far, by path
+            values = {(): data}
+
+            for check in self.compiled.checks:
+                parent = values.get(check.path[:-1], _MISSING)
+                if parent is _MISSING:
+                    # Parent missing: already reported
+                    continue
+                key = check.path[-1]
+                if not isinstance(parent, dict) or key not in parent:
+                    feedback.append(self._missing(check.path))
+                    continue
+                value = parent[key]
+                values[check.path] = value
+
+                if len(check.path) != 2:
                     continue
-                
-                section_data = data[section]
-                section_schema = self.schema[section]
-                
-                # Check fields in section
-                for field, field_type in section_schema.items():
-                    if field not in section_data:
-                        feedback.append(f"Missing field '{field}' in section '{section}'")
-                        continue
-                        
-                    value = section_data[field]
-                    
-                    # Handle nested objects
-                    if isinstance(field_type, dict):
-                        for subfield, subfield_type in field_type.items():
-                            if subfield not in value:
-                                feedback.append(f"Missing subfield '{subfield}' in '{section}.{field}'")
-                    
-                    # Handle arrays
-                    elif isinstance(field_type, list):
-                        if not isinstance(value, list):
-                            feedback.append(f"Field '{section}.{field}' should be a list")
-                    
-                    # Handle basic types
-                    elif field_type == "str" and not isinstance(value, str):
-                        feedback.append(f"Field '{section}.{field}' should be a string")
-                    elif field_type == "float" and not isinstance(value, (int, float)):
-                        feedback.append(f"Field '{section}.{field}' should be a number")
-                    elif field_type == "YYYY-MM-DD" and not isinstance(value, str):
-                        feedback.append(f"Field '{section}.{field}' should be a date string")
-            
+                field_path = ".".join(check.path)
+                if check.kind == "list":
+                    if not isinstance(value, list):
+                        feedback.append(f"Field '{field_path}' {TYPE_MESSAGES['list']}")
+                elif check.expected in TYPE_CHECKS and not isinstance(value, TYPE_CHECKS[check.expected]):
+                    feedback.append(f"Field '{field_path}' {TYPE_MESSAGES[check.expected]}")
+
             # Calculate score based on completeness
-            total_fields = sum(len(section.keys()) for section in self.schema.values())
+            total_fields = self.compiled.total_fields
             valid_fields = total_fields - len(feedback)
             score = valid_fields / total_fields if total_fields > 0 else 0.0
-            
+
             return ValidationResult(
                 score=round(score, 2),
                 feedback=feedback
             )
-            
+
         except Exception as e:
             logger.error(f"Validation error: {e}")
             return ValidationResult(
@@ -93,35 +163,105 @@ class DocumentValidator:
                 feedback=[f"Validation failed: {str(e)}"]
             )
 
-def validate_document(data: str | Dict[str, Any]) -> ValidationResult:
+    @staticmethod
+    def _missing(path: Tuple[str, ...]) -> str:
+        if len(path) == 1:
+            return f"Missing section: {path[0]}"
+        if len(path) == 2:
+            return f"Missing field '{path[1]}' in section '{path[0]}'"
+        return f"Missing subfield '{path[2]}' in '{path[0]}.{path[1]}'"
+
+def _parse(data: str | Dict[str, Any]) -> Dict[str, Any] | ValidationResult:
+    """Dictionary of a document, or the failed ValidationResult of an unreadable string."""
+    if not isinstance(data, str):
+        return data
+    # A string is parsed as JSON first
+    try:
+        # Clean the string
+        data = data.strip()
+        # Find the JSON object in the string
+        start_idx = data.find('{')
+        end_idx = data.rfind('}') + 1
+        if start_idx != -1 and end_idx > start_idx:
+            # Parse the JSON
+            return json.loads(data[start_idx:end_idx])
+        return ValidationResult(
+            score=0.0,
+            feedback=["No valid JSON object found in input"]
+        )
+    except json.JSONDecodeError as e:
+        return ValidationResult(
+            score=0.0,
+            feedback=[f"Invalid JSON: {str(e)}"]
+        )
+
+def validate_document(data: str | Dict[str, Any],
+                      compiled: Optional[CompiledSchema] = None) -> ValidationResult:
     """Main entry point for document validation.
-    
+
     Args:
         data: Either a JSON string or a dictionary
+        compiled: Schema to validate against (default: json_schema.json)
     """
-    validator = DocumentValidator()
-    
-    # Si on reçoit une chaîne, essayer de la parser en JSON
-    if isinstance(data, str):
-        try:
-            # Nettoyer la chaîne
-            data = data.strip()
-            # Trouver le JSON dans la chaîne
-            start_idx = data.find('{')
-            end_idx = data.rfind('}') + 1
-            if start_idx != -1 and end_idx > start_idx:
-                data = data[start_idx:end_idx]
-                # Parser le JSON
-                data = json.loads(data)
-            else:
-                return ValidationResult(
-                    score=0.0,
-                    feedback=["No valid JSON object found in input"]
-                )
-        except json.JSONDecodeError as e:
-            return ValidationResult(
-                score=0.0,
-                feedback=[f"Invalid JSON: {str(e)}"]
-            )
-            
-    return validator.validate(data)
+    return validate_many([data], compiled)[0]
+
+def validate_many(docs: Iterable[str | Dict[str, Any]],
+                  compiled: Optional[CompiledSchema] = None) -> List[ValidationResult]:
+    """Validate a batch of documents with a single validator.
+
+    Args:
+        docs: JSON strings or dictionaries
+        compiled: Schema to validate against (default: json_schema.json)
+    """
+    validator = DocumentValidator(compiled)
+    results = []
+    for doc in docs:
+        parsed = _parse(doc)
+        results.append(parsed if isinstance(parsed, ValidationResult) else validator.validate(parsed))
+    return results
+
+def benchmark_validation(docs: List[Dict[str, Any]], schema_path: str = SCHEMA_PATH,
+                         runs: int = 100) -> Dict[str, float]:
+    """Average time per document: schema read and compiled on each call vs. validate_many.
+
+    Args:
+        docs: Documents to validate (for instance extracted kid.json files)
+        runs: Number of passes over docs
+    """
+    count = len(docs) * runs
+
+    start = time.perf_counter()
+    for _ in range(runs):
+        for doc in docs:
+            # Previous behaviour: schema read and parsed on every validation
+            with open(schema_path, 'r') as f:
+                schema = json.load(f)
+            DocumentValidator(CompiledSchema(schema)).validate(doc)
+    per_call = (time.perf_counter() - start) / count
+
+    compiled = load_schema(schema_path)
+    start = time.perf_counter()
+    for _ in range(runs):
+        validate_many(docs, compiled)
+    batched = (time.perf_counter() - start) / count
+
+    report = {
+        "documents": count,
+        "per_call_schema_us": per_call * 1e6,
+        "validate_many_us": batched * 1e6,
+        "speedup": per_call / batched if batched else 0.0,
+    }
+    logger.info(f"Validation benchmark: {report}")
+    return report
+
+if __name__ == "__main__":
+    import sys
+    if len(sys.argv) < 3 or sys.argv[1] != "--benchmark":
+        print("Usage: python validation_advanced.py --benchmark <kid.json> [<kid.json> ...]")
+        sys.exit(1)
+    logging.basicConfig(level=logging.INFO)
+    documents = []
+    for path in sys.argv[2:]:
+        with open(path, 'r', encoding='utf-8') as f:
+            documents.append(json.load(f))
+    print(json.dumps(benchmark_validation(documents), indent=2))
@@ -1,9 +1,20 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
+import fcntl
 import os
 import subprocess
+import threading
 import json
+import time
 from werkzeug.utils import secure_filename
+from job_store import JobStore, STATUS_DONE, STATUS_FAILED
+from jobs import JOBS_ROOT, PIPELINE_STAGES, JobScheduler, JobWorkspace, SchedulerFull
+from metrics import (REGISTRY, JOB_DURATION, QUEUE_DEPTH, QUEUE_WAIT, RESULT_CACHE_LOOKUPS, STAGE_DURATION,
+                     UPLOAD_SIZE, Gauge, record_observation)
+from pipeline_worker import WarmPipeline
+from profiling import MERGED_TRACE, job_profile, merge_traces, record_span, span
+from result_cache import ResultCache, fake_backends
+from stage_metrics import parse_metric_line
 
 app = Flask(__name__)
 CORS(app)  # Enable CORS for all routes
@@ -12,72 +23,390 @@ CORS(app)  # Enable CORS for all routes
 PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
 
 # Configuration with absolute paths
-UPLOAD_FOLDER = os.path.join(PROJECT_ROOT, 'uploads')
+UPLOAD_FOLDER = JOBS_ROOT  # one sub-directory per job
 ALLOWED_EXTENSIONS = {'pdf'}
 JSON_OUTPUT_PATH = os.path.join(PROJECT_ROOT, 'LLM', 'outputs', 'kid.json')
 
+# 'script' runs run_pipeline.sh for each upload, 'worker' uses the persistent workers
+PIPELINE_MODE = os.environ.get('KID_PIPELINE_MODE', 'script')
+
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 
+warm_pipeline = WarmPipeline() if PIPELINE_MODE == 'worker' else None
+
+# Bounded pool: at most KID_MAX_JOBS analyses run in parallel
+scheduler = JobScheduler()
+
+# Scheduler load, read at each /metrics scrape
+REGISTRY.register(Gauge('kid_jobs_queued', 'Jobs waiting for a free slot', function=lambda: scheduler.queued))
+REGISTRY.register(Gauge('kid_jobs_running', 'Jobs being analysed', function=lambda: scheduler.running))
+
+# Persistent job state (SQLite), shared by all endpoints
+job_store = JobStore()
+
+# Stage artifacts keyed by PDF hash and stage versions (KID_CACHE_DIR, KID_CACHE_MAX_BYTES).
+# Disabled with fake model backends, whose output must never be served as a real analysis.
+result_cache = ResultCache() if os.environ.get('KID_CACHE', '1') == '1' and not fake_backends() else None
+if fake_backends():
+    print(f"Result cache disabled: fake model backends selected ({', '.join(fake_backends())})")
+
+# Stage markers printed by run_pipeline.sh
+SCRIPT_STAGE_MARKERS = {
+    'Étape 1': 'parse',
+    'Étape 2': 'enrich',
+    'Étape 3': 'extract',
+}
+STREAM_POLL_INTERVAL = 0.5
+# Prefix of the kid.json sections printed by llm_test_options.py --stream-sections
+SECTION_MARKER = '@@KID_SECTION '
+# Timings recorded in kid_stage_duration_seconds
+OBSERVED_TIMINGS = ('cache_lookup',) + PIPELINE_STAGES
+
 # Create uploads directory if it doesn't exist
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-def run_pipeline(pdf_path):
-    """Run the analysis pipeline on the uploaded PDF."""
+def format_server_timing(timings):
+    """Format stage timings (seconds) as a Server-Timing header value."""
+    return ', '.join(f"{name};dur={duration * 1000:.0f}" for name, duration in timings.items())
+
+def publish_latest_json(result):
+    """Atomically replace LLM/outputs/kid.json, still served by /kid-json."""
+    tmp_path = f"{JSON_OUTPUT_PATH}.{os.getpid()}.{time.monotonic_ns()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(result, f, indent=2, ensure_ascii=False)
+    os.replace(tmp_path, JSON_OUTPUT_PATH)
+
+def run_pipeline(workspace, on_stage=None, on_section=None, on_metric=None, profile_dir=None):
+    """Run the analysis pipeline on the PDF of a job workspace, through the result cache.
+
+    Args:
+        workspace: Job directory holding the uploaded PDF
+        on_stage: Optional callback receiving each stage name when it starts, and
+            ``cached=True`` for the stages restored from the cache
+        on_section: Optional callback receiving each top-level kid.json section
+            (name, value) as soon as the LLM has generated it
+        on_metric: Optional callback receiving the stage_metrics observations made
+            inside the stages
+        profile_dir: Optional directory receiving the CPU profile and span trace
+            of each stage (see profiling.py)
+
+    Returns:
+        Tuple containing the kid.json content and the per-stage timings in seconds.
+    """
     try:
-        print(f"Processing PDF: {pdf_path}")
-
-        # Run the pipeline script
-        print("Running pipeline script...")
-        result = subprocess.run(['./run_pipeline.sh', pdf_path], 
-                             capture_output=True, 
-                             text=True)
-        print(f"Pipeline script output:\n{result.stdout}")
-        print(f"Pipeline script error:\n{result.stderr}")
-        
-        if result.returncode != 0:
-            raise Exception(f"Pipeline failed: {result.stderr}")
-
-        # Read and return the JSON output
-        with open(JSON_OUTPUT_PATH, 'r') as f:
-            return json.load(f)
+        print(f"Processing PDF: {workspace.pdf_path}")
+        if result_cache is None:
+            return run_stages(workspace, on_stage, on_section=on_section, on_metric=on_metric,
+                              profile_dir=profile_dir)
+
+        start = time.perf_counter()
+        with span('cache_lookup'):
+            keys = result_cache.keys_for(workspace.pdf_path)
+            result = result_cache.get_result(keys)
+        if result is not None:
+            print("Result cache hit")
+            RESULT_CACHE_LOOKUPS.inc(outcome='hit')
+            publish_latest_json(result)
+            if on_stage is not None:
+                for stage in PIPELINE_STAGES:
+                    on_stage(stage, cached=True)
+            return result, {'cache_lookup': time.perf_counter() - start}
+
+        with span('cache_restore'):
+            from_stage = result_cache.restore(workspace, keys)
+        RESULT_CACHE_LOOKUPS.inc(outcome='miss' if from_stage == PIPELINE_STAGES[0] else 'partial')
+        if on_stage is not None:
+            for stage in PIPELINE_STAGES[:PIPELINE_STAGES.index(from_stage)]:
+                on_stage(stage, cached=True)
+        timings = {'cache_lookup': time.perf_counter() - start}
+
+        result, stage_timings = run_stages(workspace, on_stage, from_stage, on_section, on_metric, profile_dir)
+        timings.update(stage_timings)
+        with span('cache_store'):
+            result_cache.store(workspace, keys, from_stage)
+        return result, timings
 
     except Exception as e:
         raise Exception(f"Error running pipeline: {str(e)}")
 
-@app.route('/analyze', methods=['POST'])
-def analyze_pdf():
-    """Endpoint to analyze a PDF file."""
+def run_stages(workspace, on_stage=None, from_stage='parse', on_section=None, on_metric=None,
+               profile_dir=None):
+    """Run the pipeline stages from ``from_stage`` with the workers or run_pipeline.sh."""
+    if warm_pipeline is not None:
+        # In memory mode the stage outputs only need to be written for the result cache
+        result, timings = warm_pipeline.run(workspace, on_stage=on_stage, from_stage=from_stage,
+                                            save_artifacts=result_cache is not None,
+                                            on_section=on_section, on_metric=on_metric,
+                                            profile_dir=profile_dir)
+        print(f"Pipeline timings: {timings}")
+        publish_latest_json(result)
+        return result, timings
+
+    start = time.perf_counter()
+    # Run the pipeline script
+    print("Running pipeline script...")
+    # KID_STAGE_METRICS: the stages print their observations for /metrics
+    env = {**os.environ, 'KID_STAGE_METRICS': '1'}
+    if profile_dir is not None:
+        env['KID_PROFILE_DIR'] = profile_dir
+    process = subprocess.Popen(['./run_pipeline.sh', workspace.pdf_path, workspace.dir, from_stage],
+                               stdout=subprocess.PIPE,
+                               stderr=subprocess.STDOUT,
+                               text=True,
+                               cwd=PROJECT_ROOT,
+                               env=env)
+    output = []
+    stage_starts = []
+    for line in process.stdout:
+        if line.startswith(SECTION_MARKER):
+            if on_section is not None:
+                section = json.loads(line[len(SECTION_MARKER):])
+                on_section(section['section'], section['value'])
+            continue
+        observation = parse_metric_line(line)
+        if observation is not None:
+            if on_metric is not None:
+                on_metric(observation)
+            continue
+        output.append(line)
+        for marker, stage in SCRIPT_STAGE_MARKERS.items():
+            if marker in line:
+                stage_starts.append((stage, time.perf_counter()))
+                if on_stage is not None:
+                    on_stage(stage)
+    process.wait()
+    end = time.perf_counter()
+    print(f"Pipeline script output:\n{''.join(output)}")
+    
+    if process.returncode != 0:
+        raise Exception(f"Pipeline failed: {''.join(output[-20:])}")
+
+    # Read and return the JSON output
+    with open(workspace.json_path, 'r') as f:
+        output = json.load(f)
+    publish_latest_json(output)
+    # A stage lasts until the marker of the next one
+    timings = {}
+    for (stage, stage_start), (_, next_start) in zip(stage_starts, stage_starts[1:] + [(None, end)]):
+        timings[stage] = next_start - stage_start
+        record_span(stage, stage_start, next_start)
+    timings['total'] = end - start
+    return output, timings
+
+def observe_timings(timings):
+    """Record the stage timings of a job in the /metrics histograms."""
+    for stage in OBSERVED_TIMINGS:
+        if stage in timings:
+            STAGE_DURATION.observe(timings[stage], stage=stage)
+
+def execute_job(workspace, submitted_at=None, profile=False):
+    """Run a job from the scheduler and record its progress in the job store.
+
+    Args:
+        submitted_at: time.perf_counter() when the job was submitted, for the
+            queue wait metric (None for resumed jobs)
+        profile: Write a CPU profile of each stage and a trace of the job
+            (trace.json) to ``workspace.profile_dir``
+    """
+    job_id = workspace.job_id
+    start = time.perf_counter()
+    if submitted_at is not None:
+        QUEUE_WAIT.observe(start - submitted_at)
+    profile_dir = workspace.profile_dir if profile else None
+    try:
+        job_store.mark_running(job_id)
+        # The server only records spans: cProfile would also see the other jobs' threads
+        with job_profile(profile_dir, 'server', cpu=False):
+            if submitted_at is not None:
+                record_span('queue_wait', submitted_at, start)
+            result, timings = run_pipeline(
+                workspace,
+                on_stage=lambda stage, cached=False: job_store.start_stage(job_id, stage, cached),
+                on_section=lambda name, value: job_store.add_section(job_id, name, value),
+                on_metric=record_observation,
+                profile_dir=profile_dir,
+            )
+        job_store.complete(job_id, result, timings)
+        observe_timings(timings)
+        JOB_DURATION.observe(time.perf_counter() - start, status=STATUS_DONE)
+        return result, timings
+    except Exception as e:
+        job_store.fail(job_id, str(e))
+        JOB_DURATION.observe(time.perf_counter() - start, status=STATUS_FAILED)
+        raise
+    finally:
+        if profile_dir is not None:
+            merge_traces(profile_dir)
+        workspace.cleanup()
+
+def submit_job(file, profile=False):
+    """Save an uploaded PDF in a new job directory and schedule its analysis.
+
+    Args:
+        profile: Profile the job (see execute_job)
+
+    Returns:
+        Tuple containing the job id and the scheduler future.
+    """
+    filename = secure_filename(file.filename) or 'document.pdf'
+    workspace = JobWorkspace.create(filename, root=app.config['UPLOAD_FOLDER'])
+    file.save(workspace.pdf_path)
+    UPLOAD_SIZE.observe(os.path.getsize(workspace.pdf_path))
+    job_store.create(workspace.job_id, filename)
+    QUEUE_DEPTH.observe(scheduler.queued)
+    try:
+        future = scheduler.submit(execute_job, workspace, time.perf_counter(), profile)
+    except SchedulerFull:
+        job_store.delete(workspace.job_id)
+        workspace.cleanup()
+        raise
+    return workspace.job_id, future
+
+def resume_interrupted_jobs():
+    """Reschedule the jobs left queued or running by a previous run of the server."""
+    for job in job_store.active_jobs():
+        workspace = JobWorkspace(job['id'], job['filename'], root=app.config['UPLOAD_FOLDER'])
+        if not os.path.exists(workspace.pdf_path):
+            job_store.fail(job['id'], 'Job interrupted by a server restart')
+            continue
+        print(f"Resuming job {job['id']}")
+        job_store.requeue(job['id'])
+        try:
+            scheduler.submit(execute_job, workspace)
+        except SchedulerFull:
+            job_store.fail(job['id'], 'Job interrupted by a server restart')
+            workspace.cleanup()
+
+# Interrupted jobs are resumed by a single serving process: the first one to lock
+# this file, which it holds until it exits
+RESUME_LOCK_PATH = job_store.db_path + '.resume.lock'
+resume_guard = threading.Lock()
+resume_lock_file = None
+resume_checked = False
+
+@app.before_request
+def resume_interrupted_jobs_once():
+    """Resume the interrupted jobs when this process serves its first request.
+
+    Runs in the processes that actually serve (the debug reloader's child, each
+    worker of a WSGI server), not in those that merely import the app. Only the
+    process holding RESUME_LOCK_PATH resumes the jobs, so they run once.
+    """
+    global resume_checked, resume_lock_file
+    with resume_guard:
+        if resume_checked:
+            return
+        resume_checked = True
+        lock_file = open(RESUME_LOCK_PATH, 'w')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            # Another process of this server resumes them
+            lock_file.close()
+            return
+        resume_lock_file = lock_file
+    resume_interrupted_jobs()
+
+def profile_requested():
+    """True if the request asks for a profiled job (?profile=1 or a 'profile' form field)."""
+    return request.values.get('profile', '').lower() in ('1', 'true', 'yes')
+
+def get_uploaded_file():
+    """Return the uploaded PDF, or an error response tuple."""
     if 'file' not in request.files:
-        return jsonify({'error': 'No file part'}), 400
+        return None, (jsonify({'error': 'No file part'}), 400)
     
     file = request.files['file']
     if file.filename == '':
-        return jsonify({'error': 'No selected file'}), 400
+        return None, (jsonify({'error': 'No selected file'}), 400)
     
-    if file and allowed_file(file.filename):
-        # Create upload folder if it doesn't exist
-        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-        
-        # Save the uploaded file
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(file_path)
-        
-        try:
-            # Process the PDF and get results
-            result = run_pipeline(file_path)
-            return jsonify(result)
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
-        finally:
-            # Clean up uploaded file
-            if os.path.exists(file_path):
-                os.remove(file_path)
+    if not allowed_file(file.filename):
+        return None, (jsonify({'error': 'Invalid file type'}), 400)
+    return file, None
+
+@app.route('/jobs', methods=['POST'])
+def create_job():
+    """Endpoint to submit a PDF for asynchronous analysis."""
+    file, error = get_uploaded_file()
+    if error:
+        return error
     
-    return jsonify({'error': 'Invalid file type'}), 400
+    profile = profile_requested()
+    try:
+        job_id, _ = submit_job(file, profile)
+    except SchedulerFull as e:
+        return jsonify({'error': str(e)}), 503
+    
+    response = {'id': job_id, 'status_url': f'/jobs/{job_id}', 'events_url': f'/jobs/{job_id}/events'}
+    if profile:
+        response['trace_url'] = f'/jobs/{job_id}/trace'
+    return jsonify(response), 202
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Endpoint to get the status, per-stage progress and result of a job."""
+    job = job_store.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(job)
+
+def parse_last_event_id(value):
+    """Sequence number of the last event a reconnecting client received (0 if absent or invalid)."""
+    try:
+        return max(0, int(value))
+    except (TypeError, ValueError):
+        return 0
+
+@app.route('/jobs/<job_id>/events', methods=['GET'])
+def stream_job_events(job_id):
+    """Server-sent events stream of a job: stage transitions, each kid.json section
+    as soon as the LLM has generated it ('section' events), then the final kid.json."""
+    if job_store.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    last_seq = parse_last_event_id(request.headers.get('Last-Event-ID'))
+
+    def generate():
+        seq = last_seq
+        while True:
+            # Status read before the events: the events of a job finishing in between
+            # are still sent by this pass before the stream ends
+            finished = job_store.get(job_id)['status'] in (STATUS_DONE, STATUS_FAILED)
+            for event in job_store.events_since(job_id, seq):
+                seq = event['seq']
+                yield f"id: {seq}\nevent: {event['event']}\ndata: {json.dumps(event['data'], ensure_ascii=False)}\n\n"
+                if event['event'] in ('result', 'error'):
+                    return
+            if finished:
+                return
+            time.sleep(STREAM_POLL_INTERVAL)
+
+    return Response(stream_with_context(generate()), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/analyze', methods=['POST'])
+def analyze_pdf():
+    """Endpoint to analyze a PDF file and wait for the result."""
+    file, error = get_uploaded_file()
+    if error:
+        return error
+    
+    try:
+        # Process the PDF and get results
+        profile = profile_requested()
+        job_id, future = submit_job(file, profile)
+        result, timings = future.result()
+        response = jsonify(result)
+        response.headers['Server-Timing'] = format_server_timing(timings)
+        if profile:
+            response.headers['X-Profile-Trace'] = f'/jobs/{job_id}/trace'
+        return response
+    except SchedulerFull as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
 
 @app.route('/kid-json', methods=['GET'])
 def get_kid_json():
@@ -87,5 +416,23 @@ def get_kid_json():
     except Exception as e:
         return jsonify({'error': f'Error reading kid.json: {str(e)}'}), 500
 
+@app.route('/jobs/<job_id>/trace', methods=['GET'])
+def get_job_trace(job_id):
+    """Endpoint to download the Chrome trace of a profiled job (chrome://tracing, Perfetto).
+
+    The CPU profiles of the stages (<stage>.prof) are in the same directory.
+    """
+    if job_store.get(job_id) is None:
+        return jsonify({'error': 'Unknown job'}), 404
+    trace_path = os.path.join(JobWorkspace(job_id).profile_dir, MERGED_TRACE)
+    if not os.path.exists(trace_path):
+        return jsonify({'error': 'No trace for this job'}), 404
+    return send_file(trace_path, mimetype='application/json')
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Endpoint exposing the service metrics in the Prometheus text format."""
+    return Response(REGISTRY.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
 if __name__ == '__main__':
     app.run(debug=True, port=5001)
@@ -0,0 +1,232 @@
+"""
+Batch Pipeline
+Runs the pipeline over a directory of PDFs or a manifest, for backfills of many KIDs.
+
+The stages overlap like a CPU pipeline: while llama.cpp extracts document N, Qwen2-VL
+describes the images of document N+1 and MinerU parses document N+2. Each stage has
+its own persistent worker (pipeline_worker.py "mineru", "vlm" and "llama") and its
+own thread, and the stages are connected by bounded queues so that a fast stage never
+runs more than ``queue_size`` documents ahead of the next one.
+
+Results are appended to a JSONL file, one line per document keyed by its path
+relative to the directory or manifest, so that documents with the same file name in
+different subdirectories are kept apart. A rerun skips the documents already
+extracted and retries the failed ones.
+
+Usage:
+    python batch_pipeline.py <pdf_dir | manifest.txt> <results.jsonl> [--queue-size N]
+"""
+
+import argparse
+import json
+import os
+import queue
+import sys
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+from pipeline_worker import DocumentArtifacts, WarmPipeline
+
+# Documents waiting between two stages
+QUEUE_SIZE = int(os.environ.get("KID_BATCH_QUEUE_SIZE", "1"))
+# Worker kinds of the parse, enrich and extract stages: one process per stage
+BATCH_WORKERS = ("mineru", "vlm", "llama")
+
+
+@dataclass
+class BatchItem:
+    """A document travelling through the stages, with its results key."""
+    pdf_path: str
+    file: str
+    artifacts: DocumentArtifacts = field(default_factory=DocumentArtifacts)
+    timings: Dict[str, float] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def source_dir(source: str) -> str:
+    """Directory the document paths of a source are relative to."""
+    return source if os.path.isdir(source) else os.path.dirname(os.path.abspath(source))
+
+
+def document_key(pdf_path: str, base_dir: Optional[str] = None) -> str:
+    """Results key of a document: its path relative to ``base_dir``, or its absolute path."""
+    if base_dir is None:
+        return os.path.abspath(pdf_path)
+    return os.path.relpath(os.path.abspath(pdf_path), os.path.abspath(base_dir))
+
+
+def list_documents(source: str) -> List[str]:
+    """PDFs of a directory (sorted), or the paths listed in a manifest file.
+
+    Manifest lines are paths relative to the manifest; blank lines and lines
+    starting with "#" are ignored.
+    """
+    if os.path.isdir(source):
+        return sorted(
+            os.path.join(source, name) for name in os.listdir(source)
+            if name.lower().endswith(".pdf")
+        )
+    base_dir = source_dir(source)
+    with open(source, "r", encoding="utf-8") as f:
+        lines = [line.strip() for line in f]
+    return [os.path.join(base_dir, line) for line in lines if line and not line.startswith("#")]
+
+
+def load_done(results_path: str) -> Set[str]:
+    """Keys of the documents already extracted successfully in a previous run."""
+    done = set()
+    if not os.path.exists(results_path):
+        return done
+    with open(results_path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Line truncated by an interrupted run
+                continue
+            if record.get("ok"):
+                done.add(record["file"])
+    return done
+
+
+class BatchPipeline:
+    """Parse, enrich and extract stages connected by bounded queues."""
+
+    def __init__(self, pipeline: Optional[WarmPipeline] = None, queue_size: int = QUEUE_SIZE):
+        self.pipeline = pipeline or WarmPipeline(workers_per_env=1, kinds=BATCH_WORKERS)
+        self.queue_size = queue_size
+        # Time each stage spent processing documents
+        self.busy: Dict[str, float] = {"parse": 0.0, "enrich": 0.0, "extract": 0.0}
+
+    def stage_parse(self, item: BatchItem) -> None:
+        with open(item.pdf_path, "rb") as f:
+            pdf_bytes = f.read()
+        output = self.pipeline.call("mineru", "parse_memory", pdf_bytes=pdf_bytes)["output"]
+        item.artifacts.markdown = output["markdown"]
+        item.artifacts.images = output["images"]
+
+    def stage_enrich(self, item: BatchItem) -> None:
+        output = self.pipeline.call("vlm", "enrich_memory", markdown=item.artifacts.markdown,
+                                    images=item.artifacts.images)["output"]
+        item.artifacts.enriched_markdown = output["enriched_markdown"]
+        item.artifacts.risk = output["risk"]
+        # The image bytes are no longer needed: free them before the item waits
+        item.artifacts.images = {}
+
+    def stage_extract(self, item: BatchItem) -> None:
+        output = self.pipeline.call("llama", "extract_memory",
+                                    enriched_markdown=item.artifacts.enriched_markdown,
+                                    risk=item.artifacts.risk)["output"]
+        item.artifacts.result = output["result"]
+
+    def _stage_loop(self, name: str, run: Callable[[BatchItem], None],
+                    inbox: "queue.Queue", outbox: "queue.Queue") -> None:
+        """Process the items of ``inbox`` until the end marker (None), passing them on."""
+        while True:
+            item = inbox.get()
+            if item is None:
+                outbox.put(None)
+                return
+            if item.error is None:
+                start = time.perf_counter()
+                try:
+                    run(item)
+                except Exception as e:
+                    item.error = f"{name}: {e}"
+                item.timings[name] = time.perf_counter() - start
+                self.busy[name] += item.timings[name]
+            outbox.put(item)
+
+    def run(self, pdf_paths: Iterable[str], results_path: str,
+            base_dir: Optional[str] = None) -> Dict[str, Any]:
+        """Process the documents not yet in ``results_path`` and append their results.
+
+        Args:
+            pdf_paths: Documents to process
+            results_path: JSONL file of the results
+            base_dir: Directory the results keys are relative to (see source_dir);
+                absolute paths if None
+
+        Returns:
+            Report with the document counts, the elapsed time, the throughput in
+            documents per hour and the busy time of each stage.
+        """
+        done = load_done(results_path)
+        todo = [BatchItem(path, document_key(path, base_dir)) for path in pdf_paths]
+        todo = [item for item in todo if item.file not in done]
+        print(f"{len(todo)} documents to process, {len(done)} already done")
+        self.pipeline.start()
+
+        inboxes = [queue.Queue(maxsize=self.queue_size) for _ in range(3)]
+        results: "queue.Queue" = queue.Queue()
+        stages = [("parse", self.stage_parse), ("enrich", self.stage_enrich), ("extract", self.stage_extract)]
+        threads = [
+            threading.Thread(target=self._stage_loop, args=(name, run, inbox, outbox),
+                             name=f"batch-{name}", daemon=True)
+            for (name, run), inbox, outbox in zip(stages, inboxes, inboxes[1:] + [results])
+        ]
+        for thread in threads:
+            thread.start()
+
+        def feed() -> None:
+            for item in todo:
+                inboxes[0].put(item)
+            inboxes[0].put(None)
+
+        threading.Thread(target=feed, name="batch-feed", daemon=True).start()
+
+        start = time.perf_counter()
+        succeeded = failed = 0
+        with open(results_path, "a", encoding="utf-8") as out:
+            while True:
+                item = results.get()
+                if item is None:
+                    break
+                record = {"file": item.file, "ok": item.error is None, "timings": item.timings}
+                if item.error is None:
+                    record["result"] = item.artifacts.result
+                    succeeded += 1
+                else:
+                    record["error"] = item.error
+                    failed += 1
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+                out.flush()
+                elapsed = time.perf_counter() - start
+                print(f"[{succeeded + failed}/{len(todo)}] {item.file}: "
+                      f"{'ok' if item.error is None else item.error} "
+                      f"({3600 * (succeeded + failed) / elapsed:.1f} docs/h)")
+
+        elapsed = time.perf_counter() - start
+        return {
+            "documents": len(todo),
+            "succeeded": succeeded,
+            "failed": failed,
+            "skipped": len(done),
+            "elapsed": elapsed,
+            "docs_per_hour": 3600 * len(todo) / elapsed if elapsed > 0 else 0.0,
+            "stage_busy": dict(self.busy),
+        }
+
+
+def main():
+    """Main entry point of the script."""
+    parser = argparse.ArgumentParser(description="Run the KID pipeline over many PDFs.")
+    parser.add_argument("source", help="Directory of PDFs, or manifest file with one PDF path per line")
+    parser.add_argument("results", help="JSONL file receiving one result per document")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="Documents waiting between two stages")
+    args = parser.parse_args()
+
+    try:
+        pdf_paths = list_documents(args.source)
+    except OSError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    report = BatchPipeline(queue_size=args.queue_size).run(pdf_paths, args.results, source_dir(args.source))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
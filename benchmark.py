@@ -0,0 +1,253 @@
+"""
+End-to-end Benchmark
+Runs the pipeline stages over a fixed corpus of KID PDFs and records, per stage and
+per document, the wall time, CPU time, peak RSS and generation speed (tokens/s for
+the VLM and llama.cpp stages). The report is written as JSON and can be compared
+against a stored baseline to catch regressions.
+
+Stages are the stage_runner.py commands, run as cold processes in their own
+environments, so the timings include the model loads:
+    parse    main.py (process_pdf)
+    enrich   process_markdown_fixed.py (image descriptions)
+    extract  llm_test_options.py (JSON extraction)
+    xml      key_info_xml.py (json_to_xml)
+
+Without --corpus, a synthetic corpus (synthetic_kid.py) is generated so that the
+benchmark runs offline; the extracted ISIN and risk level are then checked against
+its ground truth. The VLM description cache is disabled unless --keep-caches is given.
+
+Usage:
+    python benchmark.py [--corpus DIR | --count N] [--output report.json]
+                        [--baseline baseline.json] [--save-baseline baseline.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+from stage_runner import STAGES, StagePaths
+from synthetic_kid import generate_corpus
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+BENCH_DIR = os.environ.get("KID_BENCH_DIR", os.path.join(PROJECT_ROOT, "benchmarks"))
+BENCH_STAGES = ("parse", "enrich", "extract", "xml")
+# Relative slowdown tolerated before a metric is reported as a regression
+TOLERANCE = float(os.environ.get("KID_BENCH_TOLERANCE", "0.10"))
+# Metric -> True if a higher value is worse
+METRICS = {"wall": True, "cpu": True, "peak_rss_mb": True, "tokens_per_s": False}
+# Persistent caches that would make the stages skip their work on a second run
+NO_CACHE_ENV = {"KID_VLM_CACHE": "0"}
+
+
+def run_measured(command: List[str], env: Dict[str, str]) -> Dict[str, Any]:
+    """Run a command and measure its wall time, CPU time and peak RSS.
+
+    The resource usage comes from wait4, so it covers this process only and not
+    the other children of the benchmark.
+    """
+    start = time.perf_counter()
+    try:
+        process = subprocess.Popen(command, cwd=PROJECT_ROOT, env=env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.PIPE)
+    except OSError as e:
+        # Missing environment (e.g. MinerU/bin/python3.10)
+        return {"ok": False, "wall": 0.0, "cpu": 0.0, "peak_rss_mb": 0.0, "error": str(e)}
+    # Drain stderr so that a verbose stage never blocks on a full pipe
+    stderr = process.stderr.read()
+    _, status, usage = os.wait4(process.pid, 0)
+    process.returncode = os.waitstatus_to_exitcode(status)
+    return {
+        "ok": process.returncode == 0,
+        "wall": time.perf_counter() - start,
+        "cpu": usage.ru_utime + usage.ru_stime,
+        # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+        "peak_rss_mb": usage.ru_maxrss / (1024 ** 2 if sys.platform == "darwin" else 1024),
+        "error": None if process.returncode == 0 else stderr.decode(errors="replace")[-2000:],
+    }
+
+
+def read_stats(stats_path: str) -> Optional[float]:
+    """Tokens per second written by the stage in KID_STATS_PATH, if any."""
+    try:
+        with open(stats_path, "r", encoding="utf-8") as f:
+            stats = json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+    if not stats.get("generation"):
+        return None
+    return stats["completion_tokens"] / stats["generation"]
+
+
+def benchmark_document(pdf_path: str, run_dir: str, env: Dict[str, str]) -> Dict[str, Dict[str, Any]]:
+    """Run the benchmark stages on one PDF, stopping at the first failure."""
+    paths = StagePaths(os.path.abspath(pdf_path), os.path.abspath(run_dir))
+    shutil.rmtree(run_dir, ignore_errors=True)
+    os.makedirs(run_dir)
+    results = {}
+    for stage in STAGES:
+        if stage.name not in BENCH_STAGES:
+            continue
+        stats_path = os.path.join(run_dir, f"{stage.name}.stats.json")
+        result = run_measured(stage.command(paths), {**env, "KID_STATS_PATH": stats_path})
+        result["tokens_per_s"] = read_stats(stats_path)
+        results[stage.name] = result
+        print(f"  {stage.name}: {result['wall']:.1f}s wall, {result['cpu']:.1f}s CPU, "
+              f"{result['peak_rss_mb']:.0f} MB"
+              + (f", {result['tokens_per_s']:.1f} tokens/s" if result["tokens_per_s"] else "")
+              + ("" if result["ok"] else " (failed)"))
+        if not result["ok"]:
+            break
+    return results
+
+
+def same_level(extracted: Any, expected: Any) -> bool:
+    """True if two risk levels are the same number (4, 4.0 and "4" are equal)."""
+    try:
+        return float(extracted) == float(expected)
+    except (TypeError, ValueError):
+        return False
+
+
+def check_truth(corpus_dir: str, run_dirs: Dict[str, str]) -> Optional[Dict[str, float]]:
+    """Share of documents whose extracted ISIN and risk level match the synthetic ground truth."""
+    truth_path = os.path.join(corpus_dir, "truth.jsonl")
+    if not os.path.exists(truth_path):
+        return None
+    with open(truth_path, "r", encoding="utf-8") as f:
+        truths = [json.loads(line) for line in f if line.strip()]
+    matches = {"isin": 0, "risk_level": 0}
+    for truth in truths:
+        run_dir = run_dirs.get(truth["file"])
+        if run_dir is None:
+            continue
+        json_path = StagePaths(os.path.join(corpus_dir, truth["file"]), run_dir).json
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, json.JSONDecodeError):
+            continue
+        product, risk = data.get("product") or {}, data.get("risk") or {}
+        matches["isin"] += product.get("isin") == truth["isin"]
+        matches["risk_level"] += same_level(risk.get("level"), truth["risk_level"])
+    return {field: count / len(truths) for field, count in matches.items()} if truths else None
+
+
+def summarize(documents: Dict[str, Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+    """Mean wall time, CPU time and tokens/s, and max peak RSS of each stage over the documents.
+
+    A stage that ran but always failed is kept, with its failures and no measures.
+    """
+    summary = {}
+    for stage in BENCH_STAGES:
+        runs = [stages[stage] for stages in documents.values() if stage in stages]
+        if not runs:
+            continue
+        successful = [run for run in runs if run["ok"]]
+        speeds = [run["tokens_per_s"] for run in successful if run["tokens_per_s"]]
+        summary[stage] = {
+            "runs": len(runs),
+            "failures": len(runs) - len(successful),
+            "wall": sum(run["wall"] for run in successful) / len(successful) if successful else None,
+            "cpu": sum(run["cpu"] for run in successful) / len(successful) if successful else None,
+            "peak_rss_mb": max(run["peak_rss_mb"] for run in successful) if successful else None,
+            "tokens_per_s": sum(speeds) / len(speeds) if speeds else None,
+        }
+    return summary
+
+
+def compare(report: Dict[str, Any], baseline: Dict[str, Any], tolerance: float = TOLERANCE) -> List[str]:
+    """Metrics of the report worse than the baseline by more than ``tolerance``, more
+    failures than in the baseline, and baseline stages that did not run at all."""
+    regressions = []
+    for stage, reference in baseline.get("stages", {}).items():
+        metrics = report["stages"].get(stage)
+        if metrics is None:
+            regressions.append(f"{stage}: missing from the report (not run)")
+            continue
+        if metrics.get("failures", 0) > reference.get("failures", 0):
+            regressions.append(f"{stage}.failures: {reference.get('failures', 0)} -> {metrics['failures']}")
+        for metric, higher_is_worse in METRICS.items():
+            current, previous = metrics.get(metric), reference.get(metric)
+            if not current or not previous:
+                continue
+            change = (current - previous) / previous
+            if (change if higher_is_worse else -change) > tolerance:
+                regressions.append(f"{stage}.{metric}: {previous:.2f} -> {current:.2f} ({change:+.0%})")
+    return regressions
+
+
+def run_benchmark(corpus_dir: str, bench_dir: str = BENCH_DIR, keep_caches: bool = False) -> Dict[str, Any]:
+    """Benchmark every PDF of ``corpus_dir`` and return the report."""
+    env = dict(os.environ)
+    if not keep_caches:
+        env.update(NO_CACHE_ENV)
+    pdf_paths = sorted(
+        os.path.join(corpus_dir, name) for name in os.listdir(corpus_dir) if name.lower().endswith(".pdf")
+    )
+    documents, run_dirs = {}, {}
+    start = time.perf_counter()
+    for pdf_path in pdf_paths:
+        name = os.path.basename(pdf_path)
+        print(f"▶️  {name}")
+        run_dirs[name] = os.path.join(bench_dir, "runs", os.path.splitext(name)[0])
+        documents[name] = benchmark_document(pdf_path, run_dirs[name], env)
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "host": {"platform": platform.platform(), "cpu_count": os.cpu_count(), "python": platform.python_version()},
+        "corpus": {"dir": os.path.abspath(corpus_dir), "documents": len(pdf_paths)},
+        "elapsed": time.perf_counter() - start,
+        "stages": summarize(documents),
+        "accuracy": check_truth(corpus_dir, run_dirs),
+        "documents": documents,
+    }
+
+
+def main():
+    """Main entry point of the script."""
+    parser = argparse.ArgumentParser(description="Benchmark the KID pipeline stages.")
+    parser.add_argument("--corpus", help="Directory of PDFs (default: generated synthetic corpus)")
+    parser.add_argument("--count", type=int, default=3, help="Synthetic documents to generate")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the synthetic corpus")
+    parser.add_argument("--output", default=os.path.join(BENCH_DIR, "report.json"), help="Report file")
+    parser.add_argument("--baseline", help="Report to compare against; exit code 1 on regression")
+    parser.add_argument("--save-baseline", help="Also write the report to this baseline file")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="Relative change tolerated before a regression is reported")
+    parser.add_argument("--keep-caches", action="store_true", help="Leave the VLM description cache enabled")
+    args = parser.parse_args()
+
+    corpus_dir = args.corpus
+    if corpus_dir is None:
+        corpus_dir = os.path.join(BENCH_DIR, f"corpus-{args.count}-{args.seed}")
+        if not os.path.isdir(corpus_dir):
+            generate_corpus(corpus_dir, args.count, args.seed)
+
+    report = run_benchmark(corpus_dir, keep_caches=args.keep_caches)
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps({"stages": report["stages"], "accuracy": report["accuracy"]}, indent=2))
+    print(f"Report written to {args.output}")
+    if args.save_baseline:
+        shutil.copyfile(args.output, args.save_baseline)
+
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        regressions = compare(report, baseline, args.tolerance)
+        if regressions:
+            print("❌ Regressions against the baseline:")
+            for regression in regressions:
+                print(f"  {regression}")
+            sys.exit(1)
+        print("✅ No regression against the baseline")
+
+
+if __name__ == "__main__":
+    main()
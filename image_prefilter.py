@@ -0,0 +1,103 @@
+"""
+Image Pre-filter
+Cheap checks run before Qwen2-VL to discard the images that cannot be an SRI risk
+scale (logos, signatures, decorative bars...). A risk scale is a wide strip of seven
+numbered boxes, so images that are too small, not wide enough, or almost uniform are
+answered directly with the VLM's "no risk" sentence.
+
+Images matching a known risk-scale template (perceptual hash) always go to the VLM.
+"""
+
+import os
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageStat
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.environ.get("KID_RISK_TEMPLATES_DIR", os.path.join(PROJECT_ROOT, "risk_templates"))
+
+# Same sentence as the VLM answer for an image without a risk scale
+NO_RISK_RESPONSE = "cette image ne semble pas indiquer de risque"
+
+MIN_WIDTH = 120
+MIN_HEIGHT = 20
+# Width / height of the risk scale strip, with margin for the labels around it
+MIN_ASPECT_RATIO = 1.8
+MAX_ASPECT_RATIO = 15.0
+# Grey-level standard deviation below which an image is a plain bar or background
+MIN_CONTRAST = 8.0
+# Maximum Hamming distance between hashes for a template match
+TEMPLATE_MAX_DISTANCE = 10
+
+
+def dhash(image: Image.Image, size: int = 8) -> int:
+    """64-bit difference hash: robust to rescaling and recompression."""
+    pixels = list(image.convert("L").resize((size + 1, size), Image.BILINEAR).getdata())
+    value = 0
+    for row in range(size):
+        for col in range(size):
+            left = pixels[row * (size + 1) + col]
+            right = pixels[row * (size + 1) + col + 1]
+            value = (value << 1) | (left > right)
+    return value
+
+
+def hamming_distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def load_templates(templates_dir: str = TEMPLATES_DIR) -> List[int]:
+    """Hashes of the reference risk-scale images stored in templates_dir."""
+    if not os.path.isdir(templates_dir):
+        return []
+    hashes = []
+    for filename in sorted(os.listdir(templates_dir)):
+        try:
+            with Image.open(os.path.join(templates_dir, filename)) as image:
+                hashes.append(dhash(image))
+        except OSError:
+            continue
+    return hashes
+
+
+class ImagePrefilter:
+    """Decides which images need a VLM call and counts the calls avoided."""
+
+    def __init__(self, templates_dir: str = TEMPLATES_DIR):
+        self.templates = load_templates(templates_dir)
+        self.checked = 0
+        self.skipped = 0
+        self.reasons: Counter = Counter()
+
+    def classify(self, image: Image.Image) -> Tuple[bool, str]:
+        """Return (may contain a risk scale, reason)."""
+        if self.templates:
+            image_hash = dhash(image)
+            if any(hamming_distance(image_hash, template) <= TEMPLATE_MAX_DISTANCE
+                   for template in self.templates):
+                return True, "template_match"
+
+        width, height = image.size
+        if width < MIN_WIDTH or height < MIN_HEIGHT:
+            return False, "too_small"
+        aspect_ratio = width / height
+        if not MIN_ASPECT_RATIO <= aspect_ratio <= MAX_ASPECT_RATIO:
+            return False, "aspect_ratio"
+        # The contrast is measured on a thumbnail to keep the check cheap
+        thumbnail = image.convert("L").resize((64, max(1, int(64 / aspect_ratio))))
+        if ImageStat.Stat(thumbnail).stddev[0] < MIN_CONTRAST:
+            return False, "uniform"
+        return True, "candidate"
+
+    def should_describe(self, image: Image.Image) -> bool:
+        """Classify an image and update the counters."""
+        keep, reason = self.classify(image)
+        self.checked += 1
+        self.reasons[reason] += 1
+        if not keep:
+            self.skipped += 1
+        return keep
+
+    def stats(self) -> Dict[str, object]:
+        return {"checked": self.checked, "vlm_calls_avoided": self.skipped, "reasons": dict(self.reasons)}
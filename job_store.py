@@ -0,0 +1,185 @@
+"""
+Job Store
+SQLite persistence for the asynchronous job API: job status, per-stage progress,
+final kid.json and the ordered event log used by the streaming endpoint.
+Each call opens its own connection, so the store can be shared by the Flask request
+threads and the scheduler threads, and its content survives a restart.
+"""
+
+import json
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from jobs import PIPELINE_STAGES
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+JOB_DB_PATH = os.environ.get("KID_JOB_DB", os.path.join(PROJECT_ROOT, "jobs.db"))
+
+STATUS_QUEUED = "queued"
+STATUS_RUNNING = "running"
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+ACTIVE_STATUSES = (STATUS_QUEUED, STATUS_RUNNING)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    filename TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stages TEXT NOT NULL,
+    result TEXT,
+    timings TEXT,
+    error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS job_events (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    job_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    data TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_job_events_job ON job_events (job_id, seq);
+"""
+
+
+class JobStore:
+    """Persistent job registry backed by SQLite."""
+
+    def __init__(self, db_path: str = JOB_DB_PATH):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _add_event(self, conn: sqlite3.Connection, job_id: str, event: str, data: Dict[str, Any]) -> None:
+        conn.execute(
+            "INSERT INTO job_events (job_id, event, data, created_at) VALUES (?, ?, ?, ?)",
+            (job_id, event, json.dumps(data, ensure_ascii=False), time.time()),
+        )
+
+    def _update(self, conn: sqlite3.Connection, job_id: str, **fields) -> None:
+        fields["updated_at"] = time.time()
+        columns = ", ".join(f"{name} = ?" for name in fields)
+        conn.execute(f"UPDATE jobs SET {columns} WHERE id = ?", (*fields.values(), job_id))
+
+    def _finish_running_stages(self, conn: sqlite3.Connection, job_id: str,
+                               stages: Dict[str, Dict[str, Any]], now: float) -> None:
+        for name, info in stages.items():
+            if info["status"] == "running":
+                info.update(status="done", duration=now - info["started_at"])
+                self._add_event(conn, job_id, "stage", {"stage": name, **info})
+
+    def create(self, job_id: str, filename: str) -> None:
+        """Register a new queued job."""
+        now = time.time()
+        stages = {stage: {"status": "pending"} for stage in PIPELINE_STAGES}
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, filename, status, stages, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (job_id, filename, STATUS_QUEUED, json.dumps(stages), now, now),
+            )
+            self._add_event(conn, job_id, "status", {"status": STATUS_QUEUED})
+
+    def delete(self, job_id: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM job_events WHERE job_id = ?", (job_id,))
+            conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def requeue(self, job_id: str) -> None:
+        """Put an interrupted job back in the queue with its progress reset."""
+        stages = {stage: {"status": "pending"} for stage in PIPELINE_STAGES}
+        with self._connect() as conn:
+            self._update(conn, job_id, status=STATUS_QUEUED, stages=json.dumps(stages))
+            self._add_event(conn, job_id, "status", {"status": STATUS_QUEUED})
+
+    def mark_running(self, job_id: str) -> None:
+        with self._connect() as conn:
+            self._update(conn, job_id, status=STATUS_RUNNING)
+            self._add_event(conn, job_id, "status", {"status": STATUS_RUNNING})
+
+    def start_stage(self, job_id: str, stage: str, cached: bool = False) -> None:
+        """Mark a stage as running (or restored from the cache) and the previous running stage as done."""
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            stages = json.loads(row["stages"])
+            self._finish_running_stages(conn, job_id, stages, now)
+            stages[stage] = {"status": "cached"} if cached else {"status": "running", "started_at": now}
+            self._update(conn, job_id, stages=json.dumps(stages))
+            self._add_event(conn, job_id, "stage", {"stage": stage, **stages[stage]})
+
+    def add_section(self, job_id: str, section: str, value: Any) -> None:
+        """Record a kid.json section generated before the end of the extraction."""
+        with self._connect() as conn:
+            self._add_event(conn, job_id, "section", {"section": section, "value": value})
+
+    def complete(self, job_id: str, result: Dict[str, Any], timings: Dict[str, float]) -> None:
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            stages = json.loads(row["stages"])
+            self._finish_running_stages(conn, job_id, stages, now)
+            self._update(
+                conn, job_id,
+                status=STATUS_DONE,
+                stages=json.dumps(stages),
+                result=json.dumps(result, ensure_ascii=False),
+                timings=json.dumps(timings),
+            )
+            self._add_event(conn, job_id, "result", result)
+
+    def fail(self, job_id: str, error: str) -> None:
+        with self._connect() as conn:
+            self._update(conn, job_id, status=STATUS_FAILED, error=error)
+            self._add_event(conn, job_id, "error", {"error": error})
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return the public view of a job, or None if it does not exist."""
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return {
+            "id": row["id"],
+            "filename": row["filename"],
+            "status": row["status"],
+            "stages": json.loads(row["stages"]),
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "timings": json.loads(row["timings"]) if row["timings"] else None,
+            "error": row["error"],
+            "created_at": row["created_at"],
+            "updated_at": row["updated_at"],
+        }
+
+    def events_since(self, job_id: str, seq: int = 0) -> List[Dict[str, Any]]:
+        """Return the events of a job recorded after ``seq``, oldest first."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT seq, event, data FROM job_events WHERE job_id = ? AND seq > ? ORDER BY seq",
+                (job_id, seq),
+            ).fetchall()
+        return [{"seq": row["seq"], "event": row["event"], "data": json.loads(row["data"])} for row in rows]
+
+    def active_jobs(self) -> List[Dict[str, Any]]:
+        """Jobs left queued or running, e.g. by a restart."""
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT id FROM jobs WHERE status IN (?, ?) ORDER BY created_at", ACTIVE_STATUSES
+            ).fetchall()
+        return [self.get(row["id"]) for row in rows]
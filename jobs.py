@@ -0,0 +1,128 @@
+"""
+Job Isolation and Scheduling
+Each analysis runs in its own working directory so that concurrent uploads never
+share the PDF, the extracted images, the markdown or the kid.json. A bounded
+scheduler runs a fixed number of jobs in parallel and rejects work beyond its queue.
+"""
+
+import os
+import shutil
+import threading
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+JOBS_ROOT = os.environ.get("KID_JOBS_DIR", os.path.join(PROJECT_ROOT, "uploads"))
+# Profiles of the profiled jobs, kept after the job directory is deleted
+PROFILES_ROOT = os.environ.get("KID_PROFILE_ROOT", os.path.join(PROJECT_ROOT, "profiles"))
+
+# MinerU and llama.cpp are multi-threaded themselves: one job per 4 cores avoids
+# oversubscribing the CPU while still scaling with the host.
+DEFAULT_MAX_JOBS = max(1, (os.cpu_count() or 1) // 4)
+MAX_JOBS = int(os.environ.get("KID_MAX_JOBS", DEFAULT_MAX_JOBS))
+MAX_QUEUED_JOBS = int(os.environ.get("KID_MAX_QUEUED_JOBS", "16"))
+
+# Stages of run_pipeline.sh, in execution order
+PIPELINE_STAGES = ("parse", "enrich", "extract")
+
+
+class JobWorkspace:
+    """Working directory and artifact paths of a single job."""
+
+    def __init__(self, job_id: str, pdf_name: str = "document.pdf", root: str = JOBS_ROOT):
+        self.job_id = job_id
+        self.dir = os.path.join(root, job_id)
+        self.pdf_path = os.path.join(self.dir, pdf_name)
+        self.name = os.path.splitext(pdf_name)[0]
+
+    @classmethod
+    def create(cls, pdf_name: str = "document.pdf", root: str = JOBS_ROOT) -> "JobWorkspace":
+        """Create a workspace with a fresh job id."""
+        workspace = cls(uuid.uuid4().hex, pdf_name, root)
+        os.makedirs(workspace.dir, exist_ok=True)
+        return workspace
+
+    @property
+    def markdown_path(self) -> str:
+        return os.path.join(self.dir, f"{self.name}.md")
+
+    @property
+    def enriched_markdown_path(self) -> str:
+        return os.path.join(self.dir, f"{self.name}_enriched.md")
+
+    @property
+    def risk_path(self) -> str:
+        return os.path.join(self.dir, f"{self.name}_risk.json")
+
+    @property
+    def images_dir(self) -> str:
+        return os.path.join(self.dir, "images")
+
+    @property
+    def llm_input_path(self) -> str:
+        return os.path.join(self.dir, "input.txt")
+
+    @property
+    def json_path(self) -> str:
+        return os.path.join(self.dir, "kid.json")
+
+    @property
+    def profile_dir(self) -> str:
+        """CPU profiles and traces of the job, outside the job directory (see profiling.py)."""
+        return os.path.join(PROFILES_ROOT, self.job_id)
+
+    def cleanup(self) -> None:
+        """Delete the job directory and everything in it."""
+        shutil.rmtree(self.dir, ignore_errors=True)
+
+
+class SchedulerFull(Exception):
+    """Raised when the scheduler queue is full."""
+
+
+class JobScheduler:
+    """Runs at most ``max_jobs`` jobs in parallel with a bounded waiting queue."""
+
+    def __init__(self, max_jobs: int = MAX_JOBS, max_queued: int = MAX_QUEUED_JOBS):
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="kid-job")
+        self.slots = threading.BoundedSemaphore(max_jobs + max_queued)
+        # Jobs waiting for a free worker thread, and jobs running
+        self.queued = 0
+        self.running = 0
+        self._lock = threading.Lock()
+
+    def _run(self, fn: Callable[..., Any], args: tuple, kwargs: dict) -> Any:
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def submit(self, fn: Callable[..., Any], *args, **kwargs) -> Future:
+        """Schedule a job.
+
+        Raises:
+            SchedulerFull: if ``max_jobs`` jobs are running and the queue is full
+        """
+        if not self.slots.acquire(blocking=False):
+            raise SchedulerFull("Too many jobs in progress, retry later")
+        with self._lock:
+            self.queued += 1
+        try:
+            future = self.executor.submit(self._run, fn, args, kwargs)
+        except Exception:
+            with self._lock:
+                self.queued -= 1
+            self.slots.release()
+            raise
+        future.add_done_callback(lambda _: self.slots.release())
+        return future
+
+    def run(self, fn: Callable[..., Any], *args, timeout: Optional[float] = None, **kwargs) -> Any:
+        """Schedule a job and wait for its result."""
+        return self.submit(fn, *args, **kwargs).result(timeout=timeout)
@@ -5,11 +5,33 @@ markdown content, layout analysis, and content structure.
 """
 
 import os
-from typing import Tuple
-from magic_pdf.data.data_reader_writer import FileBasedDataWriter, FileBasedDataReader
+import multiprocessing
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+from magic_pdf.data.data_reader_writer import DataWriter, FileBasedDataWriter, FileBasedDataReader
 from magic_pdf.data.dataset import PymuDocDataset
 from magic_pdf.model.doc_analyze_by_custom_model import doc_analyze
+from magic_pdf.operators.models import InferenceResult
 from magic_pdf.config.enums import SupportedPdfParseMethod
+from profiling import PROFILE_DIR, job_profile, span
+from stage_metrics import observe
+
+# Page-sharded layout analysis: number of processes (1 disables sharding) and pages per shard
+MINERU_WORKERS = int(os.environ.get("KID_MINERU_WORKERS", "1"))
+MINERU_SHARD_PAGES = int(os.environ.get("KID_MINERU_SHARD_PAGES", "4"))
+
+# Artifacts written by process_pdf:
+#   minimal  markdown and images only (what the enrich stage reads)
+#   standard + content list and middle json
+#   debug    + model, layout and span PDFs rendered for visual inspection
+OUTPUT_PROFILES = ("minimal", "standard", "debug")
+OUTPUT_PROFILE = os.environ.get("KID_OUTPUT_PROFILE", "standard")
+
+# Kept alive between documents so that each process loads the models only once
+_shard_pool: Optional[ProcessPoolExecutor] = None
+_shard_pool_size = 0
 
 def setup_directories(output_dir: str, images_dir: str) -> None:
     """Create necessary output directories if they don't exist."""
@@ -27,77 +49,263 @@ def get_writers(pdf_dir: str) -> Tuple[FileBasedDataWriter, FileBasedDataWriter]
     images_dir = os.path.join(pdf_dir, "images")
     return FileBasedDataWriter(images_dir), FileBasedDataWriter(pdf_dir)
 
-def process_pdf(pdf_path: str) -> None:
-    """Process a PDF file and generate analysis outputs.
+def _analyze_shard(pdf_bytes: bytes, ocr: bool, start_page: int, end_page: int) -> list:
+    """Run doc_analyze on pages start_page..end_page (inclusive) in a pool process.
+    
+    Returns:
+        The per-page model results; pages outside the shard only carry their page_info
+    """
+    ds = PymuDocDataset(pdf_bytes)
+    return doc_analyze(ds, ocr=ocr, start_page_id=start_page, end_page_id=end_page).get_infer_res()
+
+def get_shard_pool(workers: int) -> ProcessPoolExecutor:
+    """Return the shared process pool, recreated if the worker count changes."""
+    global _shard_pool, _shard_pool_size
+    if _shard_pool is None or _shard_pool_size != workers:
+        if _shard_pool is not None:
+            _shard_pool.shutdown()
+        # spawn: the models must not be inherited half-initialised through fork
+        _shard_pool = ProcessPoolExecutor(max_workers=workers,
+                                          mp_context=multiprocessing.get_context("spawn"))
+        _shard_pool_size = workers
+    return _shard_pool
+
+def page_shards(page_count: int, shard_pages: int) -> List[Tuple[int, int]]:
+    """Split pages into inclusive (start, end) ranges of at most shard_pages pages."""
+    return [(start, min(start + shard_pages, page_count) - 1)
+            for start in range(0, page_count, shard_pages)]
+
+def analyze_dataset(ds: PymuDocDataset, pdf_bytes: bytes, ocr: bool,
+                    workers: int = MINERU_WORKERS,
+                    shard_pages: int = MINERU_SHARD_PAGES) -> InferenceResult:
+    """Run doc_analyze on the whole document, sharded by pages over a process pool.
+    
+    The per-page results of the shards are merged in page order into a single
+    InferenceResult, so the pipe and dump steps see one document as usual.
+    """
+    page_count = len(ds)
+    if workers <= 1 or page_count <= shard_pages:
+        return ds.apply(doc_analyze, ocr=ocr)
+    
+    shards = page_shards(page_count, shard_pages)
+    print(f"Analyzing {page_count} pages in {len(shards)} shards on {workers} processes")
+    pool = get_shard_pool(workers)
+    futures = [pool.submit(_analyze_shard, pdf_bytes, ocr, start, end) for start, end in shards]
+    
+    model_list = [None] * page_count
+    for (start, end), future in zip(shards, futures):
+        shard_results = future.result()
+        model_list[start:end + 1] = shard_results[start:end + 1]
+    return InferenceResult(model_list, ds)
+
+def write_outputs(infer_result: InferenceResult, pipe_result, pdf_dir: str, name: str,
+                  profile: str = OUTPUT_PROFILE) -> Dict[str, float]:
+    """Write the artifacts of an output profile to pdf_dir.
     
     Args:
-        pdf_path: Path to the PDF file to process
+        infer_result: Layout analysis result of the document
+        pipe_result: Result of the OCR or text pipe
+        pdf_dir: Output directory
+        name: Base name of the output files
+        profile: One of OUTPUT_PROFILES
+    
+    Returns:
+        Duration in seconds of the render and write steps
+    """
+    if profile not in OUTPUT_PROFILES:
+        raise ValueError(f"Unknown output profile '{profile}', expected one of {', '.join(OUTPUT_PROFILES)}")
+    md_writer = FileBasedDataWriter(pdf_dir)
+    image_dir = "images"  # Relative path to images
+    timings = {}
+    
+    start = time.perf_counter()
+    if profile == "minimal":
+        # Markdown built in memory and written once
+        md_writer.write_string(f"{name}.md", pipe_result.get_markdown(image_dir))
+    else:
+        pipe_result.dump_md(md_writer, f"{name}.md", image_dir)
+    timings["markdown"] = time.perf_counter() - start
+    
+    if profile in ("standard", "debug"):
+        start = time.perf_counter()
+        pipe_result.dump_content_list(md_writer, f"{name}_content_list.json", image_dir)
+        pipe_result.dump_middle_json(md_writer, f"{name}_middle.json")
+        timings["json_dumps"] = time.perf_counter() - start
+    
+    if profile == "debug":
+        start = time.perf_counter()
+        infer_result.draw_model(os.path.join(pdf_dir, f"{name}_model.pdf"))
+        pipe_result.draw_layout(os.path.join(pdf_dir, f"{name}_layout.pdf"))
+        pipe_result.draw_span(os.path.join(pdf_dir, f"{name}_spans.pdf"))
+        timings["draw"] = time.perf_counter() - start
+    return timings
+
+class MemoryDataWriter(DataWriter):
+    """DataWriter keeping the written files in memory, by relative path."""
+    
+    def __init__(self):
+        self.files: Dict[str, bytes] = {}
+    
+    def write(self, path: str, data: bytes) -> None:
+        self.files[path] = data
+
+def analyze_pdf_bytes(pdf_bytes: bytes, image_writer: DataWriter, workers: int = MINERU_WORKERS,
+                      shard_pages: int = MINERU_SHARD_PAGES) -> Tuple[InferenceResult, object, Dict[str, float]]:
+    """Run the layout analysis and the OCR or text pipe on the content of a PDF.
+    
+    Args:
+        pdf_bytes: Content of the PDF
+        image_writer: Receives the images cropped from the pages
+    
+    Returns:
+        Tuple containing infer_result, pipe_result and the step durations
     """
-    try:
-        # Get PDF directory and base filename
-        pdf_dir = os.path.dirname(pdf_path)
-        name_without_suff = os.path.splitext(os.path.basename(pdf_path))[0]
-        images_dir = os.path.join(pdf_dir, "images")
-        
-        # Setup directories
-        setup_directories(pdf_dir, images_dir)
-        
-        # Initialize writers
-        image_writer, md_writer = get_writers(pdf_dir)
-        
-        # Read PDF content
-        reader = FileBasedDataReader("")
-        pdf_bytes = reader.read(pdf_path)
-        
-        # Create and process dataset
+    timings = {}
+    
+    # Create and process dataset
+    with span("classify"):
         ds = PymuDocDataset(pdf_bytes)
-        
-        # Determine processing mode and get results
-        if ds.classify() == SupportedPdfParseMethod.OCR:
-            infer_result = ds.apply(doc_analyze, ocr=True)
+        ocr = ds.classify() == SupportedPdfParseMethod.OCR
+    mode = "ocr" if ocr else "txt"
+    
+    start = time.perf_counter()
+    with span("analyze", mode=mode):
+        infer_result = analyze_dataset(ds, pdf_bytes, ocr, workers, shard_pages)
+    timings["analyze"] = time.perf_counter() - start
+    
+    start = time.perf_counter()
+    with span("pipe", mode=mode):
+        if ocr:
             pipe_result = infer_result.pipe_ocr_mode(image_writer)
         else:
-            infer_result = ds.apply(doc_analyze, ocr=False)
             pipe_result = infer_result.pipe_txt_mode(image_writer)
+    timings["pipe"] = time.perf_counter() - start
+    for step in ("analyze", "pipe"):
+        observe("kid_parse_duration_seconds", timings[step], mode=mode, step=step)
+    return infer_result, pipe_result, timings
+
+def analyze_pdf(pdf_path: str, pdf_dir: str, workers: int = MINERU_WORKERS,
+                shard_pages: int = MINERU_SHARD_PAGES) -> Tuple[InferenceResult, object, Dict[str, float]]:
+    """Run the layout analysis and the OCR or text pipe on a PDF file.
+    
+    The extracted images are written to pdf_dir/images.
+    
+    Returns:
+        Tuple containing infer_result, pipe_result and the step durations
+    """
+    images_dir = os.path.join(pdf_dir, "images")
+    setup_directories(pdf_dir, images_dir)
+    image_writer, _ = get_writers(pdf_dir)
+    
+    # Read PDF content
+    reader = FileBasedDataReader("")
+    pdf_bytes = reader.read(pdf_path)
+    return analyze_pdf_bytes(pdf_bytes, image_writer, workers, shard_pages)
+
+def parse_pdf_in_memory(pdf_bytes: bytes, workers: int = MINERU_WORKERS,
+                        shard_pages: int = MINERU_SHARD_PAGES) -> Tuple[str, Dict[str, bytes]]:
+    """Convert a PDF to markdown without writing anything to disk.
+    
+    Returns:
+        Tuple containing the markdown, whose images are referenced as images/<name>,
+        and the image bytes by name
+    """
+    image_writer = MemoryDataWriter()
+    _, pipe_result, timings = analyze_pdf_bytes(pdf_bytes, image_writer, workers, shard_pages)
+    
+    start = time.perf_counter()
+    markdown = pipe_result.get_markdown("images")
+    timings["markdown"] = time.perf_counter() - start
+    print("Timings: " + ", ".join(f"{step}={duration:.2f}s" for step, duration in timings.items()))
+    return markdown, image_writer.files
 
-        # Generate output files
-        output_files = {
-            "model": f"{name_without_suff}_model.pdf",
-            "layout": f"{name_without_suff}_layout.pdf",
-            "spans": f"{name_without_suff}_spans.pdf",
-            "markdown": f"{name_without_suff}.md",
-            "content_list": f"{name_without_suff}_content_list.json",
-            "middle_json": f"{name_without_suff}_middle.json"
-        }
-        
-        # Save analysis results
-        infer_result.draw_model(os.path.join(pdf_dir, output_files["model"]))
-        pipe_result.draw_layout(os.path.join(pdf_dir, output_files["layout"]))
-        pipe_result.draw_span(os.path.join(pdf_dir, output_files["spans"]))
-        
-        # Generate and save content
-        image_dir = "images"  # Relative path to images
-        pipe_result.dump_md(md_writer, output_files["markdown"], image_dir)
-        pipe_result.dump_content_list(md_writer, output_files["content_list"], image_dir)
-        pipe_result.dump_middle_json(md_writer, output_files["middle_json"])
-        
-        print(f"Successfully processed {pdf_path}")
-        print(f"Output files saved in {pdf_dir}")
-        
-    except Exception as e:
-        print(f"Error processing PDF: {str(e)}")
-        raise
+def process_pdf(pdf_path: str, output_dir: Optional[str] = None,
+                workers: int = MINERU_WORKERS, shard_pages: int = MINERU_SHARD_PAGES,
+                profile: str = OUTPUT_PROFILE, profile_dir: Optional[str] = PROFILE_DIR) -> str:
+    """Process a PDF file and generate analysis outputs.
+    
+    Args:
+        pdf_path: Path to the PDF file to process
+        output_dir: Directory receiving the outputs (defaults to the PDF directory).
+            Give each job its own directory to run several documents concurrently.
+        workers: Processes running the layout analysis on page shards (1 = whole document in-process)
+        shard_pages: Number of pages per shard
+        profile: Output profile, see OUTPUT_PROFILES
+        profile_dir: If given, write a CPU profile and a span trace of the run
+            to this directory (see profiling.py)
+    
+    Returns:
+        Path to the generated markdown file
+    """
+    # Opt-in CPU profile and span trace of this document
+    with job_profile(profile_dir, "parse"):
+        try:
+            # Get output directory and base filename
+            pdf_dir = output_dir or os.path.dirname(pdf_path)
+            name_without_suff = os.path.splitext(os.path.basename(pdf_path))[0]
+            
+            infer_result, pipe_result, timings = analyze_pdf(pdf_path, pdf_dir, workers, shard_pages)
+            with span("write_outputs", profile=profile):
+                timings.update(write_outputs(infer_result, pipe_result, pdf_dir, name_without_suff, profile))
+            
+            print(f"Successfully processed {pdf_path}")
+            print(f"Output files saved in {pdf_dir} (profile: {profile})")
+            print("Timings: " + ", ".join(f"{step}={duration:.2f}s" for step, duration in timings.items()))
+            return os.path.join(pdf_dir, f"{name_without_suff}.md")
+            
+        except Exception as e:
+            print(f"Error processing PDF: {str(e)}")
+            raise
+
+def compare_profiles(pdf_path: str, output_dir: str) -> Dict[str, Dict[str, float]]:
+    """Time the output step of each profile on the same analysis result.
+    
+    The document is analysed once; each profile then writes its artifacts to
+    output_dir/<profile>, so the difference is the render and I/O cost alone.
+    
+    Returns:
+        Mapping of profile to its step durations and total
+    """
+    name_without_suff = os.path.splitext(os.path.basename(pdf_path))[0]
+    infer_result, pipe_result, analysis_timings = analyze_pdf(pdf_path, os.path.join(output_dir, "analysis"))
+    print("Analysis: " + ", ".join(f"{step}={duration:.2f}s" for step, duration in analysis_timings.items()))
+    
+    report = {}
+    for profile in OUTPUT_PROFILES:
+        profile_dir = os.path.join(output_dir, profile)
+        shutil.rmtree(profile_dir, ignore_errors=True)
+        os.makedirs(profile_dir)
+        timings = write_outputs(infer_result, pipe_result, profile_dir, name_without_suff, profile)
+        timings["total"] = sum(timings.values())
+        report[profile] = timings
+    
+    debug_total = report["debug"]["total"]
+    print(f"{'profile':<10} {'markdown':>10} {'json':>10} {'draw':>10} {'total':>10} {'saved':>10}")
+    for profile, timings in report.items():
+        print(f"{profile:<10} {timings['markdown']:>9.2f}s {timings.get('json_dumps', 0):>9.2f}s "
+              f"{timings.get('draw', 0):>9.2f}s {timings['total']:>9.2f}s "
+              f"{debug_total - timings['total']:>9.2f}s")
+    return report
 
 def main():
     """Main entry point of the script."""
-    import sys
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="Convert a PDF to markdown with MinerU.")
+    parser.add_argument("pdf_file_path", help="PDF to process")
+    parser.add_argument("output_dir", nargs="?", help="Output directory (defaults to the PDF directory)")
+    parser.add_argument("--profile", choices=OUTPUT_PROFILES, default=OUTPUT_PROFILE,
+                        help="Artifacts to write (default: %(default)s)")
+    parser.add_argument("--profile-dir", default=PROFILE_DIR,
+                        help="Write a CPU profile (cProfile) and a span trace of the run to this directory")
+    parser.add_argument("--compare-profiles", action="store_true",
+                        help="Time the output step of every profile instead of processing normally")
+    args = parser.parse_args()
     
-    if len(sys.argv) != 2:
-        print("Usage: python main.py <pdf_file_path>")
-        sys.exit(1)
-        
-    pdf_file_path = sys.argv[1]
-    process_pdf(pdf_file_path)
+    if args.compare_profiles:
+        compare_profiles(args.pdf_file_path, args.output_dir or os.path.dirname(args.pdf_file_path))
+    else:
+        process_pdf(args.pdf_file_path, args.output_dir, profile=args.profile, profile_dir=args.profile_dir)
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
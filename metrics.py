@@ -0,0 +1,225 @@
+"""
+Service Metrics
+Prometheus metrics of the analysis service, served by app.py on /metrics.
+
+The few metric types needed (counters, gauges and histograms, with labels) are
+rendered directly in the Prometheus text exposition format, so no client library
+is required.
+
+app.py observes the upload sizes, stage latencies, job queue and result cache. The
+metrics observed inside the stage processes are declared here too and receive the
+stage_metrics observations through record_observation().
+"""
+
+import math
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from stage_metrics import Observation
+
+SIZE_BUCKETS = (50e3, 100e3, 250e3, 500e3, 1e6, 2.5e6, 5e6, 10e6, 25e6, 50e6)
+STAGE_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300, 600)
+IMAGE_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2, 5, 10, 30)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+SCORE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+QUEUE_DEPTH_BUCKETS = (0, 1, 2, 4, 8, 16, 32)
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    escaped = (
+        (name, value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"'))
+        for name, value in labels
+    )
+    return "{" + ",".join(f'{name}="{value}"' for name, value in escaped) + "}"
+
+
+class Metric:
+    """Metric with a fixed set of label names; each label combination is a series."""
+
+    type = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], Any] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"Metric {self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: Tuple[str, ...], *extra: Tuple[str, str]) -> str:
+        return _format_labels(list(zip(self.labelnames, key)) + list(extra))
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+    def render(self) -> List[str]:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type}"] + self.samples()
+
+
+class Counter(Metric):
+    """Monotonic total, e.g. cache lookups by outcome."""
+
+    type = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        if amount < 0:
+            raise ValueError(f"Counter {self.name} can only increase")
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted(self._series.items())
+        return [f"{self.name}{self._labels(key)} {_format_value(value)}" for key, value in series]
+
+
+class Gauge(Metric):
+    """Current value, either set explicitly or read from ``function`` at each scrape."""
+
+    type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 function: Optional[Callable[[], float]] = None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def samples(self) -> List[str]:
+        if self.function is not None:
+            return [f"{self.name} {_format_value(self.function())}"]
+        with self._lock:
+            series = sorted(self._series.items())
+        return [f"{self.name}{self._labels(key)} {_format_value(value)}" for key, value in series]
+
+
+class Histogram(Metric):
+    """Distribution of observed values over cumulative buckets (upper bounds)."""
+
+    type = "histogram"
+
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            # Per-bucket counts, sum, count
+            series = self._series.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            for index, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][index] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[str]:
+        with self._lock:
+            series = sorted((key, (list(counts), total, count)) for key, (counts, total, count) in self._series.items())
+        lines = []
+        for key, (counts, total, count) in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f"{self.name}_bucket{self._labels(key, ('le', _format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{self._labels(key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{self._labels(key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    """Metrics of the process, by name."""
+
+    def __init__(self):
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"Metric {metric.name} already registered")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def observe(self, name: str, value: float, **labels: Any) -> None:
+        """Add a value to a metric by name: increment a counter, set a gauge or observe a histogram."""
+        metric = self.metrics[name]
+        if isinstance(metric, Counter):
+            metric.inc(value, **labels)
+        elif isinstance(metric, Gauge):
+            metric.set(value, **labels)
+        else:
+            metric.observe(value, **labels)
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+# Observed by app.py
+UPLOAD_SIZE = REGISTRY.register(Histogram(
+    "kid_upload_size_bytes", "Size of the uploaded PDFs", SIZE_BUCKETS))
+STAGE_DURATION = REGISTRY.register(Histogram(
+    "kid_stage_duration_seconds", "Wall time of each pipeline stage, as seen by the server",
+    STAGE_BUCKETS, ("stage",)))
+JOB_DURATION = REGISTRY.register(Histogram(
+    "kid_job_duration_seconds", "Wall time of a job from its start to its result", STAGE_BUCKETS, ("status",)))
+QUEUE_WAIT = REGISTRY.register(Histogram(
+    "kid_job_queue_wait_seconds", "Time a job waited in the scheduler queue", STAGE_BUCKETS))
+QUEUE_DEPTH = REGISTRY.register(Histogram(
+    "kid_job_queue_depth", "Jobs already waiting when a job is submitted", QUEUE_DEPTH_BUCKETS))
+RESULT_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "kid_result_cache_lookups_total", "Result cache lookups (hit, partial: some stages restored, miss)",
+    ("outcome",)))
+
+# Observed in the stage processes (stage_metrics.observe)
+REGISTRY.register(Histogram(
+    "kid_parse_duration_seconds", "MinerU layout analysis and OCR or text pipe time per document",
+    STAGE_BUCKETS, ("mode", "step")))
+REGISTRY.register(Histogram(
+    "kid_vlm_image_seconds", "VLM inference time per image (batch time divided by the batch size)",
+    IMAGE_BUCKETS, ("mode",)))
+REGISTRY.register(Counter(
+    "kid_vlm_cache_lookups_total", "VLM answer cache lookups", ("mode", "outcome")))
+REGISTRY.register(Histogram(
+    "kid_llm_prompt_eval_seconds", "LLM prompt evaluation time (until the first token) per call", STAGE_BUCKETS))
+REGISTRY.register(Histogram(
+    "kid_llm_generation_seconds", "LLM generation time (after the first token) per call", STAGE_BUCKETS))
+REGISTRY.register(Histogram(
+    "kid_llm_completion_tokens", "Tokens generated per LLM call", TOKEN_BUCKETS))
+REGISTRY.register(Counter(
+    "kid_llm_prefix_cache_lookups_total", "Prompt prefix KV state lookups", ("outcome",)))
+REGISTRY.register(Histogram(
+    "kid_validation_score", "validate_document score of the extracted kid.json", SCORE_BUCKETS))
+
+
+def record_observation(observation: Observation, registry: MetricsRegistry = REGISTRY) -> None:
+    """Add an observation forwarded by a stage process to the registry.
+
+    Unknown metrics (e.g. from a worker running a newer version) are ignored rather
+    than failing the job.
+    """
+    try:
+        registry.observe(observation["name"], observation["value"], **observation.get("labels", {}))
+    except (KeyError, ValueError, TypeError) as e:
+        print(f"Ignoring stage metric {observation!r}: {e}")
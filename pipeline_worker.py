@@ -0,0 +1,504 @@
+"""
+Persistent Pipeline Workers
+Long-lived processes that load the heavy models once (MinerU's doc_analyze weights,
+Qwen2-VL and the GGUF model) and then serve pipeline stages over a local socket.
+
+Workers run per Python environment, mirroring run_pipeline.sh:
+    MinerU/bin/python3.10 pipeline_worker.py mineru [index]   # stage "parse"  (main.process_pdf)
+    .venv/bin/python      pipeline_worker.py llm [index]      # stages "enrich", "extract" and "resume"
+
+The batch command (batch_pipeline.py) gives each stage its own process so that they
+overlap across documents; it uses "vlm" (enrich only) and "llama" (extract and
+resume only) workers instead of "llm".
+
+This module must stay importable from both environments, so model imports are lazy.
+"""
+
+import json
+import os
+import queue
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from dataclasses import dataclass, field
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from jobs import PIPELINE_STAGES, JobWorkspace
+import profiling
+from profiling import bind, job_profile, span
+from stage_metrics import observe, set_sink
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+LLM_SRC_DIR = os.path.join(PROJECT_ROOT, "LLM", "src")
+
+WORKER_PYTHONS = {
+    "mineru": os.path.join(PROJECT_ROOT, "MinerU", "bin", "python3.10"),
+    "llm": os.path.join(PROJECT_ROOT, ".venv", "bin", "python"),
+    "vlm": os.path.join(PROJECT_ROOT, ".venv", "bin", "python"),
+    "llama": os.path.join(PROJECT_ROOT, ".venv", "bin", "python"),
+}
+# Worker i of a kind listens on its base port + i
+WORKER_BASE_PORTS = {
+    "mineru": int(os.environ.get("KID_MINERU_WORKER_PORT", "6100")),
+    "llm": int(os.environ.get("KID_LLM_WORKER_PORT", "6200")),
+    "vlm": int(os.environ.get("KID_VLM_WORKER_PORT", "6300")),
+    "llama": int(os.environ.get("KID_LLAMA_WORKER_PORT", "6400")),
+}
+WORKERS_PER_ENV = int(os.environ.get("KID_WORKERS_PER_ENV", "1"))
+# Requests are pickled, so the key is what keeps other local processes from running
+# code in a worker: a random key per app start, handed to the workers it spawns
+AUTHKEY_ENV = "KID_WORKER_AUTHKEY"
+AUTHKEY = (os.environ.get(AUTHKEY_ENV) or secrets.token_hex(32)).encode()
+STARTUP_TIMEOUT = float(os.environ.get("KID_WORKER_STARTUP_TIMEOUT", "600"))
+# Pass the stage outputs between workers as objects instead of files (KID_IN_MEMORY=0 to disable)
+IN_MEMORY = os.environ.get("KID_IN_MEMORY", "1") == "1"
+
+
+@dataclass
+class DocumentArtifacts:
+    """Outputs of the stages for one document, handed from stage to stage in memory."""
+    markdown: Optional[str] = None
+    images: Dict[str, bytes] = field(default_factory=dict)
+    enriched_markdown: Optional[str] = None
+    risk: Optional[Dict[str, Any]] = None
+    result: Optional[Dict[str, Any]] = None
+
+    @classmethod
+    def load(cls, workspace: JobWorkspace, from_stage: str = "parse") -> "DocumentArtifacts":
+        """Read from the workspace the outputs of the stages before ``from_stage``."""
+        artifacts = cls()
+        if from_stage == "enrich":
+            with open(workspace.markdown_path, "r", encoding="utf-8") as f:
+                artifacts.markdown = f.read()
+            if os.path.isdir(workspace.images_dir):
+                for name in os.listdir(workspace.images_dir):
+                    with open(os.path.join(workspace.images_dir, name), "rb") as f:
+                        artifacts.images[name] = f.read()
+        elif from_stage == "extract":
+            with open(workspace.enriched_markdown_path, "r", encoding="utf-8") as f:
+                artifacts.enriched_markdown = f.read()
+            if os.path.exists(workspace.risk_path):
+                with open(workspace.risk_path, "r", encoding="utf-8") as f:
+                    artifacts.risk = json.load(f)
+        return artifacts
+
+    def save(self, workspace: JobWorkspace) -> None:
+        """Write the available artifacts to the usual workspace files."""
+        if self.markdown is not None:
+            with open(workspace.markdown_path, "w", encoding="utf-8") as f:
+                f.write(self.markdown)
+            os.makedirs(workspace.images_dir, exist_ok=True)
+            for name, data in self.images.items():
+                with open(os.path.join(workspace.images_dir, name), "wb") as f:
+                    f.write(data)
+        if self.enriched_markdown is not None:
+            with open(workspace.enriched_markdown_path, "w", encoding="utf-8") as f:
+                f.write(self.enriched_markdown)
+        if self.risk is not None:
+            with open(workspace.risk_path, "w", encoding="utf-8") as f:
+                json.dump(self.risk, f)
+        if self.result is not None:
+            with open(workspace.json_path, "w", encoding="utf-8") as f:
+                json.dump(self.result, f, indent=2, ensure_ascii=False)
+
+
+class StageWorker:
+    """Base worker: loads its models once, then dispatches stage requests."""
+
+    kind = ""
+
+    def __init__(self):
+        self.load_timings: Dict[str, float] = {}
+        # Sends an intermediate event to the client of the current request
+        self.emit: Callable[[str, Any], None] = lambda event, data: None
+
+    def emit_section(self, name: str, value: Any) -> None:
+        self.emit("section", {"section": name, "value": value})
+
+    def load(self) -> None:
+        raise NotImplementedError
+
+    def run(self, stage: str, **kwargs) -> Any:
+        handler = getattr(self, f"stage_{stage}", None)
+        if handler is None:
+            raise ValueError(f"Unknown stage '{stage}' for worker '{self.kind}'")
+        return handler(**kwargs)
+
+    def _timed_load(self, name: str, loader):
+        start = time.perf_counter()
+        result = loader()
+        self.load_timings[name] = time.perf_counter() - start
+        print(f"[{self.kind}] {name} loaded in {self.load_timings[name]:.2f}s")
+        return result
+
+
+class MineruWorker(StageWorker):
+    """Runs main.process_pdf with the doc_analyze models kept in memory."""
+
+    kind = "mineru"
+
+    def load(self) -> None:
+        from main import parse_pdf_in_memory, process_pdf
+        self.process_pdf = process_pdf
+        self.parse_pdf_in_memory = parse_pdf_in_memory
+
+        def warm_models():
+            # doc_analyze caches its models in ModelSingleton: warming it here
+            # moves the load out of the first request.
+            from magic_pdf.model.doc_analyze_by_custom_model import ModelSingleton
+            for ocr in (False, True):
+                ModelSingleton().get_model(ocr, False)
+
+        try:
+            self._timed_load("doc_analyze", warm_models)
+        except Exception as e:
+            # The singleton API varies across magic-pdf versions; models will then
+            # be loaded by the first request and stay cached afterwards.
+            print(f"[{self.kind}] Could not pre-load doc_analyze models: {e}")
+
+    def stage_parse(self, pdf_path: str, output_dir: Optional[str] = None) -> None:
+        self.process_pdf(pdf_path, output_dir)
+
+    def stage_parse_memory(self, pdf_bytes: bytes) -> Dict[str, Any]:
+        markdown, images = self.parse_pdf_in_memory(pdf_bytes)
+        return {"markdown": markdown, "images": images}
+
+
+class LLMWorker(StageWorker):
+    """Runs the image enrichment and JSON extraction with Qwen2-VL and llama.cpp loaded."""
+
+    kind = "llm"
+    # Models loaded at startup
+    models = ("qwen2_vl", "llama_cpp")
+
+    def load(self) -> None:
+        if LLM_SRC_DIR not in sys.path:
+            sys.path.append(LLM_SRC_DIR)
+        import process_markdown_fixed
+        import llm_test_options
+        import resume
+        from model_service import get_model_service
+        self.process_markdown_fixed = process_markdown_fixed
+        self.llm_test_options = llm_test_options
+        # The LLM modules live outside the repository root: hand them the observer and profiler
+        llm_test_options.set_observer(observe)
+        llm_test_options.set_profiler(profiling)
+        self.resume = resume
+
+        if "qwen2_vl" in self.models:
+            self.vlm = self._timed_load("qwen2_vl", process_markdown_fixed.load_model)
+        if "llama_cpp" in self.models:
+            model_config = llm_test_options.load_config()["model"]
+            # Shared with resume.py: the GGUF model is loaded once for both
+            self.llm_service = self._timed_load("llama_cpp", lambda: get_model_service(model_config))
+
+    def stage_enrich(self, md_path: str, output_path: str, risk_file: Optional[str] = None) -> None:
+        self.process_markdown_fixed.process_markdown(md_path, output_path, model_bundle=self.vlm,
+                                                     risk_file=risk_file)
+
+    def stage_extract(self, input_path: str, output_path: str, risk_path: Optional[str] = None) -> None:
+        written = self.llm_test_options.main(input_path=input_path, output_path=output_path, risk_path=risk_path,
+                                             on_section=self.emit_section)
+        if not written:
+            raise ValueError("No valid JSON could be extracted from the document")
+
+    def stage_resume(self, output_path: str, input_path: Optional[str] = None,
+                     json_path: Optional[str] = None) -> None:
+        self.resume.main(input_path, output_path, json_file=json_path)
+
+    def stage_enrich_memory(self, markdown: str, images: Dict[str, bytes]) -> Dict[str, Any]:
+        enriched_markdown, risk = self.process_markdown_fixed.enrich_markdown(
+            markdown, self.process_markdown_fixed.bytes_image_opener(images), self.vlm
+        )
+        return {"enriched_markdown": enriched_markdown, "risk": risk}
+
+    def stage_extract_memory(self, enriched_markdown: str,
+                             risk: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        model_config = self.llm_test_options.load_config()["model"]
+        result = self.llm_service.run(bind(self.llm_test_options.extract), enriched_markdown, model_config, risk,
+                                      on_section=self.emit_section)
+        if result is None:
+            raise ValueError("No valid JSON could be extracted from the document")
+        return {"result": result}
+
+
+class VLMWorker(LLMWorker):
+    """Image enrichment only (Qwen2-VL), for pipelines giving each stage its own worker."""
+
+    kind = "vlm"
+    models = ("qwen2_vl",)
+
+
+class LlamaWorker(LLMWorker):
+    """JSON extraction and summary only (llama.cpp), for pipelines giving each stage its own worker."""
+
+    kind = "llama"
+    models = ("llama_cpp",)
+
+
+WORKERS = {
+    "mineru": MineruWorker,
+    "llm": LLMWorker,
+    "vlm": VLMWorker,
+    "llama": LlamaWorker,
+}
+
+
+def worker_address(kind: str, index: int = 0) -> Tuple[str, int]:
+    return ("127.0.0.1", WORKER_BASE_PORTS[kind] + index)
+
+
+def serve(kind: str, index: int = 0) -> None:
+    """Load the models of a worker and serve requests until interrupted.
+
+    Requests are handled one at a time: the models are not safe to share between
+    concurrent generations.
+    """
+    if not os.environ.get(AUTHKEY_ENV):
+        raise SystemExit(f"{AUTHKEY_ENV} is not set: the worker would accept no client")
+    worker = WORKERS[kind]()
+    worker.load()
+    # Observations made by the stages go to the client of the current request
+    set_sink(lambda observation: worker.emit("metric", observation))
+
+    address = worker_address(kind, index)
+    with Listener(address, authkey=AUTHKEY) as listener:
+        print(f"[{kind}] Worker ready on {address}")
+        while True:
+            with listener.accept() as conn:
+                try:
+                    request = conn.recv()
+                except EOFError:
+                    continue
+
+                if request.get("stage") == "ping":
+                    conn.send({"ok": True, "load_timings": worker.load_timings})
+                    continue
+
+                worker.emit = lambda event, data: conn.send({"event": event, "data": data})
+                start = time.perf_counter()
+                try:
+                    # Profiled jobs send the directory receiving this request's profile
+                    with job_profile(request.get("profile_dir"), f"{kind}-{request['stage']}"):
+                        output = worker.run(request["stage"], **request.get("kwargs", {}))
+                    response = {"ok": True, "output": output}
+                except Exception as e:
+                    traceback.print_exc()
+                    response = {"ok": False, "error": str(e)}
+                response["duration"] = time.perf_counter() - start
+                response["load_timings"] = worker.load_timings
+                conn.send(response)
+
+
+class WorkerClient:
+    """Client side of a persistent worker, used by the Flask app."""
+
+    def __init__(self, kind: str, index: int = 0):
+        self.kind = kind
+        self.index = index
+        self.address = worker_address(kind, index)
+        self.process: Optional[subprocess.Popen] = None
+
+    def call(self, stage: str, on_event: Optional[Callable[[str, Any], None]] = None,
+             profile_dir: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Run a stage; intermediate events are passed to ``on_event`` as they arrive.
+
+        With ``profile_dir``, the worker writes a CPU profile and a span trace of
+        the request to that directory (see profiling.py).
+        """
+        request = {"stage": stage, "kwargs": kwargs}
+        if profile_dir is not None:
+            request["profile_dir"] = profile_dir
+        with Client(self.address, authkey=AUTHKEY) as conn:
+            conn.send(request)
+            while True:
+                response = conn.recv()
+                if "event" not in response:
+                    break
+                if on_event is not None:
+                    on_event(response["event"], response["data"])
+        if not response.get("ok"):
+            raise Exception(f"Worker {self.kind} failed on stage '{stage}': {response.get('error')}")
+        return response
+
+    def is_alive(self) -> bool:
+        try:
+            self.call("ping")
+            return True
+        except AuthenticationError:
+            raise Exception(f"Worker {self.kind} on {self.address} uses another {AUTHKEY_ENV}")
+        except (ConnectionError, OSError):
+            return False
+
+    def ensure_started(self) -> None:
+        """Start the worker in its own environment if nothing answers on its address."""
+        if self.is_alive():
+            return
+        if self.process is None or self.process.poll() is not None:
+            print(f"Starting {self.kind} worker {self.index}...")
+            self.process = subprocess.Popen(
+                [WORKER_PYTHONS[self.kind], os.path.abspath(__file__), self.kind, str(self.index)],
+                cwd=PROJECT_ROOT,
+                env={**os.environ, AUTHKEY_ENV: AUTHKEY.decode()},
+            )
+        deadline = time.monotonic() + STARTUP_TIMEOUT
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise Exception(f"Worker {self.kind} exited with code {self.process.returncode}")
+            if self.is_alive():
+                return
+            time.sleep(1)
+        raise Exception(f"Worker {self.kind} did not start within {STARTUP_TIMEOUT:.0f}s")
+
+
+class WarmPipeline:
+    """Same stages as run_pipeline.sh, executed by the persistent workers.
+
+    Each stage checks a worker out of its pool, so up to ``KID_WORKERS_PER_ENV``
+    jobs can be in the same stage at once.
+    """
+
+    def __init__(self, workers_per_env: int = WORKERS_PER_ENV, kinds: Tuple[str, ...] = ("mineru", "llm")):
+        self.clients = {
+            kind: [WorkerClient(kind, index) for index in range(workers_per_env)]
+            for kind in kinds
+        }
+        self.pools: Dict[str, "queue.Queue[WorkerClient]"] = {}
+        for kind, clients in self.clients.items():
+            self.pools[kind] = queue.Queue()
+            for client in clients:
+                self.pools[kind].put(client)
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._started:
+                return
+            for clients in self.clients.values():
+                for client in clients:
+                    client.ensure_started()
+            self._started = True
+
+    def call(self, kind: str, stage: str, on_event: Optional[Callable[[str, Any], None]] = None,
+             profile_dir: Optional[str] = None, **kwargs) -> Dict[str, Any]:
+        """Run a stage on the first free worker of the given kind."""
+        client = self.pools[kind].get()
+        try:
+            return client.call(stage, on_event=on_event, profile_dir=profile_dir, **kwargs)
+        finally:
+            self.pools[kind].put(client)
+
+    def run(self, workspace: JobWorkspace,
+            on_stage: Optional[Callable[[str], None]] = None,
+            from_stage: str = "parse",
+            in_memory: bool = IN_MEMORY,
+            save_artifacts: bool = True,
+            on_section: Optional[Callable[[str, Any], None]] = None,
+            on_metric: Optional[Callable[[Dict[str, Any]], None]] = None,
+            profile_dir: Optional[str] = None) -> Tuple[Dict[str, Any], Dict[str, float]]:
+        """Run the pipeline on the PDF of a job workspace.
+
+        Args:
+            workspace: Job directory holding the PDF and receiving the outputs
+            on_stage: Called with the stage name when each stage starts
+            from_stage: First stage to run; the outputs of the previous stages
+                must already be in the workspace
+            in_memory: Hand the markdown, image bytes and JSON from stage to stage
+                as objects instead of files
+            save_artifacts: In memory mode, also write the stage outputs to the
+                workspace (e.g. for the result cache)
+            on_section: Called with each top-level kid.json section (product,
+                risk, ...) as soon as the LLM has generated it
+            on_metric: Called with each stage_metrics observation made by the workers
+            profile_dir: If given, each worker writes a CPU profile and a span trace
+                of its stage to this directory, and the stages are recorded as spans
+                of the caller's active profile
+
+        Returns:
+            Tuple containing the kid.json content and the per-stage timings. The
+            ``saved_model_load`` entry is the model load time a cold run would have paid.
+        """
+        self.start()
+        artifacts = DocumentArtifacts.load(workspace, from_stage) if in_memory else None
+        stages = PIPELINE_STAGES[PIPELINE_STAGES.index(from_stage):]
+        timings: Dict[str, float] = {}
+        saved = 0.0
+
+        def on_event(event: str, data: Any) -> None:
+            if event == "section" and on_section is not None:
+                on_section(data["section"], data["value"])
+            elif event == "metric" and on_metric is not None:
+                on_metric(data)
+
+        for stage in stages:
+            if on_stage is not None:
+                on_stage(stage)
+            start = time.perf_counter()
+            kind, request_stage, kwargs = self._stage_request(stage, workspace, artifacts)
+            with span(stage, worker=kind):
+                response = self.call(kind, request_stage, on_event=on_event, profile_dir=profile_dir, **kwargs)
+            if artifacts is not None:
+                for name, value in response["output"].items():
+                    setattr(artifacts, name, value)
+            timings[stage] = time.perf_counter() - start
+            timings[f"{stage}_worker"] = response["duration"]
+            if stage in ("parse", "extract"):
+                # Count each worker once
+                saved += sum(response["load_timings"].values())
+
+        if artifacts is not None:
+            result = artifacts.result
+            if save_artifacts:
+                artifacts.save(workspace)
+        else:
+            with open(workspace.json_path, "r") as f:
+                result = json.load(f)
+
+        timings["total"] = sum(timings[stage] for stage in stages)
+        timings["saved_model_load"] = saved
+        return result, timings
+
+    @staticmethod
+    def _stage_request(stage: str, workspace: JobWorkspace,
+                       artifacts: Optional[DocumentArtifacts]) -> Tuple[str, str, Dict[str, Any]]:
+        """Worker kind, worker stage and arguments of a pipeline stage.
+
+        Without artifacts the stages exchange their outputs through the workspace
+        files; with artifacts they receive and return them as objects.
+        """
+        if stage == "parse":
+            if artifacts is None:
+                return "mineru", "parse", {"pdf_path": workspace.pdf_path, "output_dir": workspace.dir}
+            with open(workspace.pdf_path, "rb") as f:
+                return "mineru", "parse_memory", {"pdf_bytes": f.read()}
+        if stage == "enrich":
+            if artifacts is None:
+                return "llm", "enrich", {"md_path": workspace.markdown_path,
+                                         "output_path": workspace.enriched_markdown_path,
+                                         "risk_file": workspace.risk_path}
+            return "llm", "enrich_memory", {"markdown": artifacts.markdown, "images": artifacts.images}
+        if artifacts is None:
+            return "llm", "extract", {"input_path": workspace.enriched_markdown_path,
+                                      "output_path": workspace.json_path,
+                                      "risk_path": workspace.risk_path}
+        return "llm", "extract_memory", {"enriched_markdown": artifacts.enriched_markdown,
+                                         "risk": artifacts.risk}
+
+
+def main():
+    """Main entry point of the script."""
+    if len(sys.argv) not in (2, 3) or sys.argv[1] not in WORKERS:
+        print(f"Usage: python pipeline_worker.py <{'|'.join(WORKERS)}> [index]")
+        sys.exit(1)
+    index = int(sys.argv[2]) if len(sys.argv) == 3 else 0
+    serve(sys.argv[1], index)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,40 +1,45 @@
 import re
-import torch
-from transformers import Qwen2VLForConditionalGeneration, AutoTokenizer, AutoProcessor
+import json
 from PIL import Image
+import io
 import os
+import time
 from qwen_vl_utils import process_vision_info
+from image_prefilter import ImagePrefilter, NO_RISK_RESPONSE
+from vlm_cache import DescriptionCache, prompt_version
+from vlm_backends import FAKE_RISK_LEVEL, VLM_BACKEND, FakeVLMBackend, VLMBackend
+from stage_metrics import observe
+from profiling import PROFILE_DIR, job_profile, span
+
+MODEL_ID = "Qwen/Qwen2-VL-2B-Instruct"
+MAX_NEW_TOKENS = 128
+
+def load_model(backend=VLM_BACKEND):
+    """Charge le backend VLM : "qwen" (Qwen2-VL) ou "fake" (réponses factices, sans torch)."""
+    if backend == "fake":
+        print("Utilisation du VLM factice")
+        return FakeVLMBackend(
+            description=RISK_SENTENCE.format(level=FAKE_RISK_LEVEL) if FAKE_RISK_LEVEL else NO_RISK_RESPONSE,
+            level=FAKE_RISK_LEVEL,
+        )
+
+    # torch et transformers ne sont importés que pour le vrai modèle
+    import torch
+    from transformers import Qwen2VLForConditionalGeneration, AutoProcessor
 
-def load_model():
     device = "mps" if torch.backends.mps.is_available() else "cpu"
     print(f"Utilisation du device: {device}")
     
     model = Qwen2VLForConditionalGeneration.from_pretrained(
-        "Qwen/Qwen2-VL-2B-Instruct",
+        MODEL_ID,
         torch_dtype="auto",
         device_map=device
     ).eval()
     
-    processor = AutoProcessor.from_pretrained("Qwen/Qwen2-VL-2B-Instruct")
-    return model, processor, device
-
-def get_image_description(image_path, model, processor, device):
-    try:
-        # Utiliser le chemin complet fourni
-        if not os.path.exists(image_path):
-            return f"[Erreur: Image non trouvée: {image_path}]"
-            
-        image = Image.open(image_path)
-        
-        messages = [
-            {
-                "role": "user",
-                "content": [
-                    {
-                        "type": "image",
-                        "image": image,
-                    },
-                    {"type": "text", "text": """Analyse cette image et suis ces instructions précises :
+    processor = AutoProcessor.from_pretrained(MODEL_ID)
+    return QwenVLBackend(model, processor, device)
+
+RISK_SCALE_PROMPT = """Analyse cette image et suis ces instructions précises :
 
 1. Vérifie d'abord si l'image contient une échelle de risque numérotée de 1 à 7 avec un chiffre mis en évidence.
    Une échelle de risque valide doit avoir :
@@ -49,71 +54,359 @@ def get_image_description(image_path, model, processor, device):
 3. Si l'image ne contient PAS une échelle de risque valide selon les critères ci-dessus :
    - Réponds UNIQUEMENT : "cette image ne semble pas indiquer de risque"
 
-Ne fais AUCUN autre commentaire ou description. Ta réponse doit être UNIQUEMENT l'une des deux phrases mentionnées ci-dessus."""},
-                ],
-            }
-        ]
+Ne fais AUCUN autre commentaire ou description. Ta réponse doit être UNIQUEMENT l'une des deux phrases mentionnées ci-dessus."""
+
+# Mode contraint : un seul passage avant, probabilités des chiffres "0" (pas d'échelle) à "7"
+RISK_LEVEL_PROMPT = """Cette image contient-elle une échelle de risque numérotée de 1 à 7 avec un chiffre mis en évidence ?
+
+Réponds par un seul chiffre : le chiffre mis en évidence (de 1 à 7), ou 0 si l'image ne contient pas d'échelle de risque."""
+RISK_CLASSES = ["0", "1", "2", "3", "4", "5", "6", "7"]
+RISK_SENTENCE = "le niveau de risque de ce document est : {level}"
+RISK_SENTENCE_PATTERN = re.compile(r"niveau de risque de ce document est\s*:\s*([1-7])")
+
+# "describe" : réponse libre du VLM, "risk_level" : score des logits en un passage
+VLM_MODE = os.environ.get("KID_VLM_MODE", "describe")
+
+# Nombre d'images envoyées ensemble à model.generate
+VLM_BATCH_SIZE = int(os.environ.get("KID_VLM_BATCH_SIZE", "4"))
+
+# Pré-filtre des images qui ne peuvent pas être une échelle de risque (KID_VLM_PREFILTER=0 pour le désactiver)
+PREFILTER = ImagePrefilter() if os.environ.get("KID_VLM_PREFILTER", "1") == "1" else None
+
+# Tokens produits par le VLM et temps passé à les produire, écrits dans KID_STATS_PATH
+# s'il est défini (mesures de benchmark.py)
+VLM_STATS = {"completion_tokens": 0, "generation": 0.0}
+
+# Réponses du VLM partagées entre documents et workers (KID_VLM_CACHE=0 pour le désactiver)
+VLM_CACHE_ENABLED = os.environ.get("KID_VLM_CACHE", "1") == "1"
+# Les réponses du backend factice ne doivent pas être servies au vrai modèle
+CACHE_MODEL_ID = MODEL_ID if VLM_BACKEND == "qwen" else VLM_BACKEND
+DESCRIPTION_CACHE = (
+    DescriptionCache(CACHE_MODEL_ID, prompt_version(RISK_SCALE_PROMPT, max_new_tokens=MAX_NEW_TOKENS))
+    if VLM_CACHE_ENABLED else None
+)
+RISK_LEVEL_CACHE = (
+    DescriptionCache(CACHE_MODEL_ID, prompt_version(RISK_LEVEL_PROMPT, classes="".join(RISK_CLASSES)))
+    if VLM_CACHE_ENABLED else None
+)
+
+IMAGE_PATTERN = re.compile(r'!\[([^\]]*)\]\(([^)]+)\)')
+
+def build_messages(image, prompt=RISK_SCALE_PROMPT):
+    return [
+        {
+            "role": "user",
+            "content": [
+                {
+                    "type": "image",
+                    "image": image,
+                },
+                {"type": "text", "text": prompt},
+            ],
+        }
+    ]
 
-        text = processor.apply_chat_template(
+def prepare_inputs(images, prompt, processor, device):
+    """Construit les entrées du modèle pour un lot d'images avec le même prompt."""
+    texts = []
+    image_inputs = []
+    for image in images:
+        messages = build_messages(image, prompt)
+        texts.append(processor.apply_chat_template(
             messages, tokenize=False, add_generation_prompt=True
-        )
-        
-        image_inputs, video_inputs = process_vision_info(messages)
-        inputs = processor(
-            text=[text],
-            images=image_inputs,
-            padding=True,
-            return_tensors="pt",
-        )
-        
-        inputs = inputs.to(device)
-        
-        generated_ids = model.generate(**inputs, max_new_tokens=128)
-        generated_ids_trimmed = [
-            out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
-        ]
-        
-        response = processor.batch_decode(
-            generated_ids_trimmed,
-            skip_special_tokens=True,
-            clean_up_tokenization_spaces=False
-        )[0]
-        
-        return f"[Description d'image: {response}]"
-    except Exception as e:
-        return f"[Erreur lors de l'analyse de l'image: {str(e)}]"
+        ))
+        images_of_message, _ = process_vision_info(messages)
+        image_inputs.extend(images_of_message)
 
-def process_markdown(input_file, output_file):
-    print("Chargement du modèle...")
-    model, processor, device = load_model()
+    # Padding à gauche : toutes les séquences se terminent au même index pour la génération
+    processor.tokenizer.padding_side = "left"
+    inputs = processor(
+        text=texts,
+        images=image_inputs,
+        padding=True,
+        return_tensors="pt",
+    )
     
-    print("Lecture du fichier markdown...")
-    with open(input_file, 'r', encoding='utf-8') as f:
-        content = f.read()
+    return inputs.to(device)
+
+def generate_descriptions(images, model, processor, device):
+    """Génère les réponses du VLM pour un lot d'images en un seul appel à generate."""
+    inputs = prepare_inputs(images, RISK_SCALE_PROMPT, processor, device)
     
-    def replace_image(match):
-        image_path = match.group(2)
-        # Construire le chemin vers le dossier images à la racine
-        image_path = os.path.join(os.path.dirname(input_file), "images", os.path.basename(image_path))
-        print(f"Analyse de l'image: {image_path}")
-        return get_image_description(image_path, model, processor, device)
+    start = time.perf_counter()
+    generated_ids = model.generate(**inputs, max_new_tokens=MAX_NEW_TOKENS)
+    generated_ids_trimmed = [
+        out_ids[len(in_ids):] for in_ids, out_ids in zip(inputs.input_ids, generated_ids)
+    ]
+    VLM_STATS["generation"] += time.perf_counter() - start
+    VLM_STATS["completion_tokens"] += sum(len(ids) for ids in generated_ids_trimmed)
     
-    print("Traitement des images...")
-    content_with_descriptions = re.sub(r'!\[([^\]]*)\]\(([^)]+)\)', replace_image, content)
+    return processor.batch_decode(
+        generated_ids_trimmed,
+        skip_special_tokens=True,
+        clean_up_tokenization_spaces=False
+    )
+
+def score_risk_levels(images, model, processor, device):
+    """Niveau de risque et confiance pour un lot d'images, sans génération autorégressive.
+
+    Un seul passage avant : les logits du prochain token sont restreints aux chiffres
+    de RISK_CLASSES puis normalisés. Le niveau vaut None quand "0" (pas d'échelle) l'emporte.
+    """
+    import torch
+
+    inputs = prepare_inputs(images, RISK_LEVEL_PROMPT, processor, device)
+    class_ids = [processor.tokenizer.convert_tokens_to_ids(digit) for digit in RISK_CLASSES]
+    
+    start = time.perf_counter()
+    with torch.no_grad():
+        logits = model(**inputs).logits[:, -1, :]
+    # Un seul token évalué par image
+    VLM_STATS["generation"] += time.perf_counter() - start
+    VLM_STATS["completion_tokens"] += len(images)
+    probabilities = torch.softmax(logits[:, class_ids].float(), dim=-1)
     
-    print("Écriture du fichier de sortie...")
-    # Écriture du fichier markdown uniquement
-    with open(output_file, 'w', encoding='utf-8') as f:
-        f.write(content_with_descriptions)
+    scores = []
+    for row in probabilities:
+        best = int(row.argmax())
+        scores.append({"level": best or None, "confidence": round(float(row[best]), 4)})
+    return scores
+
+class QwenVLBackend(VLMBackend):
+    """Qwen2-VL chargé en mémoire (modèle, processeur et device)."""
+
+    name = "qwen"
+
+    def __init__(self, model, processor, device):
+        self.model = model
+        self.processor = processor
+        self.device = device
+
+    def describe(self, images):
+        return generate_descriptions(images, self.model, self.processor, self.device)
+
+    def score_risk(self, images):
+        return score_risk_levels(images, self.model, self.processor, self.device)
+
+def as_vlm_backend(model_bundle):
+    """Backend VLM d'un model_bundle : un VLMBackend, ou l'ancien tuple (model, processor, device)."""
+    if isinstance(model_bundle, VLMBackend):
+        return model_bundle
+    return QwenVLBackend(*model_bundle)
+
+def run_vlm(image_paths, infer_batch, batch_size, prefilter, cache, skipped_answer, open_image=Image.open,
+            mode="describe"):
+    """Applique le pré-filtre et le cache puis infer_batch par lots sur les images restantes.
+
+    Args:
+        open_image: ouvre une image à partir de son entrée dans image_paths
+            (FileNotFoundError si elle n'existe pas)
+        mode: "describe" ou "risk_level", étiquette des métriques (/metrics)
+
+    Returns:
+        Tuple (réponses, erreurs) alignées sur image_paths ; une seule des deux est renseignée.
+    """
+    answers = [None] * len(image_paths)
+    errors = [None] * len(image_paths)
+    loaded = []
+    cache_keys = {}
+    avoided = 0
+    cached = 0
+    for index, image_path in enumerate(image_paths):
+        try:
+            image = open_image(image_path)
+            if prefilter is not None and not prefilter.should_describe(image):
+                answers[index] = skipped_answer
+                avoided += 1
+                continue
+            if cache is not None:
+                cache_keys[index] = cache.key(image)
+                answer = cache.get(cache_keys[index])
+                if answer is not None:
+                    answers[index] = answer
+                    cached += 1
+                    continue
+            loaded.append((index, image))
+        except FileNotFoundError:
+            errors[index] = f"[Erreur: Image non trouvée: {image_path}]"
+        except Exception as e:
+            errors[index] = f"[Erreur lors de l'analyse de l'image: {str(e)}]"
+
+    if prefilter is not None:
+        print(f"Pré-filtre : {avoided} appel(s) VLM évité(s) "
+              f"sur {len(image_paths)} image(s) (total : {prefilter.stats()})")
+    if cache is not None:
+        print(f"Cache VLM : {cached} réponse(s) réutilisée(s) (total : {cache.stats()})")
+        observe("kid_vlm_cache_lookups_total", cached, mode=mode, outcome="hit")
+        observe("kid_vlm_cache_lookups_total", len(cache_keys) - cached, mode=mode, outcome="miss")
+
+    for start in range(0, len(loaded), batch_size):
+        batch = loaded[start:start + batch_size]
+        print(f"Analyse de {len(batch)} image(s) en lot...")
+        try:
+            batch_start = time.perf_counter()
+            with span("vlm_batch", mode=mode, images=len(batch)):
+                batch_answers = infer_batch([image for _, image in batch])
+            # Temps par image : le lot est traité en un seul appel
+            per_image = (time.perf_counter() - batch_start) / len(batch)
+            for _ in batch:
+                observe("kid_vlm_image_seconds", per_image, mode=mode)
+            for (index, _), answer in zip(batch, batch_answers):
+                answers[index] = answer
+                if cache is not None:
+                    cache.put(cache_keys[index], answer)
+        except Exception as e:
+            for index, _ in batch:
+                errors[index] = f"[Erreur lors de l'analyse de l'image: {str(e)}]"
+    return answers, errors
+
+def get_image_descriptions(image_paths, backend, batch_size=VLM_BATCH_SIZE,
+                           prefilter=PREFILTER, cache=DESCRIPTION_CACHE, open_image=Image.open):
+    """Décrit une liste d'images par lots de batch_size, dans l'ordre des chemins."""
+    answers, errors = run_vlm(
+        image_paths,
+        backend.describe,
+        batch_size, prefilter, cache, NO_RISK_RESPONSE, open_image, mode="describe"
+    )
+    return [error or f"[Description d'image: {answer}]" for answer, error in zip(answers, errors)]
+
+def get_image_description(image_path, backend):
+    return get_image_descriptions([image_path], backend, batch_size=1)[0]
+
+def get_risk_levels(image_paths, backend, batch_size=VLM_BATCH_SIZE,
+                    prefilter=PREFILTER, cache=RISK_LEVEL_CACHE, open_image=Image.open):
+    """Score de niveau de risque de chaque image (mode contraint).
+
+    Returns:
+        Tuple (scores, erreurs) : un score est un dict {"level", "confidence"}.
+    """
+    answers, errors = run_vlm(
+        image_paths,
+        lambda images: [json.dumps(score) for score in backend.score_risk(images)],
+        batch_size, prefilter, cache, json.dumps({"level": None, "confidence": None}), open_image,
+        mode="risk_level"
+    )
+    return [json.loads(answer) if answer else None for answer in answers], errors
+
+def risk_sentence(score):
+    """Phrase du mode describe équivalente à un score, pour le markdown envoyé au LLM."""
+    if score["level"] is None:
+        return NO_RISK_RESPONSE
+    return RISK_SENTENCE.format(level=score["level"])
+
+def directory_image_opener(images_dir):
+    """Ouvre les images du markdown depuis le dossier images écrit par MinerU."""
+    return lambda name: Image.open(os.path.join(images_dir, name))
+
+def bytes_image_opener(images):
+    """Ouvre les images du markdown depuis leurs octets en mémoire (nom -> bytes)."""
+    def open_image(name):
+        if name not in images:
+            raise FileNotFoundError(name)
+        return Image.open(io.BytesIO(images[name]))
+    return open_image
+
+def enrich_markdown(content, open_image, model_bundle, batch_size=VLM_BATCH_SIZE, mode=VLM_MODE):
+    """Remplace les images d'un markdown en mémoire par leur analyse VLM.
+
+    Args:
+        content: markdown produit par MinerU
+        open_image: ouvre une image à partir de son nom de fichier (voir
+            directory_image_opener et bytes_image_opener)
+        model_bundle: backend VLM chargé par load_model (ou tuple (model, processor, device))
+        mode: "describe" (réponse libre) ou "risk_level" (un passage avant, avec confiance)
+
+    Returns:
+        Tuple (markdown enrichi, niveau de risque {"mode", "level", "confidence", "image"}) ;
+        level vaut None si aucune échelle de risque n'a été trouvée.
+    """
+    backend = as_vlm_backend(model_bundle)
     
-    print("Traitement terminé!")
+    print("Traitement des images...")
+    # Toutes les images sont collectées d'abord puis analysées par lots
+    image_names = list(dict.fromkeys(
+        os.path.basename(match.group(2)) for match in IMAGE_PATTERN.finditer(content)
+    ))
+    print(f"{len(image_names)} image(s) à analyser (lots de {batch_size}, mode {mode})")
+    risk = None
+    if mode == "risk_level":
+        scores, errors = get_risk_levels(image_names, backend, batch_size,
+                                         open_image=open_image)
+        texts = [error or f"[Description d'image: {risk_sentence(score)}]" for score, error in zip(scores, errors)]
+        candidates = [
+            {**score, "image": name}
+            for name, score in zip(image_names, scores) if score and score["level"] is not None
+        ]
+        if candidates:
+            risk = max(candidates, key=lambda candidate: candidate["confidence"])
+    else:
+        texts = get_image_descriptions(image_names, backend, batch_size,
+                                       open_image=open_image)
+        for name, text in zip(image_names, texts):
+            match = RISK_SENTENCE_PATTERN.search(text)
+            if match:
+                risk = {"level": int(match.group(1)), "confidence": None, "image": name}
+                break
+    descriptions = dict(zip(image_names, texts))
+    content_with_descriptions = IMAGE_PATTERN.sub(
+        lambda match: descriptions[os.path.basename(match.group(2))], content
+    )
+    print(f"Niveau de risque détecté : {risk}")
+    return content_with_descriptions, {"mode": mode, **(risk or {"level": None, "confidence": None, "image": None})}
+
+def process_markdown(input_file, output_file, model_bundle=None, batch_size=VLM_BATCH_SIZE,
+                     mode=VLM_MODE, risk_file=None, profile_dir=PROFILE_DIR):
+    """Remplace les images du fichier markdown par leur analyse VLM.
+
+    Args:
+        model_bundle: backend VLM déjà chargé par un worker persistant (voir load_model)
+        mode: "describe" (réponse libre) ou "risk_level" (un passage avant, avec confiance)
+        risk_file: JSON optionnel recevant {"mode", "level", "confidence", "image"}, repris
+            directement dans risk.level du kid.json
+        profile_dir: dossier recevant un profil CPU et une trace des étapes (voir
+            profiling.py) ; aucun profilage si None
+
+    Returns:
+        Le niveau de risque détecté (dict, voir enrich_markdown)
+    """
+    # Profil CPU et trace des étapes, uniquement si demandé
+    with job_profile(profile_dir, "enrich"):
+        if model_bundle is None:
+            print("Chargement du modèle...")
+            with span("load_model"):
+                model_bundle = load_model()
+        
+        print("Lecture du fichier markdown...")
+        with open(input_file, 'r', encoding='utf-8') as f:
+            content = f.read()
+        
+        # Les images sont dans le dossier images à côté du markdown
+        images_dir = os.path.join(os.path.dirname(input_file), "images")
+        content_with_descriptions, risk = enrich_markdown(
+            content, directory_image_opener(images_dir), model_bundle, batch_size, mode
+        )
+        
+        print("Écriture du fichier de sortie...")
+        with open(output_file, 'w', encoding='utf-8') as f:
+            f.write(content_with_descriptions)
+        
+        if risk_file:
+            with open(risk_file, 'w', encoding='utf-8') as f:
+                json.dump(risk, f)
+        
+        print("Traitement terminé!")
+        return risk
 
 if __name__ == "__main__":
     import sys
-    if len(sys.argv) != 3:
-        print("Usage: python process_markdown_fixed.py <input_file> <output_file>")
+    if len(sys.argv) not in (3, 4):
+        print("Usage: python process_markdown_fixed.py <input_file> <output_file> [risk_file]")
         sys.exit(1)
     
     input_file = sys.argv[1]
     output_file = sys.argv[2]
-    process_markdown(input_file, output_file)
+    risk_file = sys.argv[3] if len(sys.argv) == 4 else None
+    process_markdown(input_file, output_file, risk_file=risk_file)
+    if os.environ.get("KID_STATS_PATH"):
+        with open(os.environ["KID_STATS_PATH"], 'w', encoding='utf-8') as f:
+            json.dump(VLM_STATS, f)
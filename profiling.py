@@ -0,0 +1,195 @@
+"""
+Job Profiling
+Opt-in profiling of a single job: a CPU profile (cProfile) of each stage process and
+a trace of the stage spans in the Chrome trace-event format, to find out why one KID
+takes much longer than usual.
+
+Each process taking part in the job writes to the job's profile directory:
+    <name>.prof        cProfile statistics (python -m pstats, snakeviz)
+    <name>.trace.json  spans of the process (chrome://tracing, ui.perfetto.dev)
+and merge_traces() combines the traces of all processes into trace.json. Spans use
+wall-clock timestamps so that the traces of different processes line up.
+
+Profiling is enabled per job by giving a profile directory to the entry points
+(main.process_pdf, process_markdown_fixed.process_markdown, llm_test_options.main)
+or, for the stages started by run_pipeline.sh, through KID_PROFILE_DIR. When no
+profile is active, span() and record_span() return immediately.
+
+This module must stay importable from both environments: standard library only.
+"""
+
+import contextlib
+import cProfile
+import glob
+import json
+import os
+import pstats
+import threading
+import time
+from typing import Any, Callable, ContextManager, Dict, Iterator, List, Optional
+
+# Profile directory of the stages run as scripts (set by app.py for profiled jobs)
+PROFILE_DIR = os.environ.get("KID_PROFILE_DIR") or None
+MERGED_TRACE = "trace.json"
+
+_local = threading.local()
+_NO_SPAN = contextlib.nullcontext()
+
+
+class JobProfile:
+    """CPU profile and spans of one process's part of a job.
+
+    Args:
+        output_dir: Profile directory of the job
+        name: Name of this part (e.g. "parse"), used for the file names and as the
+            process name in the trace
+        cpu: Also run cProfile (disable for processes serving several jobs at once)
+    """
+
+    def __init__(self, output_dir: str, name: str, cpu: bool = True):
+        self.output_dir = output_dir
+        self.name = name
+        self.profiler = cProfile.Profile() if cpu else None
+        # Profilers of the other threads working for the job (see bind)
+        self.thread_profilers: List[cProfile.Profile] = []
+        self.thread_id = threading.get_ident()
+        self.events: List[Dict[str, Any]] = []
+        self.pid = os.getpid()
+        # perf_counter() + offset = wall-clock time, comparable across processes
+        self.offset = time.time() - time.perf_counter()
+
+    def record_span(self, name: str, start: float, end: float, **args: Any) -> None:
+        """Add a span measured with time.perf_counter()."""
+        self.events.append({
+            "name": name,
+            "cat": self.name,
+            "ph": "X",
+            "ts": (start + self.offset) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self.pid,
+            "tid": threading.get_ident(),
+            "args": args,
+        })
+
+    @contextlib.contextmanager
+    def span(self, name: str, **args: Any) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record_span(name, start, time.perf_counter(), **args)
+
+    @contextlib.contextmanager
+    def profile_thread(self) -> Iterator[None]:
+        """Also CPU-profile the enclosed code when it runs in another thread than the job's."""
+        profiler = None
+        if self.profiler is not None and threading.get_ident() != self.thread_id:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # Python 3.12+ allows one profiler per process, and it follows all threads
+                profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                self.thread_profilers.append(profiler)
+
+    def __enter__(self) -> "JobProfile":
+        _local.profile = self
+        self.start = time.perf_counter()
+        if self.profiler is not None:
+            self.profiler.enable()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        if self.profiler is not None:
+            self.profiler.disable()
+        self.record_span(self.name, self.start, time.perf_counter())
+        _local.profile = None
+        self.save()
+
+    def save(self) -> None:
+        os.makedirs(self.output_dir, exist_ok=True)
+        if self.profiler is not None:
+            stats = pstats.Stats(self.profiler)
+            for profiler in self.thread_profilers:
+                stats.add(profiler)
+            stats.dump_stats(os.path.join(self.output_dir, f"{self.name}.prof"))
+        metadata = {"name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": self.name}}
+        with open(os.path.join(self.output_dir, f"{self.name}.trace.json"), "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": [metadata] + self.events, "displayTimeUnit": "ms"}, f)
+        print(f"Profile of {self.name} written to {self.output_dir}")
+
+
+def active_profile() -> Optional[JobProfile]:
+    """Profile of the job running in this thread, if any."""
+    return getattr(_local, "profile", None)
+
+
+def job_profile(output_dir: Optional[str], name: str, cpu: bool = True) -> ContextManager:
+    """Profile the enclosed code into ``output_dir``; no-op without a directory.
+
+    A profile already active in this thread (e.g. started by a persistent worker
+    around a whole request) is kept rather than nested.
+    """
+    if output_dir is None or active_profile() is not None:
+        return _NO_SPAN
+    return JobProfile(output_dir, name, cpu)
+
+
+def span(name: str, **args: Any) -> ContextManager:
+    """Record the enclosed code as a span of the active profile."""
+    profile = active_profile()
+    if profile is None:
+        return _NO_SPAN
+    return profile.span(name, **args)
+
+
+def bind(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """``fn`` running with this thread's active profile, for work handed to another
+    thread (e.g. the request queue of model_service.py)."""
+    profile = active_profile()
+    if profile is None:
+        return fn
+
+    def bound(*args, **kwargs):
+        previous = active_profile()
+        _local.profile = profile
+        try:
+            with profile.profile_thread():
+                return fn(*args, **kwargs)
+        finally:
+            _local.profile = previous
+
+    return bound
+
+
+def record_span(name: str, start: float, end: float, **args: Any) -> None:
+    """Record an interval already measured with time.perf_counter() in the active profile."""
+    profile = active_profile()
+    if profile is not None:
+        profile.record_span(name, start, end, **args)
+
+
+def merge_traces(output_dir: str) -> Optional[str]:
+    """Combine the traces of all processes of a job into ``trace.json``.
+
+    Returns:
+        Path of the merged trace, or None if no process wrote one
+    """
+    events = []
+    for path in sorted(glob.glob(os.path.join(output_dir, "*.trace.json"))):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                events.extend(json.load(f)["traceEvents"])
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Skipping trace {path}: {e}")
+    if not events:
+        return None
+    merged_path = os.path.join(output_dir, MERGED_TRACE)
+    with open(merged_path, "w", encoding="utf-8") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+    return merged_path
@@ -0,0 +1,272 @@
+"""
+Result Cache
+Content-addressed cache of the pipeline artifacts, keyed by the SHA-256 of the uploaded
+PDF. Each stage has its own key, chained from the previous one and from the version of
+the code, prompt, schema and model it depends on:
+
+    parse   -> markdown + images produced by MinerU
+    enrich  -> markdown with the Qwen2-VL image descriptions
+    extract -> kid.json
+
+A change to the LLM prompt therefore only invalidates the extract entry, and the
+MinerU and VLM outputs are restored from the cache. Entries are evicted in LRU order
+once the cache exceeds its size budget.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+
+from jobs import PIPELINE_STAGES, JobWorkspace
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.environ.get("KID_CACHE_DIR", os.path.join(PROJECT_ROOT, "cache"))
+CACHE_MAX_BYTES = int(os.environ.get("KID_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+
+# Files whose content defines the behaviour of each stage (code, prompt, schema, model config).
+# resume and xml are only run by stage_runner.py.
+STAGE_DEPENDENCIES = {
+    "parse": ["main.py"],
+    "enrich": ["process_markdown_fixed.py", "qwen_vl_utils.py", "image_prefilter.py", "vlm_cache.py",
+               "vlm_backends.py"],
+    "extract": [
+        "LLM/src/llm_test_options.py",
+        "LLM/src/validation_advanced.py",
+        "LLM/src/schema_grammar.py",
+        "LLM/src/chunking.py",
+        "LLM/src/model_service.py",
+        "LLM/src/llm_backends.py",
+        "LLM/src/json_stream.py",
+        "LLM/configs/json_schema.json",
+        "LLM/configs/config.json",
+    ],
+    "resume": ["LLM/src/resume.py", "LLM/src/model_service.py", "LLM/src/llm_backends.py",
+               "LLM/configs/config.json"],
+    "xml": ["LLM/src/key_info_xml.py"],
+}
+
+# Installed packages whose version changes a stage output
+STAGE_PACKAGES = {
+    "parse": ["magic-pdf"],
+    "enrich": ["transformers"],
+    "extract": ["llama_cpp_python"],
+    "resume": ["llama_cpp_python"],
+}
+
+# Environment variables read by each stage that change its output; their values are
+# part of the stage version
+STAGE_ENVIRONMENT = {
+    "parse": ["KID_OUTPUT_PROFILE"],
+    "enrich": ["KID_VLM_BACKEND", "KID_VLM_MODE", "KID_VLM_PREFILTER", "KID_VLM_BATCH_SIZE",
+               "KID_RISK_TEMPLATES_DIR"],
+    "extract": ["KID_LLM_BACKEND", "KID_LLM_CHUNKING", "KID_LLM_MAX_TOKENS_FACTOR", "KID_LLM_GROUP_MAX_TOKENS"],
+    "resume": ["KID_LLM_BACKEND", "KID_SUMMARY_MAX_TOKENS"],
+}
+
+# Model backend variables and their production value (vlm_backends.py, LLM/src/llm_backends.py)
+PRODUCTION_BACKENDS = {"KID_VLM_BACKEND": "qwen", "KID_LLM_BACKEND": "llama"}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file, read in chunks."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _package_version(name: str) -> str:
+    from importlib.metadata import PackageNotFoundError, version
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return "missing"
+
+
+def stage_versions(stages: Iterable[str] = PIPELINE_STAGES) -> Dict[str, str]:
+    """Version fingerprint of each stage: hash of its source files, package versions and
+    the current value of its environment variables (an unset variable hashes as such)."""
+    versions = {}
+    for stage in stages:
+        digest = hashlib.sha256()
+        for relative_path in STAGE_DEPENDENCIES[stage]:
+            path = os.path.join(PROJECT_ROOT, relative_path)
+            digest.update(relative_path.encode())
+            digest.update(hash_file(path).encode() if os.path.exists(path) else b"missing")
+        for package in STAGE_PACKAGES.get(stage, []):
+            digest.update(f"{package}=={_package_version(package)}".encode())
+        for name in STAGE_ENVIRONMENT.get(stage, []):
+            value = os.environ.get(name)
+            digest.update(f"{name}={value}".encode() if value is not None else f"{name} unset".encode())
+        versions[stage] = digest.hexdigest()
+    return versions
+
+
+def fake_backends() -> List[str]:
+    """Backend variables selecting another model than the production one (e.g. the fake
+    backends used for load tests); their results must never be cached."""
+    return [name for name, production in PRODUCTION_BACKENDS.items()
+            if os.environ.get(name, production) != production]
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for filename in filenames:
+            total += os.path.getsize(os.path.join(dirpath, filename))
+    return total
+
+
+class ResultCache:
+    """LRU, size-bounded, on-disk cache of the stage artifacts of a job."""
+
+    def __init__(self, cache_dir: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.db_path = os.path.join(cache_dir, "index.db")
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, stage TEXT NOT NULL, size INTEGER NOT NULL, "
+                "last_access REAL NOT NULL)"
+            )
+        # Stage fingerprints are computed once per process
+        self.versions = stage_versions()
+        self.hits = {stage: 0 for stage in PIPELINE_STAGES}
+        self.misses = {stage: 0 for stage in PIPELINE_STAGES}
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def _entry_dir(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def keys_for(self, pdf_path: str) -> Dict[str, str]:
+        """Chained cache key of each stage for a PDF."""
+        keys = {}
+        previous = hash_file(pdf_path)
+        for stage in PIPELINE_STAGES:
+            previous = hashlib.sha256(f"{previous}:{stage}:{self.versions[stage]}".encode()).hexdigest()
+            keys[stage] = previous
+        return keys
+
+    def _lookup(self, key: str) -> Optional[str]:
+        entry_dir = self._entry_dir(key)
+        with self._connect() as conn:
+            row = conn.execute("SELECT key FROM entries WHERE key = ?", (key,)).fetchone()
+            if row is None or not os.path.isdir(entry_dir):
+                return None
+            conn.execute("UPDATE entries SET last_access = ? WHERE key = ?", (time.time(), key))
+        return entry_dir
+
+    def get_result(self, keys: Dict[str, str]) -> Optional[Dict[str, Any]]:
+        """Return the cached kid.json of a document, if any."""
+        entry_dir = self._lookup(keys["extract"])
+        try:
+            if entry_dir is not None:
+                with open(os.path.join(entry_dir, "kid.json"), "r", encoding="utf-8") as f:
+                    result = json.load(f)
+                self.hits["extract"] += 1
+                return result
+        except (OSError, json.JSONDecodeError):
+            # Evicted concurrently or corrupted: recompute
+            pass
+        self.misses["extract"] += 1
+        return None
+
+    def restore(self, workspace: JobWorkspace, keys: Dict[str, str]) -> str:
+        """Copy the latest cached intermediate artifacts into the workspace.
+
+        Returns:
+            The first stage that still has to run ("parse", "enrich" or "extract").
+        """
+        for stage, next_stage in (("enrich", "extract"), ("parse", "enrich")):
+            entry_dir = self._lookup(keys[stage])
+            if entry_dir is None:
+                self.misses[stage] += 1
+                continue
+            try:
+                self._copy_artifacts(entry_dir, workspace, stage, to_cache=False)
+            except OSError:
+                self.misses[stage] += 1
+                continue
+            self.hits[stage] += 1
+            return next_stage
+        return "parse"
+
+    def _artifacts(self, workspace: JobWorkspace, stage: str) -> Dict[str, str]:
+        """Artifact name in the cache entry -> path in the workspace."""
+        if stage == "parse":
+            return {"document.md": workspace.markdown_path, "images": workspace.images_dir}
+        if stage == "enrich":
+            return {"enriched.md": workspace.enriched_markdown_path, "risk.json": workspace.risk_path}
+        return {"kid.json": workspace.json_path}
+
+    def _copy_artifacts(self, entry_dir: str, workspace: JobWorkspace, stage: str, to_cache: bool) -> None:
+        for name, workspace_path in self._artifacts(workspace, stage).items():
+            cache_path = os.path.join(entry_dir, name)
+            src, dst = (workspace_path, cache_path) if to_cache else (cache_path, workspace_path)
+            if os.path.isdir(src):
+                shutil.copytree(src, dst, dirs_exist_ok=True)
+            elif os.path.exists(src):
+                shutil.copyfile(src, dst)
+
+    def store(self, workspace: JobWorkspace, keys: Dict[str, str], from_stage: str = "parse") -> None:
+        """Cache the artifacts of the stages computed in this job."""
+        for stage in PIPELINE_STAGES[PIPELINE_STAGES.index(from_stage):]:
+            key = keys[stage]
+            entry_dir = self._entry_dir(key)
+            tmp_dir = f"{entry_dir}.{uuid.uuid4().hex}.tmp"
+            try:
+                os.makedirs(tmp_dir)
+                self._copy_artifacts(tmp_dir, workspace, stage, to_cache=True)
+                size = _dir_size(tmp_dir)
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(tmp_dir, entry_dir)
+            except OSError as e:
+                print(f"Could not cache stage {stage}: {e}")
+                shutil.rmtree(tmp_dir, ignore_errors=True)
+                continue
+            with self._connect() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO entries (key, stage, size, last_access) VALUES (?, ?, ?, ?)",
+                    (key, stage, size, time.time()),
+                )
+        self.evict()
+
+    def evict(self) -> None:
+        """Delete the least recently used entries until the cache fits its budget."""
+        with self._connect() as conn:
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            rows = conn.execute("SELECT key, size FROM entries ORDER BY last_access").fetchall()
+            for key, size in rows:
+                if total <= self.max_bytes:
+                    break
+                conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+                shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+                total -= size
+
+    def stats(self) -> Dict[str, Any]:
+        with self._connect() as conn:
+            entries, size = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries").fetchone()
+        return {"entries": entries, "bytes": size, "max_bytes": self.max_bytes,
+                "hits": dict(self.hits), "misses": dict(self.misses)}
@@ -9,52 +9,73 @@ PROJECT_ROOT="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
 MAIN_SCRIPT="$PROJECT_ROOT/main.py"
 PROCESS_SCRIPT="$PROJECT_ROOT/process_markdown_fixed.py"
 LLM_SCRIPT="$PROJECT_ROOT/LLM/src/llm_test_options.py"
-LLM_INPUT_DIR="$PROJECT_ROOT/LLM/inputs"
-UPLOADS_DIR="$PROJECT_ROOT/uploads"
 MINERU_PYTHON="$PROJECT_ROOT/MinerU/bin/python3.10"
 VENV_PYTHON="$PROJECT_ROOT/.venv/bin/python"
 
-# Get the directory and base name of the input PDF file
-PDF_DIR=$(dirname "$1")
+# Get the base name of the input PDF file
 PDF_BASENAME=$(basename "$1" .pdf)
-MD_FILE="${PDF_DIR}/${PDF_BASENAME}.md"
 
-echo "💾 Étape 1: Exécution de main.py avec l'environnement MinerU..."
-"$MINERU_PYTHON" "$MAIN_SCRIPT" "$1"
+# Dossier de travail optionnel : chaque job y écrit tous ses fichiers,
+# ce qui permet de lancer plusieurs pipelines en parallèle
+JOB_DIR="$2"
+if [ -n "$JOB_DIR" ]; then
+    OUTPUT_DIR="$JOB_DIR"
+    LLM_INPUT="$JOB_DIR/input.txt"
+    JSON_OUTPUT="$JOB_DIR/kid.json"
+else
+    # Sans dossier de job, les fichiers intermédiaires vont dans un dossier
+    # temporaire propre à cette exécution, supprimé à la sortie
+    OUTPUT_DIR=$(mktemp -d "${TMPDIR:-/tmp}/kid-pipeline.XXXXXX") || exit 1
+    trap 'rm -rf "$OUTPUT_DIR"' EXIT
+    LLM_INPUT="$OUTPUT_DIR/input.txt"
+    JSON_OUTPUT="$PROJECT_ROOT/LLM/outputs/kid.json"
+fi
+MD_FILE="${OUTPUT_DIR}/${PDF_BASENAME}.md"
+ENRICHED_MD_FILE="${OUTPUT_DIR}/${PDF_BASENAME}_enriched.md"
+RISK_FILE="${OUTPUT_DIR}/${PDF_BASENAME}_risk.json"
 
-if [ $? -eq 0 ]; then
+# Étape de départ optionnelle : les étapes précédentes ont déjà déposé
+# leurs fichiers dans le dossier du job (par exemple depuis le cache)
+FROM_STAGE="${3:-parse}"
+case "$FROM_STAGE" in
+    parse) START_STEP=1 ;;
+    enrich) START_STEP=2 ;;
+    extract) START_STEP=3 ;;
+    *) echo "❌ Étape inconnue: $FROM_STAGE (parse, enrich ou extract)"; exit 1 ;;
+esac
+
+if [ $START_STEP -le 1 ]; then
+    echo "💾 Étape 1: Exécution de main.py avec l'environnement MinerU..."
+    if ! "$MINERU_PYTHON" "$MAIN_SCRIPT" "$1" "$OUTPUT_DIR"; then
+        echo "❌ Erreur lors de l'exécution de main.py"
+        exit 1
+    fi
     echo "✅ main.py exécuté avec succès"
-    
+fi
+
+if [ $START_STEP -le 2 ]; then
     echo "🔄 Étape 2: Exécution de process_markdown_fixed.py avec l'environnement .venv..."
-    "$VENV_PYTHON" "$PROCESS_SCRIPT" "$MD_FILE" "$MD_FILE"
-    
-    if [ $? -eq 0 ]; then
-        echo "✅ process_markdown_fixed.py exécuté avec succès"
-        
-        echo "📝 Copie du contenu markdown vers input.txt..."
-        cp "$MD_FILE" "$LLM_INPUT_DIR/input.txt"
-        
-        echo "🤖 Étape 3: Exécution de llm_test_options.py avec l'environnement .venv..."
-        "$VENV_PYTHON" "$LLM_SCRIPT"
-        
-        if [ $? -eq 0 ]; then
-            echo "✅ llm_test_options.py exécuté avec succès"
-            
-            echo "🗑️ Nettoyage des fichiers temporaires..."
-            rm -rf "$UPLOADS_DIR"/*
-            rm -f "$LLM_INPUT_DIR/input.txt"
-            
-            echo "🎉 Pipeline terminée avec succès!"
-            exit 0
-        else
-            echo "❌ Erreur lors de l'exécution de llm_test_options.py"
-            exit 1
-        fi
-    else
+    if ! "$VENV_PYTHON" "$PROCESS_SCRIPT" "$MD_FILE" "$ENRICHED_MD_FILE" "$RISK_FILE"; then
         echo "❌ Erreur lors de l'exécution de process_markdown_fixed.py"
         exit 1
     fi
-else
-    echo "❌ Erreur lors de l'exécution de main.py"
+    echo "✅ process_markdown_fixed.py exécuté avec succès"
+fi
+
+echo "📝 Copie du contenu markdown vers input.txt..."
+cp "$ENRICHED_MD_FILE" "$LLM_INPUT"
+
+echo "🤖 Étape 3: Exécution de llm_test_options.py avec l'environnement .venv..."
+# --stream-sections : chaque section du JSON est affichée dès sa génération (lue par app.py)
+# PYTHONPATH : stage_metrics.py et profiling.py, à la racine du projet (mesures lues par app.py, profil du job)
+if ! PYTHONPATH="$PROJECT_ROOT${PYTHONPATH:+:$PYTHONPATH}" "$VENV_PYTHON" "$LLM_SCRIPT" "$LLM_INPUT" "$JSON_OUTPUT" "$RISK_FILE" --stream-sections; then
+    echo "❌ Erreur lors de l'exécution de llm_test_options.py"
     exit 1
 fi
+echo "✅ llm_test_options.py exécuté avec succès"
+
+# Les fichiers intermédiaires sont supprimés avec leur dossier : le dossier temporaire
+# à la sortie, le dossier du job par l'appelant (après mise en cache)
+
+echo "🎉 Pipeline terminée avec succès!"
+exit 0
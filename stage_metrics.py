@@ -0,0 +1,54 @@
+"""
+Stage Metrics
+Observations made inside the pipeline stages (MinerU parse mode, per-image VLM time,
+LLM prompt evaluation and generation, cache lookups, validation score), forwarded to
+the process serving /metrics (app.py, see metrics.py).
+
+The stages run in other processes than the server, so each observation goes to a sink:
+    - in a persistent worker, the worker sends it to its client as a "metric" event
+      (pipeline_worker.serve);
+    - in a stage run by run_pipeline.sh with KID_STAGE_METRICS=1, it is printed on
+      stdout as a METRIC_MARKER line, read by app.py like the kid.json sections.
+Without a sink, observe() does nothing.
+
+This module must stay importable from both environments: standard library only.
+"""
+
+import json
+import os
+from typing import Any, Callable, Dict, Optional
+
+# Prefix of the observation lines printed on stdout
+METRIC_MARKER = "@@KID_METRIC "
+PRINT_METRICS = os.environ.get("KID_STAGE_METRICS") == "1"
+
+Observation = Dict[str, Any]
+
+_sink: Optional[Callable[[Observation], None]] = None
+
+
+def set_sink(sink: Optional[Callable[[Observation], None]]) -> None:
+    """Send the observations of this process to ``sink`` (None restores the default)."""
+    global _sink
+    _sink = sink
+
+
+def observe(name: str, value: float, **labels: Any) -> None:
+    """Record a value of a metric declared in metrics.py."""
+    if _sink is None and not PRINT_METRICS:
+        return
+    observation = {"name": name, "value": value, "labels": {key: str(label) for key, label in labels.items()}}
+    if _sink is not None:
+        _sink(observation)
+    else:
+        print(METRIC_MARKER + json.dumps(observation), flush=True)
+
+
+def parse_metric_line(line: str) -> Optional[Observation]:
+    """Observation printed on a stdout line, or None for any other line."""
+    if not line.startswith(METRIC_MARKER):
+        return None
+    try:
+        return json.loads(line[len(METRIC_MARKER):])
+    except json.JSONDecodeError:
+        return None
@@ -0,0 +1,263 @@
+"""
+Incremental Stage Runner
+Runs the pipeline stages on a PDF like an incremental build: each stage records a
+manifest (code version, input hashes, output hashes) in <output_dir>/manifests/, and a
+rerun skips every stage whose inputs, code and outputs are unchanged.
+
+Stages, in order:
+    parse   PDF -> markdown + images        (MinerU environment, main.py)
+    enrich  markdown -> enriched markdown + detected risk level (.venv, process_markdown_fixed.py)
+    extract enriched markdown -> kid.json   (.venv, llm_test_options.py)
+    resume  kid.json -> resume.txt          (.venv, resume.py)
+    xml     kid.json -> key-info.xml        (.venv, key_info_xml.py)
+
+Usage:
+    python stage_runner.py <pdf_file> <output_dir> [--from-stage STAGE] [--to-stage STAGE]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional
+
+from result_cache import hash_file, stage_versions
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+MINERU_PYTHON = os.path.join(PROJECT_ROOT, "MinerU", "bin", "python3.10")
+VENV_PYTHON = os.path.join(PROJECT_ROOT, ".venv", "bin", "python")
+LLM_SRC_DIR = os.path.join(PROJECT_ROOT, "LLM", "src")
+
+
+@dataclass
+class StagePaths:
+    """Files read and written by the stages for one document."""
+    pdf: str
+    output_dir: str
+
+    @property
+    def name(self) -> str:
+        return os.path.splitext(os.path.basename(self.pdf))[0]
+
+    @property
+    def markdown(self) -> str:
+        return os.path.join(self.output_dir, f"{self.name}.md")
+
+    @property
+    def images(self) -> str:
+        return os.path.join(self.output_dir, "images")
+
+    @property
+    def enriched_markdown(self) -> str:
+        return os.path.join(self.output_dir, f"{self.name}_enriched.md")
+
+    @property
+    def risk(self) -> str:
+        return os.path.join(self.output_dir, f"{self.name}_risk.json")
+
+    @property
+    def json(self) -> str:
+        return os.path.join(self.output_dir, "kid.json")
+
+    @property
+    def resume(self) -> str:
+        return os.path.join(self.output_dir, "resume.txt")
+
+    @property
+    def xml(self) -> str:
+        return os.path.join(self.output_dir, "key-info.xml")
+
+    @property
+    def manifests_dir(self) -> str:
+        return os.path.join(self.output_dir, "manifests")
+
+
+@dataclass
+class Stage:
+    """A pipeline step with its declared inputs, outputs and command."""
+    name: str
+    inputs: Callable[[StagePaths], List[str]]
+    outputs: Callable[[StagePaths], List[str]]
+    command: Callable[[StagePaths], List[str]]
+
+
+STAGES = [
+    Stage(
+        "parse",
+        inputs=lambda p: [p.pdf],
+        outputs=lambda p: [p.markdown, p.images],
+        command=lambda p: [MINERU_PYTHON, os.path.join(PROJECT_ROOT, "main.py"), p.pdf, p.output_dir],
+    ),
+    Stage(
+        "enrich",
+        inputs=lambda p: [p.markdown, p.images],
+        outputs=lambda p: [p.enriched_markdown, p.risk],
+        command=lambda p: [VENV_PYTHON, os.path.join(PROJECT_ROOT, "process_markdown_fixed.py"),
+                           p.markdown, p.enriched_markdown, p.risk],
+    ),
+    Stage(
+        "extract",
+        inputs=lambda p: [p.enriched_markdown, p.risk],
+        outputs=lambda p: [p.json],
+        command=lambda p: [VENV_PYTHON, os.path.join(LLM_SRC_DIR, "llm_test_options.py"),
+                           p.enriched_markdown, p.json, p.risk],
+    ),
+    Stage(
+        "resume",
+        # Derived from the extracted fields: the document is only evaluated by extract
+        inputs=lambda p: [p.json],
+        outputs=lambda p: [p.resume],
+        command=lambda p: [VENV_PYTHON, os.path.join(LLM_SRC_DIR, "resume.py"),
+                           "--from-json", p.json, p.resume],
+    ),
+    Stage(
+        "xml",
+        inputs=lambda p: [p.json],
+        outputs=lambda p: [p.xml],
+        command=lambda p: [VENV_PYTHON, os.path.join(LLM_SRC_DIR, "key_info_xml.py"), p.json, p.xml],
+    ),
+]
+STAGE_NAMES = [stage.name for stage in STAGES]
+
+
+def hash_path(path: str) -> Optional[str]:
+    """SHA-256 of a file, or of the relative names and contents of a directory.
+
+    Returns None if the path does not exist.
+    """
+    if os.path.isfile(path):
+        return hash_file(path)
+    if not os.path.isdir(path):
+        return None
+    digest = hashlib.sha256()
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        for filename in sorted(filenames):
+            file_path = os.path.join(dirpath, filename)
+            digest.update(os.path.relpath(file_path, path).encode())
+            digest.update(hash_file(file_path).encode())
+    return digest.hexdigest()
+
+
+def hash_paths(paths: List[str], root: str) -> Dict[str, Optional[str]]:
+    return {os.path.relpath(path, root): hash_path(path) for path in paths}
+
+
+def modification_times(paths: List[str]) -> Dict[str, Optional[int]]:
+    """Modification time of each output file (None if missing, directories excluded)."""
+    return {path: os.stat(path).st_mtime_ns if os.path.isfile(path) else None for path in paths}
+
+
+class StageRunner:
+    """Runs the stages of one document, skipping the up-to-date ones."""
+
+    def __init__(self, pdf_path: str, output_dir: str):
+        self.paths = StagePaths(os.path.abspath(pdf_path), os.path.abspath(output_dir))
+        self.versions = stage_versions(STAGE_NAMES)
+
+    def manifest_path(self, stage: Stage) -> str:
+        return os.path.join(self.paths.manifests_dir, f"{stage.name}.json")
+
+    def load_manifest(self, stage: Stage) -> Optional[Dict]:
+        try:
+            with open(self.manifest_path(stage), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+
+    def is_up_to_date(self, stage: Stage) -> bool:
+        """True if the manifest matches the current code version, inputs and outputs."""
+        manifest = self.load_manifest(stage)
+        if manifest is None or manifest.get("code_version") != self.versions[stage.name]:
+            return False
+        root = self.paths.output_dir
+        if manifest.get("inputs") != hash_paths(stage.inputs(self.paths), root):
+            return False
+        outputs = hash_paths(stage.outputs(self.paths), root)
+        return None not in outputs.values() and manifest.get("outputs") == outputs
+
+    def run_stage(self, stage: Stage) -> float:
+        root = self.paths.output_dir
+        inputs = hash_paths(stage.inputs(self.paths), root)
+        missing = [path for path, digest in inputs.items() if digest is None]
+        if missing:
+            raise FileNotFoundError(f"Stage '{stage.name}' is missing its inputs: {', '.join(missing)}")
+
+        previous_outputs = modification_times(stage.outputs(self.paths))
+        start = time.perf_counter()
+        subprocess.run(stage.command(self.paths), check=True, cwd=PROJECT_ROOT)
+        duration = time.perf_counter() - start
+
+        outputs = hash_paths(stage.outputs(self.paths), root)
+        missing = [path for path, digest in outputs.items() if digest is None]
+        if missing:
+            raise FileNotFoundError(f"Stage '{stage.name}' did not produce: {', '.join(missing)}")
+        # Outputs left over from a previous run must not be recorded as this run's
+        stale = [os.path.relpath(path, root) for path, mtime in modification_times(stage.outputs(self.paths)).items()
+                 if mtime is not None and mtime == previous_outputs[path]]
+        if stale:
+            raise FileNotFoundError(f"Stage '{stage.name}' did not rewrite: {', '.join(stale)}")
+
+        os.makedirs(self.paths.manifests_dir, exist_ok=True)
+        manifest = {
+            "stage": stage.name,
+            "code_version": self.versions[stage.name],
+            "inputs": inputs,
+            "outputs": outputs,
+            "duration": duration,
+            "completed_at": time.time(),
+        }
+        with open(self.manifest_path(stage), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, indent=2)
+        return duration
+
+    def run(self, from_stage: Optional[str] = None, to_stage: str = STAGE_NAMES[-1]) -> Dict[str, str]:
+        """Run the stages up to ``to_stage``.
+
+        Args:
+            from_stage: Stages from this one onwards are recomputed even if up to date
+            to_stage: Last stage to run
+
+        Returns:
+            Mapping of stage name to "skipped" or the run duration
+        """
+        os.makedirs(self.paths.output_dir, exist_ok=True)
+        force_from = STAGE_NAMES.index(from_stage) if from_stage else len(STAGES)
+        report = {}
+        for index, stage in enumerate(STAGES[:STAGE_NAMES.index(to_stage) + 1]):
+            if index < force_from and self.is_up_to_date(stage):
+                print(f"⏭️  {stage.name}: à jour, étape ignorée")
+                report[stage.name] = "skipped"
+                continue
+            print(f"▶️  {stage.name}: exécution...")
+            duration = self.run_stage(stage)
+            print(f"✅ {stage.name}: terminé en {duration:.1f}s")
+            report[stage.name] = f"{duration:.1f}s"
+        return report
+
+
+def main():
+    """Main entry point of the script."""
+    parser = argparse.ArgumentParser(description="Run the KID pipeline incrementally.")
+    parser.add_argument("pdf_file", help="PDF to analyse")
+    parser.add_argument("output_dir", help="Directory receiving the artifacts and manifests")
+    parser.add_argument("--from-stage", choices=STAGE_NAMES,
+                        help="Recompute this stage and the following ones")
+    parser.add_argument("--to-stage", choices=STAGE_NAMES, default=STAGE_NAMES[-1],
+                        help="Last stage to run")
+    args = parser.parse_args()
+
+    try:
+        report = StageRunner(args.pdf_file, args.output_dir).run(args.from_stage, args.to_stage)
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""
+Synthetic KID Corpus
+Generates fake but realistic Key Information Documents (French PRIIPs KID layout) as
+PDF files, so that the pipeline can be benchmarked offline on a fixed corpus.
+
+Each document has a text layer (product, objectives, risks, performance scenarios,
+costs) and a risk-scale image (1 to 7, with the level of the product highlighted),
+the image the VLM stage has to read. Documents are fully determined by the seed.
+The ground truth of each document is written to ``truth.jsonl`` next to the PDFs.
+
+Only Pillow is needed: the PDF is written directly (Helvetica text and a JPEG image).
+
+Usage:
+    python synthetic_kid.py <output_dir> [--count N] [--seed S]
+"""
+
+import argparse
+import io
+import json
+import os
+import random
+from typing import Any, Dict, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+FONT_SIZE = 10
+LINE_HEIGHT = 14
+
+ISSUERS = ["Banque Exemple SA", "Crédit Fictif", "Société Générique d'Investissement", "Epargne Modèle"]
+PRODUCT_TYPES = ["Titre de créance", "Fonds commun de placement", "Certificat", "Autocall"]
+UNDERLYINGS = ["l'indice EURO STOXX 50", "l'indice CAC 40", "l'action Exemple SA", "un panier d'actions européennes"]
+SCENARIOS = [("Tensions", -0.6, -0.2), ("Défavorable", -0.25, 0.0), ("Intermédiaire", 0.0, 0.08),
+             ("Favorable", 0.05, 0.3)]
+
+
+def generate_truth(rng: random.Random, index: int) -> Dict[str, Any]:
+    """Values of one synthetic KID."""
+    holding_years = rng.choice([3, 5, 8, 10])
+    investment = 10000
+    scenarios = []
+    for name, low, high in SCENARIOS:
+        one_year = rng.uniform(low, high)
+        annual = rng.uniform(low, high) / 2
+        scenarios.append({
+            "name": name,
+            "one_year": {"amount": round(investment * (1 + one_year)), "performance": round(100 * one_year, 2)},
+            "holding_period": {"amount": round(investment * (1 + annual) ** holding_years),
+                               "performance": round(100 * annual, 2)},
+        })
+    issue_year = rng.randint(2019, 2025)
+    return {
+        "file": f"kid_{index:03d}.pdf",
+        "name": f"{rng.choice(['Horizon', 'Patrimoine', 'Rendement', 'Opportunité'])} {rng.randint(1, 99)}",
+        "isin": "FR" + "".join(str(rng.randint(0, 9)) for _ in range(10)),
+        "currency": rng.choice(["EUR", "USD"]),
+        "issuer": rng.choice(ISSUERS),
+        "type": rng.choice(PRODUCT_TYPES),
+        "underlying": rng.choice(UNDERLYINGS),
+        "risk_level": rng.randint(1, 7),
+        "holding_years": holding_years,
+        "production_date": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{issue_year}",
+        "maturity_date": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{issue_year + holding_years}",
+        "investment": investment,
+        "scenarios": scenarios,
+        "entry_costs": round(rng.uniform(0, 3), 2),
+        "exit_costs": round(rng.uniform(0, 1), 2),
+        "recurring_costs": round(rng.uniform(0.1, 2.5), 2),
+    }
+
+
+def document_lines(truth: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """Text of the two pages; the risk-scale image is drawn after the first page's text."""
+    page_1 = [
+        "Document d'informations clés",
+        "",
+        "Objet",
+        "Le présent document contient des informations essentielles sur le produit d'investissement.",
+        "Il ne s'agit pas d'un document à caractère commercial.",
+        "",
+        "Produit",
+        f"Nom du produit : {truth['name']}",
+        f"Code ISIN : {truth['isin']}",
+        f"Initiateur : {truth['issuer']}",
+        f"Devise : {truth['currency']}",
+        f"Date de production du document : {truth['production_date']}",
+        "",
+        "En quoi consiste ce produit ?",
+        f"Type : {truth['type']}",
+        f"Objectif : offrir une exposition à {truth['underlying']} sur {truth['holding_years']} ans.",
+        f"Date d'échéance : {truth['maturity_date']}",
+        "Investisseurs de détail visés : investisseurs disposant d'une connaissance des marchés.",
+        "",
+        "Quels sont les risques et qu'est-ce que cela pourrait me rapporter ?",
+        "Indicateur de risque",
+        f"Nous supposons que vous conservez le produit {truth['holding_years']} ans.",
+        "Le risque réel peut être très différent si vous optez pour une sortie avant échéance.",
+    ]
+    page_2 = [
+        "Scénarios de performance",
+        f"Période de détention recommandée : {truth['holding_years']} ans",
+        f"Exemple d'investissement : {truth['investment']} {truth['currency']}",
+        "",
+    ]
+    for scenario in truth["scenarios"]:
+        one_year, holding = scenario["one_year"], scenario["holding_period"]
+        page_2 += [
+            f"Scénario {scenario['name']} - ce que vous pourriez obtenir après déduction des coûts :",
+            f"    si vous sortez après 1 an : {one_year['amount']} {truth['currency']} "
+            f"(rendement : {one_year['performance']} %)",
+            f"    si vous sortez après {truth['holding_years']} ans : {holding['amount']} {truth['currency']} "
+            f"(rendement annuel moyen : {holding['performance']} %)",
+        ]
+    page_2 += [
+        "",
+        "Que va me coûter cet investissement ?",
+        f"Coûts d'entrée : {truth['entry_costs']} % du montant investi",
+        f"Coûts de sortie : {truth['exit_costs']} % de votre investissement",
+        f"Coûts récurrents (frais de gestion et autres frais administratifs) : {truth['recurring_costs']} % par an",
+        "",
+        "Combien de temps dois-je le conserver, et puis-je retirer de l'argent de façon anticipée ?",
+        f"Période de détention recommandée : {truth['holding_years']} ans.",
+    ]
+    return page_1, page_2
+
+
+def risk_scale_image(level: int, width: int = 700, height: int = 170) -> Image.Image:
+    """Risk scale from 1 to 7 with ``level`` highlighted, as printed in KIDs."""
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    try:
+        font = ImageFont.load_default(size=36)
+        small_font = ImageFont.load_default(size=20)
+    except TypeError:
+        # Pillow < 10.1 has a single bitmap default font
+        font = small_font = ImageFont.load_default()
+    box = (width - 40) // 7
+    for value in range(1, 8):
+        x = 20 + (value - 1) * box
+        highlighted = value == level
+        draw.rectangle((x, 40, x + box - 6, 120), fill=(30, 60, 120) if highlighted else (225, 225, 225),
+                       outline=(80, 80, 80))
+        draw.text((x + box // 2 - 10, 58), str(value), font=font, fill="white" if highlighted else "black")
+    draw.text((20, 8), "Risque le plus faible", font=small_font, fill="black")
+    # The default font has no accented glyphs
+    draw.text((width - 210, 8), "Risque le plus fort", font=small_font, fill="black")
+    draw.line((20, 140, width - 20, 140), fill="black", width=3)
+    draw.polygon([(width - 20, 140), (width - 35, 132), (width - 35, 148)], fill="black")
+    return image
+
+
+def _pdf_text(text: str) -> bytes:
+    """PDF literal string in WinAnsi encoding."""
+    encoded = text.encode("cp1252", errors="replace")
+    return b"(" + encoded.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def _text_stream(lines: List[str], top: int) -> bytes:
+    parts = [b"BT", f"/F1 {FONT_SIZE} Tf {LINE_HEIGHT} TL {MARGIN} {top} Td".encode()]
+    for line in lines:
+        parts.append(_pdf_text(line) + b" Tj T*")
+    parts.append(b"ET")
+    return b"\n".join(parts)
+
+
+def write_pdf(path: str, pages: List[List[str]], image: Image.Image) -> None:
+    """Write a PDF with one page per list of lines, the image below the text of the first page."""
+    jpeg = io.BytesIO()
+    image.save(jpeg, format="JPEG", quality=90)
+    jpeg_bytes = jpeg.getvalue()
+
+    objects: List[bytes] = []
+
+    def add(body: bytes) -> int:
+        objects.append(body)
+        return len(objects)
+
+    def stream(header: str, data: bytes) -> bytes:
+        return f"<< {header} /Length {len(data)} >>\nstream\n".encode() + data + b"\nendstream"
+
+    catalog = add(b"")  # filled once the page tree is known
+    pages_id = add(b"")
+    font = add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding /WinAnsiEncoding >>")
+    image_id = add(stream(
+        f"/Type /XObject /Subtype /Image /Width {image.width} /Height {image.height} "
+        "/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /DCTDecode", jpeg_bytes))
+
+    page_ids = []
+    top = PAGE_HEIGHT - MARGIN
+    for number, lines in enumerate(pages):
+        content = _text_stream(lines, top)
+        resources = f"/Font << /F1 {font} 0 R >>"
+        if number == 0:
+            draw_width = PAGE_WIDTH - 2 * MARGIN
+            draw_height = draw_width * image.height // image.width
+            y = top - LINE_HEIGHT * (len(lines) + 1) - draw_height
+            content += f"\nq {draw_width} 0 0 {draw_height} {MARGIN} {y} cm /Im1 Do Q".encode()
+            resources += f" /XObject << /Im1 {image_id} 0 R >>"
+        content_id = add(stream("", content))
+        page_ids.append(add(
+            f"<< /Type /Page /Parent {pages_id} 0 R /MediaBox [0 0 {PAGE_WIDTH} {PAGE_HEIGHT}] "
+            f"/Resources << {resources} >> /Contents {content_id} 0 R >>".encode()))
+
+    objects[catalog - 1] = f"<< /Type /Catalog /Pages {pages_id} 0 R >>".encode()
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[pages_id - 1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>".encode()
+
+    out = io.BytesIO()
+    out.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(out.tell())
+        out.write(f"{number} 0 obj\n".encode() + body + b"\nendobj\n")
+    xref = out.tell()
+    out.write(f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode())
+    for offset in offsets:
+        out.write(f"{offset:010d} 00000 n \n".encode())
+    out.write(f"trailer\n<< /Size {len(objects) + 1} /Root {catalog} 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode())
+    with open(path, "wb") as f:
+        f.write(out.getvalue())
+
+
+def generate_corpus(output_dir: str, count: int = 5, seed: int = 0) -> List[str]:
+    """Write ``count`` synthetic KIDs and their ground truth to ``output_dir``.
+
+    Returns:
+        Paths of the generated PDFs
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    paths = []
+    with open(os.path.join(output_dir, "truth.jsonl"), "w", encoding="utf-8") as truth_file:
+        for index in range(count):
+            truth = generate_truth(rng, index)
+            path = os.path.join(output_dir, truth["file"])
+            write_pdf(path, list(document_lines(truth)), risk_scale_image(truth["risk_level"]))
+            truth_file.write(json.dumps(truth, ensure_ascii=False) + "\n")
+            paths.append(path)
+    return paths
+
+
+def main():
+    """Main entry point of the script."""
+    parser = argparse.ArgumentParser(description="Generate synthetic KID PDFs.")
+    parser.add_argument("output_dir", help="Directory receiving the PDFs and truth.jsonl")
+    parser.add_argument("--count", type=int, default=5, help="Number of documents")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed")
+    args = parser.parse_args()
+    for path in generate_corpus(args.output_dir, args.count, args.seed):
+        print(path)
+
+
+if __name__ == "__main__":
+    main()
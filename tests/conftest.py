@@ -0,0 +1,14 @@
+"""Test configuration: the modules are imported flatly, as the scripts do.
+
+The root modules (app.py's helpers) and LLM/src (run from the .venv) are not a
+package, so both directories are put on sys.path.
+"""
+
+import os
+import sys
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+for path in (PROJECT_ROOT, os.path.join(PROJECT_ROOT, "LLM", "src")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
@@ -0,0 +1,43 @@
+"""Batch results are keyed by path, so same-named PDFs in subdirectories do not collide."""
+
+import json
+
+from batch_pipeline import BatchPipeline, list_documents, load_done, source_dir
+
+
+class StubPipeline:
+    """WarmPipeline stand-in answering each stage call immediately."""
+
+    def start(self):
+        pass
+
+    def call(self, kind, method, **kwargs):
+        outputs = {
+            "parse_memory": {"markdown": kwargs.get("pdf_bytes", b"").decode(), "images": {}},
+            "enrich_memory": {"enriched_markdown": kwargs.get("markdown"), "risk": None},
+            "extract_memory": {"result": {"text": kwargs.get("enriched_markdown")}},
+        }
+        return {"output": outputs[method]}
+
+
+def test_same_file_names_in_subdirectories_are_kept_apart(tmp_path):
+    for subdirectory in ("fonds_a", "fonds_b"):
+        (tmp_path / subdirectory).mkdir()
+        (tmp_path / subdirectory / "kid.pdf").write_bytes(subdirectory.encode())
+    manifest = tmp_path / "manifest.txt"
+    manifest.write_text("# KID\nfonds_a/kid.pdf\nfonds_b/kid.pdf\n", encoding="utf-8")
+    results = tmp_path / "results.jsonl"
+
+    pdf_paths = list_documents(str(manifest))
+    report = BatchPipeline(StubPipeline()).run(pdf_paths, str(results), source_dir(str(manifest)))
+    assert (report["succeeded"], report["skipped"]) == (2, 0)
+    records = [json.loads(line) for line in results.read_text(encoding="utf-8").splitlines()]
+    assert {record["file"]: record["result"]["text"] for record in records} == {
+        "fonds_a/kid.pdf": "fonds_a",
+        "fonds_b/kid.pdf": "fonds_b",
+    }
+    assert load_done(str(results)) == {"fonds_a/kid.pdf", "fonds_b/kid.pdf"}
+
+    # A rerun skips both documents
+    report = BatchPipeline(StubPipeline()).run(pdf_paths, str(results), source_dir(str(manifest)))
+    assert (report["documents"], report["skipped"]) == (0, 2)
@@ -0,0 +1,44 @@
+"""Benchmark summary and baseline comparison, failures included."""
+
+from benchmark import compare, same_level, summarize
+
+
+def run(ok=True, wall=1.0):
+    return {"ok": ok, "wall": wall, "cpu": wall, "peak_rss_mb": 100.0, "tokens_per_s": None}
+
+
+BASELINE = {"stages": summarize({
+    "a.pdf": {"parse": run(), "enrich": run(), "extract": run()},
+    "b.pdf": {"parse": run(), "enrich": run(), "extract": run()},
+})}
+
+
+def test_failed_runs_are_compared():
+    documents = {
+        "a.pdf": {"parse": run(), "enrich": run(), "extract": run()},
+        "b.pdf": {"parse": run(), "enrich": run(), "extract": run(ok=False)},
+    }
+    assert compare({"stages": summarize(documents)}, BASELINE) == ["extract.failures: 0 -> 1"]
+
+
+def test_stage_missing_from_the_report_is_a_regression():
+    # enrich fails everywhere, so extract never runs
+    documents = {name: {"parse": run(), "enrich": run(ok=False)} for name in ("a.pdf", "b.pdf")}
+    summary = summarize(documents)
+    assert summary["enrich"]["failures"] == 2 and summary["enrich"]["wall"] is None
+    assert compare({"stages": summary}, BASELINE) == [
+        "enrich.failures: 0 -> 2",
+        "extract: missing from the report (not run)",
+    ]
+
+
+def test_slower_stage_beyond_the_tolerance():
+    documents = {name: {"parse": run(wall=1.5), "enrich": run(), "extract": run()} for name in ("a.pdf", "b.pdf")}
+    regressions = compare({"stages": summarize(documents)}, BASELINE, tolerance=0.1)
+    assert [regression.split(":")[0] for regression in regressions] == ["parse.wall", "parse.cpu"]
+
+
+def test_risk_levels_compare_as_numbers():
+    assert same_level(4.0, 4) and same_level("4", 4)
+    assert not same_level(3, 4)
+    assert not same_level(None, 4) and not same_level("", 4)
@@ -0,0 +1,71 @@
+"""plan_groups: relevant passages of the markdown for each schema section."""
+
+from chunking import empty_value, plan_groups, split_sections
+
+MARKDOWN = """# Document d'informations clés
+
+Objet : ce document fournit des informations essentielles.
+
+## Produit
+
+Nom du produit : Fonds Exemple. Code ISIN : FR0000000001. Devise : EUR.
+
+## Quels sont les risques ?
+
+Indicateur de risque : classe 4 sur 7. Vous pourriez perdre tout ou partie de votre investissement.
+
+## Scénarios de performance
+
+Scénario de tensions : vous pourriez obtenir 7 000 EUR.
+
+## Que va me coûter cet investissement ?
+
+Coûts ponctuels d'entrée : 2 %. Frais de sortie : aucun.
+"""
+
+SCHEMA = {
+    "product": {"name": "str", "isin": "str"},
+    "risk": {"level": "int"},
+    "performance": {"scenarios": [{"name": "str"}], "costs": {"entry": "float"}},
+    "auditorOpinion": {"auditorName": "str"},
+}
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_each_group_gets_its_sections_in_document_order():
+    plan = plan_groups(MARKDOWN, SCHEMA, budget=1000, count_tokens=count_words)
+    assert "FR0000000001" in plan["product"]
+    assert "classe 4 sur 7" in plan["risk"]
+    assert "Indicateur" not in plan["product"]
+    # Costs are stored under performance in the schema
+    performance = plan["performance"]
+    assert "Scénario de tensions" in performance and "Coûts ponctuels" in performance
+    assert performance.index("Scénario") < performance.index("Coûts")
+
+
+def test_group_without_relevant_section_gets_nothing():
+    plan = plan_groups(MARKDOWN, SCHEMA, budget=1000, count_tokens=count_words)
+    # Unknown groups fall back to the words of their field names
+    assert plan["auditorOpinion"] == ""
+
+
+def test_budget_keeps_the_best_scored_sections():
+    sections = split_sections(MARKDOWN)
+    risk_section = next(section for section in sections if section.title.startswith("Quels sont les risques"))
+    plan = plan_groups(MARKDOWN, SCHEMA, budget=count_words(risk_section.text), count_tokens=count_words)
+    assert plan["risk"] == risk_section.text
+
+
+def test_long_sections_are_split_by_paragraph():
+    markdown = "# Titre\n\n" + "\n\n".join("paragraphe " * 50 for _ in range(4))
+    sections = split_sections(markdown, max_chars=1200)
+    assert len(sections) > 1
+    assert all(len(section.text) <= 1200 for section in sections)
+    assert all(section.title == "Titre" for section in sections)
+
+
+def test_empty_value_follows_the_template():
+    assert empty_value(SCHEMA["performance"]) == {"scenarios": [], "costs": {"entry": None}}
@@ -0,0 +1,46 @@
+"""JobScheduler: bounded parallelism, bounded queue and its counters."""
+
+import threading
+
+import pytest
+
+from jobs import JobScheduler, SchedulerFull
+
+
+def test_jobs_beyond_the_queue_are_rejected():
+    scheduler = JobScheduler(max_jobs=1, max_queued=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking_job(value):
+        started.set()
+        release.wait(5)
+        return value
+
+    running = scheduler.submit(blocking_job, "first")
+    assert started.wait(5)
+    queued = scheduler.submit(lambda: "second")
+    assert (scheduler.running, scheduler.queued) == (1, 1)
+    with pytest.raises(SchedulerFull):
+        scheduler.submit(lambda: "third")
+
+    release.set()
+    assert running.result(5) == "first"
+    assert queued.result(5) == "second"
+    assert (scheduler.running, scheduler.queued) == (0, 0)
+    # Slots are released once the jobs are done
+    assert scheduler.run(lambda: "fourth", timeout=5) == "fourth"
+    scheduler.executor.shutdown()
+
+
+def test_a_failed_job_releases_its_slot():
+    scheduler = JobScheduler(max_jobs=1, max_queued=0)
+
+    def failing_job():
+        raise RuntimeError("boom")
+
+    with pytest.raises(RuntimeError):
+        scheduler.run(failing_job, timeout=5)
+    assert scheduler.run(lambda x: x * 2, 21, timeout=5) == 42
+    assert (scheduler.running, scheduler.queued) == (0, 0)
+    scheduler.executor.shutdown()
@@ -0,0 +1,55 @@
+"""JSONStreamParser: top-level members and completion of a streamed object."""
+
+import json
+
+from json_stream import JSONStreamParser
+
+DOCUMENT = {
+    "product": {"name": "Fonds \"Exemple\", part C", "isin": "FR0000000001"},
+    "risk": {"level": 4, "warnings": ["{pas un objet}", "perte, en capital"]},
+    "dates": [],
+}
+
+
+def feed_by(parser, text, size):
+    members = []
+    for start in range(0, len(text), size):
+        members.extend(parser.feed(text[start:start + size]))
+    return members
+
+
+def test_members_are_reported_once_whatever_the_chunking():
+    text = json.dumps(DOCUMENT, ensure_ascii=False, indent=2)
+    for size in (1, 3, 7, len(text)):
+        parser = JSONStreamParser()
+        assert feed_by(parser, text, size) == list(DOCUMENT.items())
+        assert parser.complete
+
+
+def test_member_is_reported_at_its_comma():
+    parser = JSONStreamParser()
+    assert parser.feed('{"product": {"name": "A"}') == []
+    assert parser.feed(', "risk"') == [("product", {"name": "A"})]
+    assert not parser.complete
+
+
+def test_text_around_the_object_is_ignored():
+    text = 'Voici le JSON : {"risk": {"level": 3}} et un commentaire {"autre": 1}'
+    parser = JSONStreamParser()
+    assert parser.feed(text) == [("risk", {"level": 3})]
+    assert parser.complete
+    assert json.loads(text[parser.start:parser.end]) == {"risk": {"level": 3}}
+
+
+def test_truncated_object_is_not_complete():
+    parser = JSONStreamParser()
+    members = parser.feed('{"product": {"name": "A"}, "risk": {"level"')
+    assert members == [("product", {"name": "A"})]
+    assert not parser.complete
+    assert parser.end is None
+
+
+def test_empty_object():
+    parser = JSONStreamParser()
+    assert parser.feed("{}") == []
+    assert parser.complete
@@ -0,0 +1,67 @@
+"""Prometheus text rendering of the metric types and stage observations."""
+
+import pytest
+
+from metrics import Counter, Gauge, Histogram, MetricsRegistry, record_observation
+from stage_metrics import METRIC_MARKER, parse_metric_line
+
+
+def test_counter_series_by_label():
+    counter = Counter("lookups_total", "Lookups", ("outcome",))
+    counter.inc(outcome="hit")
+    counter.inc(2, outcome="hit")
+    counter.inc(outcome="miss")
+    assert counter.render() == [
+        "# HELP lookups_total Lookups",
+        "# TYPE lookups_total counter",
+        'lookups_total{outcome="hit"} 3.0',
+        'lookups_total{outcome="miss"} 1.0',
+    ]
+    with pytest.raises(ValueError):
+        counter.inc(-1, outcome="hit")
+    with pytest.raises(ValueError):
+        counter.inc(stage="parse")
+
+
+def test_gauge_reads_its_function_at_each_scrape():
+    values = iter([2, 5])
+    gauge = Gauge("queued", "Queued jobs", function=lambda: next(values))
+    assert gauge.samples() == ["queued 2.0"]
+    assert gauge.samples() == ["queued 5.0"]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = Histogram("duration_seconds", "Duration", (1, 5), ("stage",))
+    for value in (0.5, 1, 3, 10):
+        histogram.observe(value, stage="parse")
+    assert histogram.samples() == [
+        'duration_seconds_bucket{stage="parse",le="1.0"} 2',
+        'duration_seconds_bucket{stage="parse",le="5.0"} 3',
+        'duration_seconds_bucket{stage="parse",le="+Inf"} 4',
+        'duration_seconds_sum{stage="parse"} 14.5',
+        'duration_seconds_count{stage="parse"} 4',
+    ]
+
+
+def test_label_values_are_escaped():
+    counter = Counter("errors_total", "Errors", ("message",))
+    counter.inc(message='a "quoted"\\path\nline')
+    assert counter.samples() == ['errors_total{message="a \\"quoted\\"\\\\path\\nline"} 1.0']
+
+
+def test_stage_observations_reach_the_registry():
+    registry = MetricsRegistry()
+    histogram = registry.register(Histogram("kid_validation_score", "Score", (0.5, 1.0)))
+    with pytest.raises(ValueError):
+        registry.register(Histogram("kid_validation_score", "Score", (0.5, 1.0)))
+
+    observation = parse_metric_line(METRIC_MARKER + '{"name": "kid_validation_score", "value": 0.8, "labels": {}}')
+    record_observation(observation, registry)
+    # Unknown metrics and wrong labels are ignored rather than failing the job
+    record_observation({"name": "kid_unknown", "value": 1}, registry)
+    record_observation({"name": "kid_validation_score", "value": 1, "labels": {"stage": "x"}}, registry)
+
+    assert histogram.samples()[-1] == "kid_validation_score_count 1"
+    assert "kid_unknown" not in registry.render()
+    assert parse_metric_line("ligne ordinaire") is None
+    assert parse_metric_line(METRIC_MARKER + "{tronqué") is None
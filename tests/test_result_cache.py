@@ -0,0 +1,62 @@
+"""Chained cache keys: a stage key changes with its input and every earlier stage."""
+
+import pytest
+
+from result_cache import STAGE_ENVIRONMENT, ResultCache, fake_backends, stage_versions
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return ResultCache(cache_dir=str(tmp_path / "cache"))
+
+
+@pytest.fixture
+def pdf(tmp_path):
+    path = tmp_path / "document.pdf"
+    path.write_bytes(b"%PDF-1.4 document")
+    return str(path)
+
+
+def test_keys_depend_on_the_pdf_content(cache, pdf, tmp_path):
+    other = tmp_path / "other.pdf"
+    other.write_bytes(b"%PDF-1.4 autre document")
+    keys = cache.keys_for(pdf)
+    assert cache.keys_for(pdf) == keys
+    assert len(set(keys.values())) == len(keys)
+    assert all(a != b for a, b in zip(keys.values(), cache.keys_for(str(other)).values()))
+
+
+def test_a_version_change_invalidates_the_stage_and_the_following_ones(cache, pdf):
+    keys = cache.keys_for(pdf)
+
+    cache.versions["extract"] = "new prompt"
+    changed = cache.keys_for(pdf)
+    assert (changed["parse"], changed["enrich"]) == (keys["parse"], keys["enrich"])
+    assert changed["extract"] != keys["extract"]
+
+    cache.versions["parse"] = "new MinerU"
+    changed = cache.keys_for(pdf)
+    assert all(changed[stage] != keys[stage] for stage in keys)
+
+
+def test_output_settings_are_part_of_the_stage_version(monkeypatch):
+    monkeypatch.setitem(STAGE_ENVIRONMENT, "enrich", ["KID_TEST_SETTING"])
+    monkeypatch.delenv("KID_TEST_SETTING", raising=False)
+    versions = stage_versions()
+    monkeypatch.setenv("KID_TEST_SETTING", "other")
+    changed = stage_versions()
+    assert changed["enrich"] != versions["enrich"]
+    assert (changed["parse"], changed["extract"]) == (versions["parse"], versions["extract"])
+
+
+def test_fake_backends_are_detected_and_change_the_versions(monkeypatch):
+    monkeypatch.delenv("KID_VLM_BACKEND", raising=False)
+    monkeypatch.setenv("KID_LLM_BACKEND", "llama")
+    assert fake_backends() == []
+    versions = stage_versions()
+
+    monkeypatch.setenv("KID_LLM_BACKEND", "fake")
+    assert fake_backends() == ["KID_LLM_BACKEND"]
+    changed = stage_versions()
+    assert changed["extract"] != versions["extract"]
+    assert (changed["parse"], changed["enrich"]) == (versions["parse"], versions["enrich"])
@@ -0,0 +1,123 @@
+"""The compiled validator gives the feedback and score of the original one."""
+
+import json
+
+import pytest
+
+from validation_advanced import CompiledSchema, DocumentValidator, validate_document, validate_many
+
+SCHEMA = {
+    "product": {
+        "name": "str",
+        "isin": "str",
+        "currency": "str",
+        "manufacturer": {"name": "str", "website": "str"},
+    },
+    "document": {"production_date": "YYYY-MM-DD", "version": "str"},
+    "risk": {"level": "float", "warnings": ["str"]},
+    "performance": {"scenarios": [{"name": "str", "return": "float"}], "holding_period": "str"},
+}
+
+COMPLETE = {
+    "product": {
+        "name": "Fonds Exemple",
+        "isin": "FR0000000001",
+        "currency": "EUR",
+        "manufacturer": {"name": "Exemple AM", "website": "https://example.com"},
+    },
+    "document": {"production_date": "2024-01-31", "version": "1"},
+    "risk": {"level": 4, "warnings": ["Perte en capital"]},
+    "performance": {"scenarios": [{"name": "Tensions", "return": -12.5}], "holding_period": "5 ans"},
+}
+
+
+def _with(**sections):
+    document = json.loads(json.dumps(COMPLETE))
+    for section, value in sections.items():
+        if value is None:
+            del document[section]
+        else:
+            document[section] = value
+    return document
+
+
+DOCUMENTS = {
+    "complete": COMPLETE,
+    "empty": {},
+    "missing_section": _with(risk=None),
+    "missing_field": _with(document={"version": "1"}),
+    "missing_subfield": _with(product={**COMPLETE["product"], "manufacturer": {"name": "Exemple AM"}}),
+    "wrong_types": _with(
+        product={**COMPLETE["product"], "name": 12},
+        document={"production_date": 20240131, "version": "1"},
+        risk={"level": "4", "warnings": "Perte en capital"},
+    ),
+    "empty_values": _with(risk={"level": "", "warnings": []}),
+    "null_number": _with(risk={"level": None, "warnings": []}),
+    "extra_keys": {**COMPLETE, "comment": "ignored", "risk": {**COMPLETE["risk"], "extra": 1}},
+}
+
+
+def legacy_validate(schema, data):
+    """DocumentValidator.validate before the schema was compiled, as a reference."""
+    try:
+        feedback = []
+        for section in schema:
+            if section not in data:
+                feedback.append(f"Missing section: {section}")
+                continue
+            section_data = data[section]
+            for field, field_type in schema[section].items():
+                if field not in section_data:
+                    feedback.append(f"Missing field '{field}' in section '{section}'")
+                    continue
+                value = section_data[field]
+                if isinstance(field_type, dict):
+                    for subfield in field_type:
+                        if subfield not in value:
+                            feedback.append(f"Missing subfield '{subfield}' in '{section}.{field}'")
+                elif isinstance(field_type, list):
+                    if not isinstance(value, list):
+                        feedback.append(f"Field '{section}.{field}' should be a list")
+                elif field_type == "str" and not isinstance(value, str):
+                    feedback.append(f"Field '{section}.{field}' should be a string")
+                elif field_type == "float" and value is not None and not isinstance(value, (int, float)):
+                    feedback.append(f"Field '{section}.{field}' should be a number")
+                elif field_type == "YYYY-MM-DD" and not isinstance(value, str):
+                    feedback.append(f"Field '{section}.{field}' should be a date string")
+        total_fields = sum(len(section.keys()) for section in schema.values())
+        score = (total_fields - len(feedback)) / total_fields if total_fields > 0 else 0.0
+        return round(score, 2), feedback
+    except Exception as e:
+        return 0.0, [f"Validation failed: {str(e)}"]
+
+
+@pytest.mark.parametrize("name", sorted(DOCUMENTS))
+def test_same_feedback_and_score_as_legacy_validator(name):
+    result = DocumentValidator(CompiledSchema(SCHEMA)).validate(DOCUMENTS[name])
+    assert (result.score, result.feedback) == legacy_validate(SCHEMA, DOCUMENTS[name])
+
+
+def test_null_section_lists_missing_fields():
+    # The legacy validator failed as a whole on a null section (TypeError on `in None`)
+    document = {**COMPLETE, "document": None}
+    legacy_score, legacy_feedback = legacy_validate(SCHEMA, document)
+    assert legacy_score == 0.0 and legacy_feedback[0].startswith("Validation failed")
+
+    result = DocumentValidator(CompiledSchema(SCHEMA)).validate(document)
+    assert result.feedback == [
+        "Missing field 'production_date' in section 'document'",
+        "Missing field 'version' in section 'document'",
+    ]
+    assert result.score == 0.8
+
+
+def test_json_strings_are_parsed_like_dictionaries():
+    compiled = CompiledSchema(SCHEMA)
+    text = "Réponse : " + json.dumps(DOCUMENTS["wrong_types"]) + " fin"
+    from_text, from_dict = validate_many([text, DOCUMENTS["wrong_types"]], compiled)
+    assert (from_text.score, from_text.feedback) == (from_dict.score, from_dict.feedback)
+
+    unreadable = validate_document("pas de JSON", compiled)
+    assert unreadable.score == 0.0
+    assert unreadable.feedback == ["No valid JSON object found in input"]
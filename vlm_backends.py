@@ -0,0 +1,73 @@
+"""
+VLM Backends
+Interface of the image model used by process_markdown_fixed.py, and a fake
+implementation for tests and benchmarks.
+
+A backend answers a batch of PIL images either with free-text descriptions (mode
+"describe") or with a risk-level score per image (mode "risk_level"). The Qwen2-VL
+backend lives in process_markdown_fixed.py; KID_VLM_BACKEND=fake replaces it with
+FakeVLMBackend, which needs neither torch nor the model weights and answers with a
+canned response after an optional simulated latency.
+"""
+
+import os
+import time
+from typing import Any, Dict, List, Optional
+
+from PIL import Image
+
+from image_prefilter import NO_RISK_RESPONSE
+
+# "qwen" (Qwen2-VL) or "fake"
+VLM_BACKEND = os.environ.get("KID_VLM_BACKEND", "qwen")
+# Fake backend: risk level found on every image (1-7, empty for none) and seconds per image
+FAKE_RISK_LEVEL = int(os.environ.get("KID_FAKE_RISK_LEVEL") or 0) or None
+FAKE_VLM_LATENCY = float(os.environ.get("KID_FAKE_VLM_LATENCY", "0"))
+
+
+class VLMBackend:
+    """Image model answering batches of images."""
+
+    name = ""
+
+    def describe(self, images: List[Image.Image]) -> List[str]:
+        """Free-text answer to the risk-scale prompt for each image."""
+        raise NotImplementedError
+
+    def score_risk(self, images: List[Image.Image]) -> List[Dict[str, Any]]:
+        """Risk level score ({"level", "confidence"}) of each image; level is None without a scale."""
+        raise NotImplementedError
+
+
+class FakeVLMBackend(VLMBackend):
+    """Deterministic backend returning the same answer for every image.
+
+    Args:
+        description: Answer of ``describe``
+        level: Risk level returned by ``score_risk`` (None: no risk scale)
+        latency: Simulated seconds per image, to mimic the model throughput
+    """
+
+    name = "fake"
+
+    def __init__(self, description: str = NO_RISK_RESPONSE, level: Optional[int] = None,
+                 latency: float = FAKE_VLM_LATENCY):
+        self.description = description
+        self.level = level
+        self.latency = latency
+        self.calls = 0
+        self.images = 0
+
+    def _simulate(self, images: List[Image.Image]) -> None:
+        self.calls += 1
+        self.images += len(images)
+        if self.latency:
+            time.sleep(self.latency * len(images))
+
+    def describe(self, images: List[Image.Image]) -> List[str]:
+        self._simulate(images)
+        return [self.description] * len(images)
+
+    def score_risk(self, images: List[Image.Image]) -> List[Dict[str, Any]]:
+        self._simulate(images)
+        return [{"level": self.level, "confidence": 1.0} for _ in images]
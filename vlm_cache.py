@@ -0,0 +1,128 @@
+"""
+VLM Description Cache
+Persistent cache of the Qwen2-VL answers, shared across documents and across worker
+processes. Issuers reuse the same logos and risk-scale graphics in hundreds of KIDs, so
+an image already described is answered from SQLite instead of running the model.
+
+Entries are keyed by the image hash, the model id and a hash of the prompt, so a prompt
+or model change never serves stale answers. The image hash is either exact (SHA-256 of
+the decoded pixels, default) or perceptual (difference hash, also matches re-encoded
+copies). The least recently used entries are evicted beyond KID_VLM_CACHE_MAX_ENTRIES.
+"""
+
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+from PIL import Image
+
+from image_prefilter import dhash
+
+PROJECT_ROOT = os.path.dirname(os.path.abspath(__file__))
+VLM_CACHE_PATH = os.environ.get("KID_VLM_CACHE_DB", os.path.join(PROJECT_ROOT, "cache", "vlm_descriptions.db"))
+VLM_CACHE_MAX_ENTRIES = int(os.environ.get("KID_VLM_CACHE_MAX_ENTRIES", "100000"))
+# "exact" or "perceptual"
+VLM_CACHE_KEY = os.environ.get("KID_VLM_CACHE_KEY", "exact")
+
+
+def image_hash(image: Image.Image, mode: str = VLM_CACHE_KEY) -> str:
+    """Hash of an image content, independent of its file name and container metadata."""
+    if mode == "perceptual":
+        return f"d{dhash(image):016x}"
+    digest = hashlib.sha256(f"{image.mode}:{image.size}".encode())
+    digest.update(image.tobytes())
+    return digest.hexdigest()
+
+
+def prompt_version(prompt: str, **generation_params) -> str:
+    """Short fingerprint of a prompt and its generation parameters."""
+    params = ",".join(f"{key}={value}" for key, value in sorted(generation_params.items()))
+    return hashlib.sha256(f"{prompt}\n{params}".encode()).hexdigest()[:16]
+
+
+class DescriptionCache:
+    """SQLite cache from (image hash, model id, prompt version) to the VLM answer."""
+
+    def __init__(self, model_id: str, prompt_version: str, db_path: str = VLM_CACHE_PATH,
+                 max_entries: int = VLM_CACHE_MAX_ENTRIES, key_mode: str = VLM_CACHE_KEY):
+        self.model_id = model_id
+        self.prompt_version = prompt_version
+        self.db_path = db_path
+        self.max_entries = max_entries
+        self.key_mode = key_mode
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS descriptions ("
+                "image_hash TEXT NOT NULL, model_id TEXT NOT NULL, prompt_version TEXT NOT NULL, "
+                "description TEXT NOT NULL, last_access REAL NOT NULL, "
+                "PRIMARY KEY (image_hash, model_id, prompt_version))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_descriptions_access ON descriptions (last_access)")
+
+    @contextmanager
+    def _connect(self) -> Iterator[sqlite3.Connection]:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def key(self, image: Image.Image) -> str:
+        return image_hash(image, self.key_mode)
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached answer for an image hash, or None."""
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT description FROM descriptions WHERE image_hash = ? AND model_id = ? AND prompt_version = ?",
+                (key, self.model_id, self.prompt_version),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE descriptions SET last_access = ? "
+                    "WHERE image_hash = ? AND model_id = ? AND prompt_version = ?",
+                    (time.time(), key, self.model_id, self.prompt_version),
+                )
+        with self._lock:
+            if row is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return row[0] if row is not None else None
+
+    def put(self, key: str, description: str) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO descriptions "
+                "(image_hash, model_id, prompt_version, description, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, self.model_id, self.prompt_version, description, time.time()),
+            )
+            count = conn.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+            if count > self.max_entries:
+                conn.execute(
+                    "DELETE FROM descriptions WHERE rowid IN "
+                    "(SELECT rowid FROM descriptions ORDER BY last_access LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+    def stats(self) -> Dict[str, object]:
+        with self._connect() as conn:
+            entries = conn.execute("SELECT COUNT(*) FROM descriptions").fetchone()[0]
+        lookups = self.hits + self.misses
+        return {
+            "entries": entries,
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+        }